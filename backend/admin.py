@@ -13,7 +13,7 @@ from backend.models import User, VideoOrder, Transaction, AIModel, SystemConfig,
 from backend.auth import get_password_hash, verify_password, create_access_token, SECRET_KEY, ALGORITHM
 from backend.security import (
     is_ip_banned, get_ban_remaining_seconds, get_fail_count,
-    record_fail, record_success
+    record_fail, record_success, ip_state
 )
 from backend.account_store import account_store
 from jose import JWTError, jwt
@@ -595,6 +595,7 @@ def unban_ip(ip: str, admin=Depends(get_admin_user), session: Session = Depends(
         print(f"[ADMIN] 重置失败计数: {ip}")
     
     session.commit()
+    ip_state.reload_ip(ip)
     return {"message": f"已解除 {ip} 的封禁", "success": True}
 
 
@@ -628,6 +629,7 @@ def manual_ban_ip(
         session.add(new_ban)
     
     session.commit()
+    ip_state.reload_ip(data.ip)
     print(f"[ADMIN] 手动封禁IP: {data.ip}, 时长: {data.duration_hours}小时, 原因: {data.reason}")
     return {
         "message": f"已封禁 IP {data.ip}",
@@ -693,6 +695,7 @@ def create_test_security_data(admin=Depends(get_admin_user), session: Session =
             created_failures += 1
     
     session.commit()
+    ip_state.load()
     
     return {
         "message": "测试数据创建完成",
@@ -59,6 +59,13 @@ def list_accounts(admin=Depends(get_admin_user)):
     return list(status["accounts"].values())
 
 
+@router.get("/client-pool")
+def get_client_pool_stats(admin=Depends(get_admin_user)):
+    """海螺客户端连接池统计（连接数、复用率）"""
+    from backend.hailuo_api import client_pool
+    return client_pool.stats()
+
+
 @router.get("/list")
 def list_accounts_alias(admin=Depends(get_admin_user)):
     """/list 别名，兼容旧前端"""
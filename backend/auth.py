@@ -1,15 +1,31 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from collections import OrderedDict
 import bcrypt
-from jose import jwt
+from jose import JWTError, jwt
 import os
 import secrets
+import threading
+import time
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session, select
+
+from backend.models import User, get_session, run_in_session
 
 # 从环境变量读取JWT配置，使用强随机默认值
 SECRET_KEY = os.getenv("SECRET_KEY", secrets.token_urlsafe(64))
 ALGORITHM = "HS256"
 # 缩短Token过期时间至24小时，提高安全性
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("TOKEN_EXPIRE_HOURS", "24")) * 60
+# 已认证用户缓存：TTL（秒，0 关闭缓存）与最多缓存的用户数
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "10"))
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", "10000"))
+
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """验证密码是否正确"""
@@ -51,6 +67,143 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+def user_token_claims(user: User, **extra) -> dict:
+    """用户 token 的载荷：sub 为用户名，uid 为用户 ID（鉴权缓存按 ID 命中）"""
+    return {"sub": user.username, "uid": user.id, **extra}
+
+
+# ============ 已认证用户解析（带缓存） ============
+
+class UserCache:
+    """
+    按用户 ID 缓存已脱离会话的 User 行，短 TTL
+    本进程内 User 行被修改/删除时通过 ORM 事件立即失效；多 worker 时其他进程的修改最多滞后一个 TTL，
+    因此涉及余额的接口仍需在事务内重新读取用户行（session.refresh）。
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL, max_entries: int = AUTH_CACHE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._users: "OrderedDict[int, tuple[float, User]]" = OrderedDict()
+        self._ids_by_name: dict[str, int] = {}  # 旧 token 只带用户名
+        self._hits = 0
+        self._misses = 0
+        self._invalidations = 0
+
+    def get(self, user_id: Optional[int]) -> Optional[User]:
+        if user_id is None or self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or entry[0] <= time.monotonic():
+                self._misses += 1
+                return None
+            self._users.move_to_end(user_id)
+            self._hits += 1
+            return entry[1]
+
+    def id_for(self, username: str) -> Optional[int]:
+        with self._lock:
+            return self._ids_by_name.get(username)
+
+    def put(self, user: User):
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._users[user.id] = (time.monotonic() + self.ttl, user)
+            self._users.move_to_end(user.id)
+            self._ids_by_name[user.username] = user.id
+            while len(self._users) > self.max_entries:
+                _, (_, evicted) = self._users.popitem(last=False)
+                self._ids_by_name.pop(evicted.username, None)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if entry is not None:
+                self._ids_by_name.pop(entry[1].username, None)
+                self._invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._ids_by_name.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._users),
+                "ttl": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hit_rate": round(self._hits / total, 3) if total else 0,
+                "invalidations": self._invalidations,
+            }
+
+
+# 全局单例
+user_cache = UserCache()
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _collect_changed_users(session, flush_context):
+    """User 行写入数据库时立即失效，提交后再失效一次（防止提交前被其他请求读到旧值重新缓存）"""
+    changed = {obj.id for obj in session.dirty | session.deleted if isinstance(obj, User) and obj.id is not None}
+    if changed:
+        for user_id in changed:
+            user_cache.invalidate(user_id)
+        session.info.setdefault("changed_user_ids", set()).update(changed)
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _invalidate_changed_users(session):
+    for user_id in session.info.pop("changed_user_ids", ()):
+        user_cache.invalidate(user_id)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_changed_users(session):
+    session.info.pop("changed_user_ids", None)
+
+
+def _load_user(session: Session, user_id: Optional[int], username: str) -> Optional[User]:
+    if user_id is not None:
+        return session.get(User, user_id)
+    return session.exec(select(User).where(User.username == username)).first()
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)) -> User:
+    """
+    各路由模块共用的登录用户依赖
+    缓存命中时不查库；返回的 User 已挂到本次请求的会话上，可以直接 add/refresh。
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+
+    user_id = payload.get("uid") or user_cache.id_for(username)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await run_in_session(_load_user, user_id, username)
+        if user is None:
+            raise credentials_exception
+        user_cache.put(user)
+    if user.username != username:
+        raise credentials_exception
+    return session.merge(user, load=False)
+
+
 def generate_invite_code() -> str:
     """生成唯一的邀请码（6位大写字母+数字）"""
     import random
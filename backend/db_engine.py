@@ -0,0 +1,229 @@
+"""
+数据库引擎工厂
+SQLite 默认配置（回滚日志、无 busy_timeout）下，后台轮询、生成任务、支付回调和 API 请求并发写入时
+高峰期会直接报 "database is locked"。这里统一创建引擎：每个新连接通过 connect 事件设置
+WAL / synchronous=NORMAL / busy_timeout / mmap / cache_size / temp_store，使用固定大小的连接池，
+并统计写语句耗时与锁冲突次数，供管理后台查看。
+
+所有参数都可通过环境变量调整：
+  SQLITE_BUSY_TIMEOUT_MS  等待写锁的最长时间（毫秒，默认 5000）
+  SQLITE_CACHE_SIZE_MB    每个连接的页缓存（默认 64）
+  SQLITE_MMAP_SIZE_MB     内存映射读取的大小（默认 256，0 关闭）
+  SQLITE_SYNCHRONOUS      NORMAL / FULL（WAL 下 NORMAL 不会损坏数据库，只可能丢最后一次提交）
+  DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT  连接池大小、溢出上限、取连接超时（秒）
+  DB_SLOW_WRITE_MS        超过该耗时的写语句计为一次“锁等待”（默认 100）
+
+异步引擎：同一个 URL 换成异步驱动（sqlite+aiosqlite / postgresql+asyncpg），
+驱动未安装时返回 None，调用方退回到线程池执行同步会话。
+"""
+import logging
+import os
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlmodel import create_engine
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+CACHE_SIZE_MB = int(os.getenv("SQLITE_CACHE_SIZE_MB", "64"))
+MMAP_SIZE_MB = int(os.getenv("SQLITE_MMAP_SIZE_MB", "256"))
+SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL").upper()
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+SLOW_WRITE_MS = float(os.getenv("DB_SLOW_WRITE_MS", "100"))
+
+_WRITE_PREFIXES = ("INSERT", "UPDATE", "DELETE", "REPLACE")
+# SQLite busy 超时 / PostgreSQL 锁超时与死锁
+_LOCK_ERRORS = ("database is locked", "lock timeout", "deadlock detected")
+
+# 同步驱动 -> 异步驱动
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+class DBMetrics:
+    """写语句耗时与锁冲突统计（busy_timeout 内的等待体现为写语句变慢，超时则为 locked 错误）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.write_total_ms = 0.0
+        self.write_max_ms = 0.0
+        self.slow_writes = 0
+        self.locked_errors = 0
+        self.connections_opened = 0
+
+    def record_write(self, elapsed_ms: float):
+        with self._lock:
+            self.writes += 1
+            self.write_total_ms += elapsed_ms
+            if elapsed_ms > self.write_max_ms:
+                self.write_max_ms = elapsed_ms
+            if elapsed_ms >= SLOW_WRITE_MS:
+                self.slow_writes += 1
+
+    def record_connect(self):
+        with self._lock:
+            self.connections_opened += 1
+
+    def record_locked(self):
+        with self._lock:
+            self.locked_errors += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "writes": self.writes,
+                "avg_write_ms": round(self.write_total_ms / self.writes, 2) if self.writes else 0,
+                "max_write_ms": round(self.write_max_ms, 2),
+                "slow_writes": self.slow_writes,
+                "slow_write_threshold_ms": SLOW_WRITE_MS,
+                "locked_errors": self.locked_errors,
+                "connections_opened": self.connections_opened,
+            }
+
+
+# 全局单例
+db_metrics = DBMetrics()
+
+
+def _apply_sqlite_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA cache_size=-{CACHE_SIZE_MB * 1024}")
+        cursor.execute(f"PRAGMA mmap_size={MMAP_SIZE_MB * 1024 * 1024}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cursor.close()
+    db_metrics.record_connect()
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_start"].pop()
+    if statement.lstrip()[:7].upper().startswith(_WRITE_PREFIXES):
+        db_metrics.record_write((time.perf_counter() - started) * 1000)
+
+
+def _handle_error(exception_context):
+    stack = exception_context.connection.info.get("query_start") if exception_context.connection else None
+    if stack:
+        stack.pop()
+    if isinstance(exception_context.sqlalchemy_exception, OperationalError) and \
+            any(m in str(exception_context.original_exception) for m in _LOCK_ERRORS):
+        db_metrics.record_locked()
+        logger.warning(f"[db] 锁等待失败: {exception_context.statement[:80] if exception_context.statement else ''}")
+
+
+def create_db_engine(url: str) -> Engine:
+    """按 URL 创建引擎；SQLite 文件库启用 WAL 与调优参数，并挂上耗时/锁冲突统计"""
+    if url.startswith("sqlite"):
+        engine = create_engine(
+            url,
+            connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000},
+            poolclass=QueuePool,
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+        )
+        event.listen(engine, "connect", _apply_sqlite_pragmas)
+    else:
+        engine = create_engine(
+            url,
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_timeout=POOL_TIMEOUT,
+            pool_pre_ping=True,
+        )
+    event.listen(engine, "before_cursor_execute", _before_execute)
+    event.listen(engine, "after_cursor_execute", _after_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    return engine
+
+
+def normalize_url(url: str) -> str:
+    """postgres:// 是很多托管服务给出的写法，SQLAlchemy 只认 postgresql://"""
+    if url.startswith("postgres://"):
+        return "postgresql://" + url[len("postgres://"):]
+    return url
+
+
+def to_async_url(url: str) -> Optional[str]:
+    """同步 URL 换成对应的异步驱动；不认识的方言返回 None"""
+    scheme, sep, rest = url.partition("://")
+    dialect = scheme.split("+", 1)[0]
+    driver = _ASYNC_DRIVERS.get(dialect)
+    return f"{driver}{sep}{rest}" if driver else None
+
+
+def create_async_db_engine(url: str):
+    """创建异步引擎；异步驱动未安装时返回 None"""
+    async_url = to_async_url(url)
+    if not async_url:
+        return None
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        if async_url.startswith("sqlite"):
+            engine = create_async_engine(
+                async_url,
+                connect_args={"timeout": BUSY_TIMEOUT_MS / 1000},
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+                pool_timeout=POOL_TIMEOUT,
+                poolclass=AsyncAdaptedQueuePool,
+            )
+            event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+        else:
+            engine = create_async_engine(
+                async_url,
+                pool_size=POOL_SIZE,
+                max_overflow=MAX_OVERFLOW,
+                pool_timeout=POOL_TIMEOUT,
+                pool_pre_ping=True,
+            )
+    except ImportError as e:
+        logger.info(f"[db] 未安装异步驱动（{e}），异步代码通过线程池访问数据库")
+        return None
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+    return engine
+
+
+def engine_stats(engine: Engine, async_engine=None) -> dict:
+    """连接池占用、SQLite 当前生效的参数与锁等待统计"""
+    pool = engine.pool
+    stats = {
+        "dialect": engine.dialect.name,
+        "async_driver": async_engine.dialect.driver if async_engine is not None else None,
+        "pool": {
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "timeout": POOL_TIMEOUT,
+        },
+        **db_metrics.snapshot(),
+    }
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            stats["pragmas"] = {
+                name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()
+                for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store")
+            }
+    return stats
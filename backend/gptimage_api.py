@@ -2,58 +2,28 @@
 GPT Image 2 文生图 API
 调用 NOVART 平台异步任务接口 (/v1/images/generations?async=1)
 """
-import asyncio
-import base64
 import json
 import os
 import time
-import threading
 import httpx
-from collections import deque
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from typing import Optional, List
 from sqlmodel import Session, select
 from pydantic import BaseModel
-from jose import jwt, JWTError
-from datetime import datetime
+from datetime import datetime, timezone
 
-from backend.models import User, GptimageOrder, AIModel, Transaction, engine
-from backend.auth import SECRET_KEY, ALGORITHM
+from backend.models import User, GptimageOrder, AIModel, Transaction, get_session, run_in_session
+from backend.auth import get_current_user
 from backend.logger import app_logger
+from backend.poll_schedule import generation_stats, gptimage_order_key
+from backend.order_events import order_events
+from backend.progress_buffer import progress_buffer
+from backend.novart_limiter import novart_limiter
+from backend.gptimage_scheduler import gptimage_scheduler, user_weight
+from backend.ref_assets import ref_asset_cache
 
 router = APIRouter(prefix="/api/gptimage", tags=["gptimage"])
 
-# ============ 全局速率限制器 ============
-# NOVART API 限制：每秒 ≤4 请求，每分钟 ≤20 请求
-_rate_lock = threading.Lock()
-_second_timestamps: deque = deque()   # 最近 1 秒内的请求时间戳
-_minute_timestamps: deque = deque()   # 最近 60 秒内的请求时间戳
-
-MAX_PER_SECOND = 3   # 保守值，留余量
-MAX_PER_MINUTE = 18  # 保守值，留余量
-
-
-def _wait_for_rate_limit():
-    """阻塞等待直到满足速率限制，然后记录本次请求"""
-    while True:
-        with _rate_lock:
-            now = time.monotonic()
-            # 清理过期记录
-            while _second_timestamps and now - _second_timestamps[0] > 1.0:
-                _second_timestamps.popleft()
-            while _minute_timestamps and now - _minute_timestamps[0] > 60.0:
-                _minute_timestamps.popleft()
-            # 检查是否可以发送
-            if len(_second_timestamps) < MAX_PER_SECOND and len(_minute_timestamps) < MAX_PER_MINUTE:
-                _second_timestamps.append(now)
-                _minute_timestamps.append(now)
-                return
-        # 等待后重试
-        time.sleep(0.35)
-
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
 # ============ NOVART 配置 ============
 
 # 质量到分辨率映射
@@ -63,60 +33,33 @@ QUALITY_RESOLUTION_MAP = {
     "ultra": "4k",
 }
 
-# 轮询配置
+# 轮询配置（每个 gptimage_poll 任务只检查一次，按下列间隔重新排队）
 POLL_INTERVAL_QUEUED = 3   # QUEUED 状态每 3 秒轮询
 POLL_INTERVAL_RUNNING = 4  # RUNNING 状态每 4 秒轮询
-POLL_MAX_ATTEMPTS = 150    # 最多轮询 150 次（约 10 分钟）
+POLL_MAX_SECONDS = 600     # 自任务创建起的轮询总时长上限
 
 
-def _get_novart_config() -> tuple:
-    """从数据库读取 NOVART 配置，回退到环境变量"""
+def _read_novart_config(session: Session) -> dict:
     from backend.models import SystemConfig
+    rows = session.exec(
+        select(SystemConfig).where(SystemConfig.key.in_(("novart_api_key", "novart_base_url")))
+    ).all()
+    return {row.key: json.loads(row.value) for row in rows}
+
+
+async def _get_novart_config() -> tuple:
+    """从数据库读取 NOVART 配置，回退到环境变量"""
     api_key = os.getenv("NOVART_API_KEY", "")
     base_url = os.getenv("NOVART_BASE_URL", "https://www.novartspace.art")
     try:
-        with Session(engine) as session:
-            key_cfg = session.exec(
-                select(SystemConfig).where(SystemConfig.key == "novart_api_key")
-            ).first()
-            if key_cfg:
-                val = json.loads(key_cfg.value)
-                if val:
-                    api_key = val
-            url_cfg = session.exec(
-                select(SystemConfig).where(SystemConfig.key == "novart_base_url")
-            ).first()
-            if url_cfg:
-                val = json.loads(url_cfg.value)
-                if val:
-                    base_url = val
+        config = await run_in_session(_read_novart_config)
+        api_key = config.get("novart_api_key") or api_key
+        base_url = config.get("novart_base_url") or base_url
     except Exception:
         pass
     return api_key, base_url
 
 
-def get_session():
-    with Session(engine) as session:
-        yield session
-
-
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = session.exec(select(User).where(User.username == username)).first()
-    if user is None:
-        raise credentials_exception
-    return user
 
 
 # ============ 模型列表 ============
@@ -217,7 +160,7 @@ async def create_gptimage_order(
 
     count = max(1, min(count, 10))
 
-    novart_api_key, _ = _get_novart_config()
+    novart_api_key, _ = await _get_novart_config()
     if not novart_api_key:
         raise HTTPException(status_code=503, detail="GPT Image 服务未配置 API Key，请联系管理员")
 
@@ -229,6 +172,8 @@ async def create_gptimage_order(
     total_price = round(unit_price * count, 2)
 
     # GPT Image 只能使用充值余额（paid_balance），赠送余额不可用
+    # 鉴权用户可能来自缓存，扣费前在本事务内重新读取用户行（PostgreSQL 下加行锁）
+    session.refresh(current_user, with_for_update=True)
     user_paid = current_user.paid_balance or 0
     if user_paid < total_price:
         raise HTTPException(
@@ -236,22 +181,10 @@ async def create_gptimage_order(
             detail=f"充值余额不足，{count}张需要 ¥{total_price}，当前充值余额 ¥{user_paid:.2f}（赠送余额不可用于 GPT Image）"
         )
 
-    # 处理参考图 → 转为 data URL（所有订单共用同一张参考图）
+    # 保存参考图（按内容去重，所有订单共用；生成时由 ref_asset_cache 转为 data URL）
     ref_image_path = None
-    ref_data_url = None
     if ref_image and ref_image.filename:
-        import uuid as _uuid
-        ext = ref_image.filename.split(".")[-1] if "." in ref_image.filename else "jpg"
-        tmp_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads", "gptimage")
-        os.makedirs(tmp_dir, exist_ok=True)
-        ref_image_path = os.path.join(tmp_dir, f"{_uuid.uuid4().hex[:12]}.{ext}")
-        content = await ref_image.read()
-        with open(ref_image_path, "wb") as f:
-            f.write(content)
-        mime_map = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
-        mime_type = mime_map.get(ext.lower(), "image/png")
-        b64 = base64.b64encode(content).decode("utf-8")
-        ref_data_url = f"data:{mime_type};base64,{b64}"
+        ref_image_path = await ref_asset_cache.save_upload(ref_image)
 
     # 一次性扣费（总价）：从充值余额和总余额同时扣减
     current_user.paid_balance = (current_user.paid_balance or 0) - total_price
@@ -289,83 +222,133 @@ async def create_gptimage_order(
         f"[GPTImage] 批量创建 {count} 个订单 {order_ids} by user {current_user.username}, model={model}"
     )
 
-    # 为每个订单启动后台生成线程（速率限制器保证不超限）
-    for oid in order_ids:
-        threading.Thread(
-            target=_run_generation_task,
-            args=(oid, ref_data_url),
-            daemon=True,
-        ).start()
+    # 交给公平调度器排队，按用户轮流放行到 job_queue 的 gptimage worker 池
+    gptimage_scheduler.submit(current_user.id, order_ids, user_weight(current_user.paid_balance))
+    queue = gptimage_scheduler.estimate(current_user.id)
 
     return {
         "message": f"已提交 {count} 张图片生成任务",
         "order_ids": order_ids,
         "total_cost": total_price,
+        "queue_position": queue["orders"][0]["position"] if queue["orders"] else 0,
+        "expected_wait": queue["next_wait"],
     }
 
 
+@router.get("/queue")
+async def get_gptimage_queue(current_user: User = Depends(get_current_user)):
+    """当前用户排队中的订单及预计开始时间"""
+    return gptimage_scheduler.estimate(current_user.id)
+
+
 # ============ NOVART 异步任务 API ============
-def _run_generation_task(order_id: int, ref_data_url: str = None):
-    """在后台线程中执行生图任务"""
+# gptimage_generate 只负责创建 NOVART 任务并保存 task_id，之后转为 gptimage_poll：
+# 每次只查询一次任务状态，未结束时返回下次查询的等待秒数由 job_queue 重新排队，不占用 worker 等待生成。
+
+async def generate_image(order_id: int):
+    """由 job_queue 的 gptimage worker 调用；无论是否提交成功都归还调度器的放行名额"""
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(_generate_image_async(order_id, ref_data_url))
-    except Exception as e:
-        app_logger.error(f"[GPTImage] 任务线程异常 order#{order_id}: {e}")
-        _update_order_status(order_id, "failed", error_message=str(e))
-        _refund_order(order_id)
+        await _create_task(order_id)
     finally:
-        loop.close()
+        gptimage_scheduler.mark_submitted(order_id)
 
 
-async def _generate_image_async(order_id: int, ref_data_url: str = None):
-    """使用 NOVART 异步任务 API 生成图片：创建任务 → 轮询状态 → 获取结果"""
-    with Session(engine) as session:
-        order = session.get(GptimageOrder, order_id)
-        if not order:
-            return
+def _start_order(session: Session, order_id: int) -> Optional[GptimageOrder]:
+    """读取待生成订单；尚未提交过的标记为 processing。已结束的订单返回 None"""
+    order = session.get(GptimageOrder, order_id)
+    if not order or order.status in ("completed", "failed"):
+        return None
+    if not order.task_id:
         order.status = "processing"
         order.progress = 10
         session.add(order)
         session.commit()
-        # 缓存订单信息
-        model_name = order.model_name
-        prompt = order.prompt
-        ratio = order.ratio
-        quality = order.quality
+    return order
+
 
-    novart_api_key, novart_base_url = _get_novart_config()
+def _get_order(session: Session, order_id: int) -> Optional[GptimageOrder]:
+    return session.get(GptimageOrder, order_id)
+
+
+def _save_order_fields(session: Session, order_id: int, fields: dict):
+    order = session.get(GptimageOrder, order_id)
+    if not order:
+        return
+    for key, value in fields.items():
+        setattr(order, key, value)
+    session.add(order)
+    session.commit()
+
+
+def _poll_delay(order: GptimageOrder, task_status: str) -> float:
+    """动态轮询间隔：按该模型历史耗时分布自适应，无统计时按任务状态取固定值"""
+    default_interval = POLL_INTERVAL_QUEUED if task_status == "QUEUED" else POLL_INTERVAL_RUNNING
+    elapsed = (datetime.utcnow() - order.created_at).total_seconds() if order.created_at else 0
+    return generation_stats.next_interval(gptimage_order_key(order.model_name, order.quality), elapsed, default_interval)
+
+
+async def _enqueue_poll(order: GptimageOrder, task_status: str, started_at: Optional[float] = None):
+    """started_at 为任务创建时间；缺失时（重新领取已提交的订单）轮询时长按订单创建时间计算"""
+    from backend.job_queue import job_queue
+    await job_queue.enqueue(
+        "gptimage_poll", order.id,
+        {"started_at": started_at} if started_at else None,
+        delay=_poll_delay(order, task_status),
+    )
+
+
+async def _fail_order(order_id: int, error_message: str):
+    await _update_order_status(order_id, "failed", error_message=error_message)
+    await _refund_order(order_id)
+
+
+async def _create_task(order_id: int):
+    """创建 NOVART 异步任务，task_id 一拿到就落库，然后转入 gptimage_poll
+
+    订单已有 task_id（重启后重新领取）时不再创建，直接补入轮询任务
+    """
+    order = await run_in_session(_start_order, order_id)
+    if not order:
+        return
+    if order.task_id:
+        app_logger.info(f"[GPTImage] 恢复轮询 order#{order_id}, task_id={order.task_id}")
+        await _enqueue_poll(order, "RUNNING")
+        return
+    order_events.publish(order.user_id, "gptimage", order_id, status="processing", progress=10)
+
+    novart_api_key, novart_base_url = await _get_novart_config()
     if not novart_api_key:
-        _update_order_status(order_id, "failed", error_message="API Key 未配置")
-        _refund_order(order_id)
+        await _fail_order(order_id, "API Key 未配置")
         return
 
-    app_logger.info(f"[GPTImage] 开始生成 order#{order_id}, model={model_name}")
+    headers = {
+        "Authorization": f"Bearer {novart_api_key}",
+        "Content-Type": "application/json",
+    }
 
     try:
-        resolution = QUALITY_RESOLUTION_MAP.get(quality, "2k")
+        app_logger.info(f"[GPTImage] 开始生成 order#{order_id}, model={order.model_name}")
+        resolution = QUALITY_RESOLUTION_MAP.get(order.quality, "2k")
 
         # 构建异步任务请求体
         reference_images = []
+        ref_data_url = await ref_asset_cache.data_url(order.ref_image_path)
         if ref_data_url:
             reference_images.append(ref_data_url)
 
         payload = {
-            "model": model_name,
-            "prompt": prompt,
+            "model": order.model_name,
+            "prompt": order.prompt,
             "resolution": resolution,
-            "aspect_ratio": ratio,
+            "aspect_ratio": order.ratio,
             "reference_images": reference_images,
         }
 
-        headers = {
-            "Authorization": f"Bearer {novart_api_key}",
-            "Content-Type": "application/json",
-        }
-
-        # Step 1: 创建异步任务（等待速率限制窗口）
-        _wait_for_rate_limit()
+        # 创建异步任务（等待速率限制窗口）
+        waited = await novart_limiter.acquire()
+        gptimage_scheduler.mark_submitted(order_id)
+        if waited:
+            app_logger.info(f"[GPTImage] order#{order_id} 等待速率许可 {waited:.1f}s")
         create_url = f"{novart_base_url}/v1/images/generations?async=1"
 
         async with httpx.AsyncClient(timeout=30) as client:
@@ -374,107 +357,96 @@ async def _generate_image_async(order_id: int, ref_data_url: str = None):
         if resp.status_code != 200:
             error_text = resp.text[:500]
             app_logger.error(f"[GPTImage] 创建任务失败 {resp.status_code}: {error_text}")
-            _update_order_status(order_id, "failed", error_message=f"创建任务失败: {error_text[:200]}")
-            _refund_order(order_id)
+            await _fail_order(order_id, f"创建任务失败: {error_text[:200]}")
             return
 
         create_data = resp.json()
         if not create_data.get("ok"):
             err_msg = create_data.get("error", {}).get("message", "创建任务返回失败")
-            _update_order_status(order_id, "failed", error_message=err_msg)
-            _refund_order(order_id)
+            await _fail_order(order_id, err_msg)
             return
 
         task_id = create_data["data"]["task_id"]
         task_status = create_data["data"].get("status", "QUEUED")
-
-        # 保存 task_id 到订单
-        with Session(engine) as session:
-            order = session.get(GptimageOrder, order_id)
-            order.task_id = str(task_id)
-            order.status = "generating"
-            order.progress = 20
-            session.add(order)
-            session.commit()
-
-        app_logger.info(f"[GPTImage] 任务已创建 order#{order_id}, task_id={task_id}, status={task_status}")
-
-        # Step 2: 轮询任务状态
-        poll_url = f"{novart_base_url}/v1/images/{task_id}"
-        image_url = None
-
-        for attempt in range(POLL_MAX_ATTEMPTS):
-            # 动态轮询间隔
-            interval = POLL_INTERVAL_QUEUED if task_status == "QUEUED" else POLL_INTERVAL_RUNNING
-            await asyncio.sleep(interval)
-
-            try:
-                async with httpx.AsyncClient(timeout=15) as client:
-                    poll_resp = await client.get(poll_url, headers=headers)
-
-                if poll_resp.status_code != 200:
-                    app_logger.warning(f"[GPTImage] 轮询异常 {poll_resp.status_code}, 继续...")
-                    continue
-
-                poll_data = poll_resp.json()
-                if not poll_data.get("ok"):
-                    continue
-
-                task = poll_data["data"]
-                task_status = task.get("status", "UNKNOWN")
-
-                # 更新进度
-                progress = 20 + min(attempt * 2, 70)  # 20 → 90
-                _update_order_progress(order_id, progress)
-
-                if task_status == "SUCCESS":
-                    results = task.get("results", [])
-                    if results:
-                        # 优先用 signed_download_url（前端可直接展示），否则用 download_url
-                        image_url = results[0].get("signed_download_url") or results[0].get("download_url")
-                    break
-
-                if task_status in ("FAILED", "CANCELLED"):
-                    err_msg = task.get("error", {}).get("message", f"任务{task_status}")
-                    app_logger.error(f"[GPTImage] 任务失败 order#{order_id}: {err_msg}")
-                    _update_order_status(order_id, "failed", error_message=err_msg)
-                    _refund_order(order_id)
-                    return
-
-            except httpx.TimeoutException:
-                app_logger.warning(f"[GPTImage] 轮询超时 attempt={attempt}, 继续...")
-                continue
-            except Exception as poll_err:
-                app_logger.warning(f"[GPTImage] 轮询异常: {poll_err}, 继续...")
-                continue
-        else:
-            # 超过最大轮询次数
-            app_logger.error(f"[GPTImage] 轮询超时 order#{order_id}, 已达最大次数")
-            _update_order_status(order_id, "failed", error_message="生成超时，请重试")
-            _refund_order(order_id)
-            return
-
-        if not image_url:
-            _update_order_status(order_id, "failed", error_message="任务完成但未返回图片")
-            _refund_order(order_id)
-            return
-
-        # Step 3: 完成
-        with Session(engine) as session:
-            order = session.get(GptimageOrder, order_id)
-            order.status = "completed"
-            order.progress = 100
-            order.image_url = image_url
-            order.completed_at = datetime.utcnow()
-            session.add(order)
-            session.commit()
-
-        app_logger.info(f"[GPTImage] 生成完成 order#{order_id}, url={image_url[:100]}...")
-
     except Exception as e:
-        app_logger.error(f"[GPTImage] 生成失败 order#{order_id}: {e}", exc_info=True)
-        _update_order_status(order_id, "failed", error_message=str(e)[:200])
-        _refund_order(order_id)
+        app_logger.error(f"[GPTImage] 创建任务失败 order#{order_id}: {e}", exc_info=True)
+        await _fail_order(order_id, str(e)[:200])
+        return
+
+    # 任务已在 NOVART 计费：先保存 task_id，再做其他事，之后任何重试都只会续轮询而不会重复创建
+    await run_in_session(_save_order_fields, order_id, {
+        "task_id": str(task_id), "status": "generating", "progress": 20,
+    })
+    order_events.publish(order.user_id, "gptimage", order_id, status="generating", progress=20)
+    app_logger.info(f"[GPTImage] 任务已创建 order#{order_id}, task_id={task_id}, status={task_status}")
+    await _enqueue_poll(order, task_status, time.time())
+
+
+async def poll_gptimage_order(order_id: int, started_at: Optional[float] = None) -> Optional[float]:
+    """查询一次 NOVART 任务状态，未结束时返回下次查询前的等待秒数"""
+    order = await run_in_session(_get_order, order_id)
+    if not order or order.status in ("completed", "failed") or not order.task_id:
+        return None
+    if started_at is None and order.created_at:
+        started_at = order.created_at.replace(tzinfo=timezone.utc).timestamp()
+    elapsed = time.time() - (started_at or time.time())
+    if elapsed >= POLL_MAX_SECONDS:
+        app_logger.error(f"[GPTImage] 轮询超时 order#{order_id}")
+        await _fail_order(order_id, "生成超时，请重试")
+        return None
+
+    novart_api_key, novart_base_url = await _get_novart_config()
+    headers = {"Authorization": f"Bearer {novart_api_key}"}
+    poll_url = f"{novart_base_url}/v1/images/{order.task_id}"
+    task_status = "RUNNING"
+    try:
+        async with httpx.AsyncClient(timeout=15) as client:
+            poll_resp = await client.get(poll_url, headers=headers)
+        if poll_resp.status_code != 200:
+            app_logger.warning(f"[GPTImage] 轮询异常 {poll_resp.status_code}, 继续...")
+            return _poll_delay(order, task_status)
+        poll_data = poll_resp.json()
+        if not poll_data.get("ok"):
+            return _poll_delay(order, task_status)
+        task = poll_data["data"]
+        task_status = task.get("status", "UNKNOWN")
+    except httpx.TimeoutException:
+        app_logger.warning(f"[GPTImage] 轮询超时 order#{order_id}, 继续...")
+        return _poll_delay(order, task_status)
+    except Exception as poll_err:
+        app_logger.warning(f"[GPTImage] 轮询异常: {poll_err}, 继续...")
+        return _poll_delay(order, task_status)
+
+    if task_status in ("FAILED", "CANCELLED"):
+        err_msg = task.get("error", {}).get("message", f"任务{task_status}")
+        app_logger.error(f"[GPTImage] 任务失败 order#{order_id}: {err_msg}")
+        await _fail_order(order_id, err_msg)
+        return None
+
+    if task_status != "SUCCESS":
+        # 进度按已轮询时长估算：20 → 90
+        _update_order_progress(order_id, 20 + min(int(elapsed / POLL_INTERVAL_RUNNING) * 2, 70), order.user_id)
+        return _poll_delay(order, task_status)
+
+    results = task.get("results", [])
+    # 优先用 signed_download_url（前端可直接展示），否则用 download_url
+    image_url = (results[0].get("signed_download_url") or results[0].get("download_url")) if results else None
+    if not image_url:
+        await _fail_order(order_id, "任务完成但未返回图片")
+        return None
+
+    progress_buffer.discard(GptimageOrder, order_id)
+    await run_in_session(_save_order_fields, order_id, {
+        "status": "completed", "progress": 100,
+        "image_url": image_url, "completed_at": datetime.utcnow(),
+    })
+    order_events.publish(
+        order.user_id, "gptimage", order_id,
+        status="completed", progress=100, image_url=image_url,
+    )
+    generation_stats.record_since(gptimage_order_key(order.model_name, order.quality), order.created_at)
+    app_logger.info(f"[GPTImage] 生成完成 order#{order_id}, url={image_url[:100]}...")
+    return None
 
 
 # ============ 图片文件服务 ============
@@ -497,50 +469,61 @@ async def serve_gptimage_file(filename: str):
 
 
 # ============ 辅助函数 ============
-def _update_order_status(order_id: int, new_status: str, error_message: str = None):
-    """更新订单状态"""
-    with Session(engine) as session:
-        order = session.get(GptimageOrder, order_id)
-        if order:
-            order.status = new_status
-            if error_message:
-                order.error_message = error_message
-            if new_status == "completed":
-                order.progress = 100
-                order.completed_at = datetime.utcnow()
-            elif new_status == "failed":
-                order.progress = 0
-            session.add(order)
-            session.commit()
-
-
-def _update_order_progress(order_id: int, progress: int):
-    """仅更新订单进度"""
-    with Session(engine) as session:
-        order = session.get(GptimageOrder, order_id)
-        if order and order.status not in ("completed", "failed"):
-            order.progress = min(progress, 95)
-            session.add(order)
-            session.commit()
-
-
-def _refund_order(order_id: int):
+def _save_order_status(session: Session, order_id: int, new_status: str, error_message: Optional[str]):
+    order = session.get(GptimageOrder, order_id)
+    if not order:
+        return None
+    order.status = new_status
+    if error_message:
+        order.error_message = error_message
+    if new_status == "completed":
+        order.progress = 100
+        order.completed_at = datetime.utcnow()
+    elif new_status == "failed":
+        order.progress = 0
+    session.add(order)
+    session.commit()
+    return order
+
+
+async def _update_order_status(order_id: int, new_status: str, error_message: str = None):
+    """更新订单状态（状态变更立即提交）"""
+    progress_buffer.discard(GptimageOrder, order_id)
+    order = await run_in_session(_save_order_status, order_id, new_status, error_message)
+    if order:
+        order_events.publish(
+            order.user_id, "gptimage", order_id,
+            status=new_status, progress=order.progress, error_message=order.error_message,
+        )
+
+
+def _update_order_progress(order_id: int, progress: int, user_id: int = None):
+    """仅更新订单进度（经 progress_buffer 合并写入），并推送给订阅的用户"""
+    progress = min(progress, 95)
+    progress_buffer.set(GptimageOrder, order_id, progress=progress)
+    order_events.publish(user_id, "gptimage", order_id, status="generating", progress=progress)
+
+
+def _refund(session: Session, order_id: int):
+    order = session.get(GptimageOrder, order_id)
+    if not order or order.cost <= 0:
+        return
+    user = session.get(User, order.user_id)
+    if user:
+        user.balance += order.cost
+        user.paid_balance = (user.paid_balance or 0) + order.cost  # 退回到充值余额
+        session.add(user)
+        transaction = Transaction(
+            user_id=user.id,
+            amount=order.cost,
+            bonus=0,
+            type="refund",
+        )
+        session.add(transaction)
+        session.commit()
+        app_logger.info(f"[GPTImage] 退款 ¥{order.cost} -> user#{user.id} for order#{order_id}")
+
+
+async def _refund_order(order_id: int):
     """订单失败时退款（退回充值余额和总余额）"""
-    with Session(engine) as session:
-        order = session.get(GptimageOrder, order_id)
-        if not order or order.cost <= 0:
-            return
-        user = session.get(User, order.user_id)
-        if user:
-            user.balance += order.cost
-            user.paid_balance = (user.paid_balance or 0) + order.cost  # 退回到充值余额
-            session.add(user)
-            transaction = Transaction(
-                user_id=user.id,
-                amount=order.cost,
-                bonus=0,
-                type="refund",
-            )
-            session.add(transaction)
-            session.commit()
-            app_logger.info(f"[GPTImage] 退款 ¥{order.cost} -> user#{user.id} for order#{order_id}")
+    await run_in_session(_refund, order_id)
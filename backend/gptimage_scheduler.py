@@ -0,0 +1,184 @@
+"""
+GPT-Image 公平调度
+NOVART 配额（18 次/分钟）全局共享。待提交的订单先按用户排队，由加权公平队列（WFQ）
+决定下一个放行哪个用户的订单：每个订单的虚拟完成时间 = max(全局虚拟时间, 该用户上一单) + 1/权重，
+取最小者放行。同一时刻只放行少量订单去 job_queue 争抢速率许可，
+因此一个用户连续提交多批也不会把其他用户挤到后面。
+
+权重默认都为 1；设置 GPTIMAGE_PRIORITY_BALANCE 后，充值余额不低于该值的用户权重为 GPTIMAGE_PRIORITY_WEIGHT。
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from typing import Optional
+
+from sqlmodel import Session, select
+
+from backend.models import GptimageOrder, User, run_in_session
+from backend.novart_limiter import novart_limiter
+
+logger = logging.getLogger(__name__)
+
+RELEASE_WINDOW = int(os.getenv("GPTIMAGE_RELEASE_WINDOW", "3"))   # 已放行但尚未拿到速率许可的订单上限
+RELEASE_TIMEOUT = 300      # 放行后迟迟没有 worker 执行的订单，超时后不再占用放行名额（秒）
+SWEEP_INTERVAL = 30
+PRIORITY_BALANCE = float(os.getenv("GPTIMAGE_PRIORITY_BALANCE", "0"))  # 0 表示不启用充值优先
+PRIORITY_WEIGHT = float(os.getenv("GPTIMAGE_PRIORITY_WEIGHT", "2"))
+
+
+def user_weight(paid_balance: Optional[float]) -> float:
+    if PRIORITY_BALANCE > 0 and (paid_balance or 0) >= PRIORITY_BALANCE:
+        return PRIORITY_WEIGHT
+    return 1.0
+
+
+class GptimageScheduler:
+    """按用户加权公平地把待提交订单放行到 job_queue"""
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, int, int]] = []   # (虚拟完成时间, 序号, user_id, order_id)
+        self._queued: set[int] = set()
+        self._last_tag: dict[int, float] = {}
+        self._vtime = 0.0
+        self._seq = itertools.count()
+        self._released: dict[int, float] = {}   # order_id -> 放行时间
+        self._sweeper: Optional[asyncio.Task] = None
+        self._dispatching: set[asyncio.Task] = set()   # 正在写入 job_queue 的放行任务
+        self._dispatched = 0
+
+    # ---- 入队 ----
+
+    def submit(self, user_id: int, order_ids: list[int], weight: float = 1.0):
+        """登记待提交订单并尝试放行"""
+        for order_id in order_ids:
+            self._push(user_id, order_id, weight)
+        self._pump()
+
+    def _push(self, user_id: int, order_id: int, weight: float):
+        if order_id in self._queued or order_id in self._released:
+            return
+        tag = max(self._vtime, self._last_tag.get(user_id, 0.0)) + 1.0 / max(weight, 0.01)
+        self._last_tag[user_id] = tag
+        heapq.heappush(self._heap, (tag, next(self._seq), user_id, order_id))
+        self._queued.add(order_id)
+
+    # ---- 放行 ----
+
+    def _pump(self):
+        """按虚拟完成时间放行，入队（数据库写入）在后台任务中完成，不阻塞调用方"""
+        while self._heap and len(self._released) < RELEASE_WINDOW:
+            tag, _, user_id, order_id = heapq.heappop(self._heap)
+            self._queued.discard(order_id)
+            self._vtime = tag
+            self._released[order_id] = time.monotonic()
+            self._dispatched += 1
+            task = asyncio.get_running_loop().create_task(self._enqueue(order_id))
+            self._dispatching.add(task)
+            task.add_done_callback(self._dispatching.discard)
+        if not self._heap:
+            # 队列清空后重置虚拟时间，避免浮点数无限增长
+            self._last_tag.clear()
+            self._vtime = 0.0
+
+    async def _enqueue(self, order_id: int):
+        from backend.job_queue import job_queue
+        try:
+            await job_queue.enqueue("gptimage_generate", order_id)
+        except Exception as e:
+            # 订单仍是 pending，下次启动 restore 时重新排队
+            logger.error(f"[gptimage-sched] 订单#{order_id} 入队失败: {e}")
+            self.mark_submitted(order_id)
+
+    def mark_submitted(self, order_id: int):
+        """订单已拿到速率许可（或已结束），让出放行名额"""
+        if self._released.pop(order_id, None) is not None:
+            self._pump()
+
+    # ---- 预计开始时间 ----
+
+    def _position_map(self) -> dict[int, int]:
+        """order_id -> 前面还有多少个订单（含已放行未提交的）"""
+        ahead = len(self._released)
+        return {entry[3]: ahead + i for i, entry in enumerate(sorted(self._heap))}
+
+    def estimate(self, user_id: int) -> dict:
+        """该用户排队中的订单及预计开始时间（秒）"""
+        positions = self._position_map()
+        orders = [
+            {"order_id": order_id, "position": positions[order_id],
+             "expected_wait": novart_limiter.estimate_wait(positions[order_id])}
+            for _, _, uid, order_id in self._heap if uid == user_id
+        ]
+        orders.sort(key=lambda o: o["position"])
+        return {
+            "queued": len(orders),
+            "total_queued": len(self._heap) + len(self._released),
+            "next_wait": orders[0]["expected_wait"] if orders else 0,
+            "orders": orders,
+        }
+
+    # ---- 恢复 / 维护 ----
+
+    @staticmethod
+    def _unsubmitted_orders(session: Session) -> list[tuple]:
+        return session.exec(
+            select(GptimageOrder.id, GptimageOrder.user_id, User.paid_balance)
+            .join(User, User.id == GptimageOrder.user_id)
+            .where(
+                GptimageOrder.status.in_(("pending", "processing")),
+                GptimageOrder.task_id.is_(None),
+            )
+            .order_by(GptimageOrder.created_at, GptimageOrder.id)
+        ).all()
+
+    async def restore(self) -> int:
+        """启动时把尚未提交到 NOVART 的订单按创建顺序重新排队"""
+        rows = await run_in_session(self._unsubmitted_orders)
+        for order_id, user_id, paid_balance in rows:
+            self._push(user_id, order_id, user_weight(paid_balance))
+        self._pump()
+        return len(rows)
+
+    async def start(self):
+        restored = await self.restore()
+        if restored:
+            logger.info(f"[gptimage-sched] 恢复待提交订单 {restored} 个")
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            now = time.monotonic()
+            for order_id, released_at in list(self._released.items()):
+                if now - released_at > RELEASE_TIMEOUT:
+                    logger.warning(f"[gptimage-sched] 订单#{order_id} 放行后长时间未执行，释放名额")
+                    self._released.pop(order_id, None)
+            self._pump()
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        if self._dispatching:
+            await asyncio.gather(*self._dispatching, return_exceptions=True)
+
+    def stats(self) -> dict:
+        per_user: dict[int, int] = {}
+        for _, _, user_id, _ in self._heap:
+            per_user[user_id] = per_user.get(user_id, 0) + 1
+        return {
+            "queued": len(self._heap),
+            "released": len(self._released),
+            "release_window": RELEASE_WINDOW,
+            "dispatched": self._dispatched,
+            "users": per_user,
+        }
+
+
+# 全局单例
+gptimage_scheduler = GptimageScheduler()
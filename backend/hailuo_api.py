@@ -116,6 +116,7 @@ def delete_hailuo_account(account_id: str):
     data["accounts"].pop(account_id, None)
     data["credentials"].pop(account_id, None)
     _save_accounts(data)
+    client_pool.discard(account_id)
 
 # ============ 签名工具 ============
 
@@ -272,6 +273,7 @@ class HailuoApiClient:
             base_url=BASE_URL,
             timeout=30.0,
             follow_redirects=True,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60.0),
         )
 
     def _common_headers(self) -> dict:
@@ -555,10 +557,95 @@ class HailuoApiClient:
             print(f"[HailuoAPI] upload_image 失败: {e}")
             return None
 
+    @property
+    def is_closed(self) -> bool:
+        return self._client.is_closed
+
+    def open_connections(self) -> int:
+        """当前连接池中的连接数（依赖 httpcore 内部结构，取不到时返回 0）"""
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        return len(getattr(pool, "connections", None) or [])
+
     async def close(self):
         await self._client.aclose()
 
 
+# ============ 客户端池 ============
+
+CLIENT_CLOSE_DELAY = 60  # 凭证变更后旧客户端延迟关闭，避免打断进行中的请求
+
+
+async def _close_later(client: HailuoApiClient, delay: float):
+    await asyncio.sleep(delay)
+    try:
+        await client.close()
+    except Exception as e:
+        logger.warning(f"[hailuo] 关闭旧客户端失败: {e}")
+
+
+class HailuoClientPool:
+    """按账号复用长连接的 HailuoApiClient，cookie/uuid/device_id 变化时才重建"""
+
+    def __init__(self):
+        self._clients: dict[str, tuple[tuple, HailuoApiClient]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._rebuilds = 0
+
+    def get(self, key: str, cookie: str, uuid: str, device_id: str) -> HailuoApiClient:
+        fingerprint = (cookie, uuid, device_id)
+        entry = self._clients.get(key)
+        if entry and entry[0] == fingerprint and not entry[1].is_closed:
+            self._hits += 1
+            return entry[1]
+        if entry:
+            self._rebuilds += 1
+            self._retire(entry[1])
+        self._misses += 1
+        client = HailuoApiClient(cookie=cookie, uuid=uuid, device_id=device_id)
+        self._clients[key] = (fingerprint, client)
+        return client
+
+    def discard(self, key: str):
+        entry = self._clients.pop(key, None)
+        if entry:
+            self._retire(entry[1])
+
+    def _retire(self, client: HailuoApiClient):
+        try:
+            asyncio.get_running_loop().create_task(_close_later(client, CLIENT_CLOSE_DELAY))
+        except RuntimeError:
+            # 没有运行中的事件循环（如脚本调用），交给 GC
+            pass
+
+    async def close_all(self):
+        entries = list(self._clients.values())
+        self._clients.clear()
+        for _, client in entries:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.warning(f"[hailuo] 关闭客户端失败: {e}")
+
+    def stats(self) -> dict:
+        total = self._hits + self._misses
+        return {
+            "clients": len(self._clients),
+            "open_connections": sum(c.open_connections() for _, c in self._clients.values()),
+            "hits": self._hits,
+            "misses": self._misses,
+            "rebuilds": self._rebuilds,
+            "reuse_ratio": round(self._hits / total, 4) if total else 0.0,
+            "accounts": {
+                key: c.open_connections() for key, (_, c) in self._clients.items()
+            },
+        }
+
+
+# 全局单例
+client_pool = HailuoClientPool()
+
+
 # ============ 登录接口 ============
 
 async def send_sms_code(phone: str, uuid: str, device_id: str) -> dict:
@@ -634,28 +721,20 @@ def _pick_hailuo_account() -> Optional[tuple]:
 
 
 def build_client(account_id: str) -> Optional[HailuoApiClient]:
-    """根据账号ID构建客户端"""
+    """根据账号ID获取（池化的）客户端"""
     creds = get_hailuo_credentials(account_id)
     if not creds:
         return None
-    return HailuoApiClient(
-        cookie=creds["cookie"],
-        uuid=creds["uuid"],
-        device_id=creds["device_id"],
-    )
+    return client_pool.get(account_id, creds["cookie"], creds["uuid"], creds["device_id"])
 
 
 def build_client_auto() -> Optional[tuple]:
-    """自动选择账号并构建客户端，返回 (account_id, client) 或 None"""
+    """自动选择账号并获取（池化的）客户端，返回 (account_id, client) 或 None"""
     result = _pick_hailuo_account()
     if not result:
         return None
     aid, creds = result
-    client = HailuoApiClient(
-        cookie=creds["cookie"],
-        uuid=creds["uuid"],
-        device_id=creds["device_id"],
-    )
+    client = client_pool.get(aid, creds["cookie"], creds["uuid"], creds["device_id"])
     return aid, client
 
 
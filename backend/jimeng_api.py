@@ -1,48 +1,20 @@
 """
 即梦订单 API
 """
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form, status
-from fastapi.security import OAuth2PasswordBearer
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
 from typing import Optional, List
 from sqlmodel import Session, select
 from pydantic import BaseModel
-from jose import jwt, JWTError
 import json
 import os
 from datetime import datetime
 
-from backend.models import User, JimengOrder, AIModel, Transaction, engine
-from backend.auth import SECRET_KEY, ALGORITHM
+from backend.models import User, JimengOrder, AIModel, Transaction, get_session
+from backend.auth import get_current_user
 from backend.jimeng_automation import submit_video_task
 
 router = APIRouter(prefix="/api/jimeng", tags=["jimeng"])
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-
-def get_session():
-    with Session(engine) as session:
-        yield session
-
-
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = session.exec(select(User).where(User.username == username)).first()
-    if user is None:
-        raise credentials_exception
-    return user
-
 
 class JimengModelResponse(BaseModel):
     id: str
@@ -223,6 +195,8 @@ async def create_jimeng_order(
         }
         price = fallback_prices.get(model, 0.99)
 
+    # 鉴权用户可能来自缓存，扣费前在本事务内重新读取用户行（PostgreSQL 下加行锁）
+    session.refresh(current_user, with_for_update=True)
     if current_user.balance < price:
         raise HTTPException(status_code=400, detail="余额不足")
 
@@ -286,10 +260,9 @@ async def create_jimeng_order(
     session.commit()
     session.refresh(order)
 
-    # 启动后台任务处理订单
-    import asyncio
-    from backend.jimeng_background import process_jimeng_order
-    asyncio.create_task(process_jimeng_order(order.id))
+    # 写入后台任务队列处理订单
+    from backend.job_queue import job_queue
+    await job_queue.enqueue("jimeng_process", order.id)
     print(f"[JIMENG-API] 订单#{order.id}已提交后台处理")
 
     return {
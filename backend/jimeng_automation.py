@@ -1,6 +1,7 @@
 """
 即梦 (Seedance) Playwright 自动化
 登录：扫码登录，二维码截图返回给前端展示
+状态扫描优先走 jimeng_client 直连接口，浏览器作为回退
 定位原则：语义定位优先，不依赖动态 class
 """
 import asyncio
@@ -12,6 +13,9 @@ import re
 from typing import Optional
 from playwright.async_api import async_playwright, Page, BrowserContext
 
+from backend.jimeng_browser_pool import jimeng_browser_pool
+from backend.jimeng_client import JimengApiClient, direct_api_available, mark_direct_api_failed
+
 JIMENG_URL = "https://jimeng.jianying.com/ai-tool/home"
 JIMENG_VIDEO_URL = "https://jimeng.jianying.com/ai-tool/generate?type=video"
 DEBUG_DIR = os.path.join(os.path.dirname(__file__), "jimeng_debug")
@@ -232,25 +236,9 @@ async def submit_video_task(
     if not cookie:
         return {"success": False, "error": "账号未登录（无Cookie）"}
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)  # 服务器必须使用无头模式
-        context = await browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        )
-
-        # 注入 Cookie
-        parsed = []
-        for part in cookie.split(";"):
-            part = part.strip()
-            if "=" in part:
-                name, _, value = part.partition("=")
-                parsed.append({"name": name.strip(), "value": value.strip(), "domain": ".jianying.com", "path": "/"})
-        if parsed:
-            await context.add_cookies(parsed)
-
-        page = await context.new_page()
-        account_id = account.get("account_id", "unknown")
-
+    account_id = account.get("account_id", "unknown")
+    # 复用浏览器池中该账号的上下文（已注入 cookie）；提交流程会改动页面状态，用完关闭页面
+    async with jimeng_browser_pool.page(account, reuse=False) as page:
         try:
             # 步骤1：进入视频生成页
             print(f"[JIMENG-SUBMIT] [{account_id}] 进入视频生成页")
@@ -402,8 +390,6 @@ async def submit_video_task(
             await page.screenshot(path=_debug_path("submit_error"))
             print(f"[JIMENG-SUBMIT] [{account_id}] 提交失败: {e}")
             return {"success": False, "error": str(e)}
-        finally:
-            await browser.close()
 
 
 async def verify_cookie(cookie: str) -> tuple[bool, str]:
@@ -833,17 +819,96 @@ JIMENG_STATUS_FAILED = "failed"          # 失败（审核不通过等）
 JIMENG_STATUS_UNKNOWN = "unknown"        # 未知
 
 
+def parse_asset_list(assets: list[dict], order_id: Optional[int] = None, account_id: str = "") -> list[dict]:
+    """
+    解析 get_asset_list 返回的资产列表（浏览器监听与直连 API 共用）
+
+    order_id 不为 None 时只保留该订单的资产
+    """
+    videos = []
+    for asset in assets:
+        video_data = asset.get("video", {})
+        task_data = asset.get("task", {})
+        gen_result = asset.get("gen_result_data", {})
+
+        # 提取 prompt
+        params = video_data.get("aigc_image_params", {}).get("text2video_params", {})
+        raw_prompt = params.get("prompt", "")
+
+        # 匹配订单ID
+        extracted_id = extract_jimeng_order_id(raw_prompt)
+        if order_id is not None and extracted_id != order_id:
+            continue
+
+        # 还原原始提示词
+        clean_prompt = re.sub(
+            r'\s*\(以下内容请忽略.*?\[' + JIMENG_ORDER_TAG_PREFIX + r'\d+\]\)', '', raw_prompt
+        ).strip()
+
+        video_info = {
+            "prompt": clean_prompt,
+            "status": JIMENG_STATUS_UNKNOWN,
+            "progress": 0,
+        }
+        if extracted_id:
+            video_info["order_id"] = extracted_id
+
+        # 判断状态
+        task_status = task_data.get("status")
+        result_code = gen_result.get("result_code")
+        fail_msg = task_data.get("fail_msg", "")
+
+        if result_code and result_code != 0:
+            video_info["status"] = "failed"
+            video_info["error"] = gen_result.get("result_msg", "") or fail_msg
+        elif fail_msg:
+            video_info["status"] = "failed"
+            video_info["error"] = fail_msg
+        elif task_status == 0 or (task_data.get("queue_info", {}).get("position", 0) > 0):
+            video_info["status"] = JIMENG_STATUS_QUEUING
+            video_info["progress"] = 0
+        elif task_status == 1:
+            video_info["status"] = JIMENG_STATUS_GENERATING
+            video_info["progress"] = 50
+        elif task_status == 2:
+            item_list = video_data.get("item_list", [])
+            if item_list:
+                first_item = item_list[0]
+                transcoded = first_item.get("video", {}).get("transcoded_video", {})
+                origin = transcoded.get("origin", {})
+                video_url = origin.get("video_url", "")
+                if not video_url:
+                    p720 = transcoded.get("720p", {})
+                    video_url = p720.get("video_url", "")
+                if video_url:
+                    video_info["status"] = JIMENG_STATUS_COMPLETED
+                    video_info["progress"] = 100
+                    video_info["video_url"] = video_url
+                    if order_id is not None:
+                        print(f"[JIMENG-SCAN] [{account_id}] 订单#{extracted_id} 已完成: {video_url[:80]}...")
+                else:
+                    video_info["status"] = JIMENG_STATUS_GENERATING
+                    video_info["progress"] = 90
+            else:
+                video_info["status"] = JIMENG_STATUS_GENERATING
+                video_info["progress"] = 50
+
+        videos.append(video_info)
+    return videos
+
+
 async def scan_video_status(
     account: dict,
     order_id: Optional[int] = None,
 ) -> dict:
     """
-    通过浏览器监听 get_asset_list API 响应扫描即梦视频状态（不依赖 DOM）
+    扫描即梦视频状态：优先直连 get_asset_list 接口，失败时回退到浏览器监听（不依赖 DOM）
 
     参数:
         account: 账号信息，包含 cookie
         prompt: 提示词（可选，已废弃，优先使用 order_id）
-        order_id: 订单ID（可选，用于通过追踪标识精确匹配）
+        order_id: 订单ID（可选，用于通过追踪标识精确匹配；为 None 时返回全部资产，
+                  由 jimeng_background 的账号级扫描器按 order_id 分发）
 
     返回: {
         "success": bool,
@@ -854,25 +919,24 @@ async def scan_video_status(
     if not cookie:
         return {"success": False, "error": "账号未登录（无Cookie）"}
 
-    async with async_playwright() as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context(
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-        )
-
-        # 注入 Cookie
-        parsed = []
-        for part in cookie.split(";"):
-            part = part.strip()
-            if "=" in part:
-                name, _, value = part.partition("=")
-                parsed.append({"name": name.strip(), "value": value.strip(), "domain": ".jianying.com", "path": "/"})
-        if parsed:
-            await context.add_cookies(parsed)
-
-        page = await context.new_page()
-        account_id = account.get("account_id", "unknown")
+    account_id = account.get("account_id", "unknown")
+    if direct_api_available(account_id):
+        try:
+            assets = await JimengApiClient(cookie).get_asset_list()
+            videos = parse_asset_list(assets, order_id, account_id)
+            print(f"[JIMENG-SCAN] [{account_id}] 直连API返回 {len(assets)} 个资产，匹配 {len(videos)} 个视频")
+            return {"success": True, "videos": videos}
+        except Exception as e:
+            mark_direct_api_failed(account_id, e)
+
+    return await _scan_via_browser(account, order_id)
 
+
+async def _scan_via_browser(account: dict, order_id: Optional[int]) -> dict:
+    """打开生成页，监听页面自己发出的 get_asset_list 响应"""
+    account_id = account.get("account_id", "unknown")
+    # 复用浏览器池中该账号的上下文和页面，省去每次启动浏览器、注入 cookie
+    async with jimeng_browser_pool.page(account) as page:
         try:
             # 监听 get_asset_list API 响应
             captured_assets = []
@@ -887,84 +951,17 @@ async def scan_video_status(
                     pass
 
             page.on("response", on_response)
-
-            print(f"[JIMENG-SCAN] [{account_id}] 通过API监听扫描视频状态...")
-            await page.goto(JIMENG_VIDEO_URL, wait_until="networkidle", timeout=60000)
-            await asyncio.sleep(3)
-
-            page.remove_listener("response", on_response)
+            try:
+                print(f"[JIMENG-SCAN] [{account_id}] 通过API监听扫描视频状态...")
+                await page.goto(JIMENG_VIDEO_URL, wait_until="networkidle", timeout=60000)
+                await asyncio.sleep(3)
+            finally:
+                # 页面会归还给浏览器池复用，必须移除本次的监听
+                page.remove_listener("response", on_response)
 
             print(f"[JIMENG-SCAN] [{account_id}] API返回 {len(captured_assets)} 个资产")
 
-            # 解析 asset_list
-            videos = []
-            for asset in captured_assets:
-                video_data = asset.get("video", {})
-                task_data = asset.get("task", {})
-                gen_result = asset.get("gen_result_data", {})
-
-                # 提取 prompt
-                params = video_data.get("aigc_image_params", {}).get("text2video_params", {})
-                raw_prompt = params.get("prompt", "")
-
-                # 匹配订单ID
-                extracted_id = extract_jimeng_order_id(raw_prompt)
-                if order_id is not None and extracted_id != order_id:
-                    continue
-
-                # 还原原始提示词
-                clean_prompt = re.sub(
-                    r'\s*\(以下内容请忽略.*?\[' + JIMENG_ORDER_TAG_PREFIX + r'\d+\]\)', '', raw_prompt
-                ).strip()
-
-                video_info = {
-                    "prompt": clean_prompt,
-                    "status": JIMENG_STATUS_UNKNOWN,
-                    "progress": 0,
-                }
-                if extracted_id:
-                    video_info["order_id"] = extracted_id
-
-                # 判断状态
-                task_status = task_data.get("status")
-                result_code = gen_result.get("result_code")
-                fail_msg = task_data.get("fail_msg", "")
-
-                if result_code and result_code != 0:
-                    video_info["status"] = "failed"
-                    video_info["error"] = gen_result.get("result_msg", "") or fail_msg
-                elif fail_msg:
-                    video_info["status"] = "failed"
-                    video_info["error"] = fail_msg
-                elif task_status == 0 or (task_data.get("queue_info", {}).get("position", 0) > 0):
-                    video_info["status"] = JIMENG_STATUS_QUEUING
-                    video_info["progress"] = 0
-                elif task_status == 1:
-                    video_info["status"] = JIMENG_STATUS_GENERATING
-                    video_info["progress"] = 50
-                elif task_status == 2:
-                    item_list = video_data.get("item_list", [])
-                    if item_list:
-                        first_item = item_list[0]
-                        transcoded = first_item.get("video", {}).get("transcoded_video", {})
-                        origin = transcoded.get("origin", {})
-                        video_url = origin.get("video_url", "")
-                        if not video_url:
-                            p720 = transcoded.get("720p", {})
-                            video_url = p720.get("video_url", "")
-                        if video_url:
-                            video_info["status"] = JIMENG_STATUS_COMPLETED
-                            video_info["progress"] = 100
-                            video_info["video_url"] = video_url
-                            print(f"[JIMENG-SCAN] [{account_id}] 订单#{extracted_id} 已完成: {video_url[:80]}...")
-                        else:
-                            video_info["status"] = JIMENG_STATUS_GENERATING
-                            video_info["progress"] = 90
-                    else:
-                        video_info["status"] = JIMENG_STATUS_GENERATING
-                        video_info["progress"] = 50
-
-                videos.append(video_info)
+            videos = parse_asset_list(captured_assets, order_id, account_id)
 
             print(f"[JIMENG-SCAN] [{account_id}] 扫描完成，匹配 {len(videos)} 个视频")
             return {"success": True, "videos": videos}
@@ -972,5 +969,3 @@ async def scan_video_status(
         except Exception as e:
             print(f"[JIMENG-SCAN] [{account_id}] 扫描失败: {e}")
             return {"success": False, "error": str(e)}
-        finally:
-            await browser.close()
@@ -3,138 +3,303 @@
 """
 import asyncio
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timezone
+from typing import Optional
 from sqlmodel import Session, select
 
-from backend.models import JimengOrder, User, Transaction, engine
+from backend.models import JimengOrder, User, Transaction, run_in_session
+from backend.order_events import order_events
+from backend.progress_buffer import progress_buffer
+from backend.video_download import video_downloader
 from backend.jimeng_automation import submit_video_task, scan_video_status
 from backend.admin_jimeng_account import _load_jimeng_accounts
 
+MAX_WAIT_SECONDS = 600  # 单个订单最长等待10分钟
+SCAN_INTERVAL = 5       # 账号级扫描间隔（秒），也是 jimeng_poll 任务的重新检查间隔
+SCAN_WAIT_TIMEOUT = 120  # 单次检查等待扫描结果的上限（浏览器回退扫描较慢）
+
+
+# ============ 即梦账号级扫描 ============
+# 每个 jimeng_poll 任务只检查一次：订阅所属账号的扫描器、取一次扫描结果后重新排队。
+# 同一账号下同时等待的订单共用一次扫描：每次只加载一次资产列表，
+# 按提示词中的 #JMORD 订单号建立索引后分发给各订单；两次扫描之间至少间隔 SCAN_INTERVAL。
+
+class _ScanWaiter:
+    """订单在账号扫描器上的一次订阅，收到一次扫描结果（失败为 None）后即被移出"""
+
+    def __init__(self, order_id: int):
+        self.order_id = order_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+
+    def offer(self, videos: Optional[list]):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(videos)
+
+
+class JimengAccountScanner:
+    """单个即梦账号的扫描循环，资产列表加载次数与账号数成正比而不是与订单数成正比"""
+
+    def __init__(self, account_id: str):
+        self.account_id = account_id
+        self.account: dict = {}
+        self._waiters: dict[int, _ScanWaiter] = {}
+        self._task = None
+
+    def subscribe(self, account: dict, order_id: int) -> _ScanWaiter:
+        # 使用最近一次订阅传入的账号信息（cookie 可能已更新）
+        self.account = account
+        waiter = _ScanWaiter(order_id)
+        self._waiters[order_id] = waiter
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return waiter
+
+    def unsubscribe(self, waiter: _ScanWaiter):
+        if self._waiters.get(waiter.order_id) is waiter:
+            del self._waiters[waiter.order_id]
+
+    async def _run(self):
+        while self._waiters:
+            try:
+                scan_result = await scan_video_status(self.account)
+            except Exception as e:
+                scan_result = {"success": False, "error": str(e)}
+
+            index: Optional[dict[int, list]] = None
+            if scan_result.get("success"):
+                index = {}
+                for video in scan_result.get("videos", []):
+                    if video.get("order_id") is not None:
+                        index.setdefault(video["order_id"], []).append(video)
+            else:
+                print(f"[JIMENG-BG] 账号 {self.account_id} 扫描失败: {scan_result.get('error')}")
+            for waiter in list(self._waiters.values()):
+                self.unsubscribe(waiter)
+                waiter.offer(index.get(waiter.order_id, []) if index is not None else None)
+
+            await asyncio.sleep(SCAN_INTERVAL)
+
+
+_account_scanners: dict[str, JimengAccountScanner] = {}
+
+
+def _get_account_scanner(account_id: str) -> JimengAccountScanner:
+    scanner = _account_scanners.get(account_id)
+    if scanner is None:
+        scanner = JimengAccountScanner(account_id)
+        _account_scanners[account_id] = scanner
+    return scanner
+
+
+async def _scan_once(account: dict, order_id: int) -> Optional[list]:
+    """取一次账号扫描结果中属于该订单的视频；扫描失败或超时返回 None"""
+    scanner = _get_account_scanner(account.get("account_id"))
+    waiter = scanner.subscribe(account, order_id)
+    try:
+        return await asyncio.wait_for(waiter.queue.get(), timeout=SCAN_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        scanner.unsubscribe(waiter)
+
+
+async def _enqueue_poll(order_id: int, account_id: str, started_at: Optional[float] = None):
+    from backend.job_queue import job_queue
+    await job_queue.enqueue(
+        "jimeng_poll", order_id,
+        {"account_id": account_id, "started_at": started_at or time.time()},
+        delay=SCAN_INTERVAL,
+    )
+
+
+def _get_order(session: Session, order_id: int) -> Optional[JimengOrder]:
+    return session.get(JimengOrder, order_id)
+
+
+def _save_order_status(session: Session, order_id: int, status: str, account_id: Optional[str]) -> JimengOrder:
+    order = session.get(JimengOrder, order_id)
+    order.status = status
+    if account_id:
+        order.account_id = account_id
+    session.add(order)
+    session.commit()
+    return order
+
+
+async def _set_order_status(order_id: int, status: str, account_id: Optional[str] = None):
+    order = await run_in_session(_save_order_status, order_id, status, account_id)
+    order_events.publish(order.user_id, "jimeng", order_id, status=status, progress=order.progress)
+
 
 async def process_jimeng_order(order_id: int):
     """
-    处理即梦视频生成订单
-    
+    提交即梦视频生成订单（可重入：任务被重新领取或重试时从中断处继续，不会重复提交）
+
     流程：
-    1. 获取订单信息
-    2. 选择一个可用的账号
-    3. 提交视频生成任务
-    4. 轮询任务状态
-    5. 更新订单状态
+    1. 获取订单信息，已结束的订单直接返回
+    2. 已提交（generating）的订单直接转入等待
+    3. 提交中断（processing）的订单先扫描一次提交账号的资产列表，已在即梦生成的转入等待
+    4. 选择一个可用的账号，提交视频生成任务
+    5. 转入 jimeng_poll 任务，按账号扫描结果更新订单状态
     """
     print(f"[JIMENG-BG] 开始处理订单 #{order_id}")
-    
-    # 在 session 内获取订单数据
-    order_data = None
-    with Session(engine) as session:
-        order = session.get(JimengOrder, order_id)
-        if not order:
-            print(f"[JIMENG-BG] 订单 #{order_id} 不存在")
-            return
-        
-        if order.status != "pending":
-            print(f"[JIMENG-BG] 订单 #{order_id} 状态不是 pending，跳过")
+
+    order = await run_in_session(_get_order, order_id)
+    if not order:
+        print(f"[JIMENG-BG] 订单 #{order_id} 不存在")
+        return
+
+    if order.status in ("completed", "failed"):
+        print(f"[JIMENG-BG] 订单 #{order_id} 已结束（{order.status}），跳过")
+        return
+
+    order_data = {
+        "prompt": order.prompt,
+        "model_name": order.model_name,
+        "duration": order.duration,
+        "ratio": order.ratio,
+        "first_frame_url": order.first_frame_url,
+        "last_frame_url": order.last_frame_url,
+        "task_id": order.task_id,  # 提取 task_id
+        "user_id": order.user_id,
+        "status": order.status,
+        "account_id": order.account_id,
+        "created_at": order.created_at,
+    }
+
+    # 之前已选定账号（老数据没有 account_id，按未提交处理）
+    if order_data["account_id"] and order_data["status"] in ("processing", "generating"):
+        submitted = order_data["status"] == "generating"
+        if not submitted:
+            account = get_jimeng_account(order_data["account_id"])
+            videos = await _scan_once(account, order_id) if account else None
+            if videos is None:
+                # 无法确认是否已提交，交给任务队列退避重试，避免重复提交
+                raise RuntimeError(f"无法确认订单 #{order_id} 是否已提交到即梦")
+            submitted = bool(videos)
+        if submitted:
+            print(f"[JIMENG-BG] 订单 #{order_id} 已提交过，继续等待结果")
+            if order_data["status"] != "generating":
+                await _set_order_status(order_id, "generating")
+            created_at = order_data["created_at"]
+            await _enqueue_poll(
+                order_id, order_data["account_id"],
+                created_at.replace(tzinfo=timezone.utc).timestamp() if created_at else None,
+            )
             return
-        
-        # 更新状态为处理中
-        order.status = "processing"
-        session.add(order)
-        session.commit()
-        
-        # 提取订单数据（在 session 关闭前）
-        order_data = {
-            "prompt": order.prompt,
-            "model_name": order.model_name,
-            "duration": order.duration,
-            "ratio": order.ratio,
-            "first_frame_url": order.first_frame_url,
-            "last_frame_url": order.last_frame_url,
-            "task_id": order.task_id,  # 提取 task_id
-        }
-    
+        print(f"[JIMENG-BG] 订单 #{order_id} 未在即梦找到，重新提交")
+
+    # 获取可用账号
+    account = get_available_jimeng_account()
+    if not account:
+        await update_order_failed(order_id, "没有可用的即梦账号")
+        return
+
+    account_id = account.get("account_id")
+    print(f"[JIMENG-BG] 订单 #{order_id} 使用账号: {account.get('display_name', account_id)}")
+
+    # 增加账号任务计数（订单结束时由 jimeng_poll 减少）
+    increment_account_tasks(account_id)
+    handed_off = False
+
     try:
-        # 获取可用账号
-        account = get_available_jimeng_account()
-        if not account:
-            update_order_failed(order_id, "没有可用的即梦账号")
+        # 更新状态为处理中，并记录提交账号
+        await _set_order_status(order_id, "processing", account_id)
+
+        # 提交视频生成任务
+        result = await submit_video_task(
+            account=account,
+            prompt=order_data["prompt"],
+            model=order_data["model_name"],
+            duration=order_data["duration"],
+            ratio=order_data["ratio"],
+            first_frame_url=order_data["first_frame_url"],
+            last_frame_url=order_data["last_frame_url"],
+            task_id=order_data["task_id"],
+            order_id=order_id,
+        )
+
+        if not result.get("success"):
+            await update_order_failed(order_id, result.get("error", "提交任务失败"))
             return
 
-        account_id = account.get("account_id")
-        print(f"[JIMENG-BG] 订单 #{order_id} 使用账号: {account.get('display_name', account_id)}")
-
-        # 增加账号任务计数
-        increment_account_tasks(account_id)
-
-        try:
-            # 提交视频生成任务
-            result = await submit_video_task(
-                account=account,
-                prompt=order_data["prompt"],
-                model=order_data["model_name"],
-                duration=order_data["duration"],
-                ratio=order_data["ratio"],
-                first_frame_url=order_data["first_frame_url"],
-                last_frame_url=order_data["last_frame_url"],
-                task_id=order_data["task_id"],
-                order_id=order_id,
-            )
+        returned_task_id = result.get("task_id")
+        print(f"[JIMENG-BG] 订单 #{order_id} 任务已提交，task_id: {returned_task_id}")
 
-            if not result.get("success"):
-                update_order_failed(order_id, result.get("error", "提交任务失败"))
-                return
-
-            returned_task_id = result.get("task_id")
-            print(f"[JIMENG-BG] 订单 #{order_id} 任务已提交，task_id: {returned_task_id}")
-
-            # 更新订单状态为生成中（task_id 已在创建时设置，无需再次保存）
-            with Session(engine) as session:
-                order = session.get(JimengOrder, order_id)
-                order.status = "generating"
-                session.add(order)
-                session.commit()
-
-            # 轮询任务状态
-            max_wait_time = 600  # 最长等待10分钟
-            start_time = asyncio.get_event_loop().time()
-
-            while True:
-                elapsed = asyncio.get_event_loop().time() - start_time
-                if elapsed > max_wait_time:
-                    update_order_failed(order_id, "任务超时")
-                    return
-
-                # 扫描视频状态
-                scan_result = await scan_video_status(account, order_id=order_id)
-
-                if scan_result.get("success"):
-                    videos = scan_result.get("videos", [])
-                    for video in videos:
-                        if video.get("status") == "completed" and video.get("video_url"):
-                            # 找到完成的视频
-                            await update_order_completed(order_id, video.get("video_url"))
-                            return
-                        elif video.get("status") == "failed":
-                            # 视频生成失败（审核不通过等）
-                            error_msg = video.get("error", "视频生成失败")
-                            update_order_failed(order_id, error_msg)
-                            return
-                        elif video.get("status") == "generating":
-                            # 更新进度
-                            progress = video.get("progress", 0)
-                            update_order_progress(order_id, progress)
-                        elif video.get("status") == "queuing":
-                            # 排队中，保持 progress 为 0
-                            update_order_progress(order_id, 0)
-
-                await asyncio.sleep(5)  # 每5秒检查一次
-
-        finally:
-            # 无论成功失败，都要减少账号任务计数
-            decrement_account_tasks(account_id)
+        # 更新订单状态为生成中（task_id 已在创建时设置，无需再次保存），转入等待
+        await _set_order_status(order_id, "generating")
+        await _enqueue_poll(order_id, account_id)
+        handed_off = True
 
     except Exception as e:
         print(f"[JIMENG-BG] 订单 #{order_id} 处理异常: {e}")
-        update_order_failed(order_id, str(e))
+        await update_order_failed(order_id, str(e))
+    finally:
+        if not handed_off:
+            decrement_account_tasks(account_id)
+
+
+async def poll_jimeng_order(order_id: int, account_id: Optional[str] = None,
+                            started_at: Optional[float] = None) -> Optional[float]:
+    """检查一次即梦订单的生成结果，订单未结束时返回下次检查前的等待秒数"""
+    order = await run_in_session(_get_order, order_id)
+    if not order or order.status in ("completed", "failed"):
+        return None
+    user_id = order.user_id
+    account_id = account_id or order.account_id
+    if not started_at:
+        started_at = order.created_at.replace(tzinfo=timezone.utc).timestamp()
+
+    finished = True
+    try:
+        if time.time() - started_at >= MAX_WAIT_SECONDS:
+            await update_order_failed(order_id, "任务超时")
+            return None
+        account = get_jimeng_account(account_id) if account_id else None
+        if not account:
+            await update_order_failed(order_id, "提交订单的即梦账号不可用")
+            return None
+
+        videos = await _scan_once(account, order_id)
+        for video in videos or []:
+            if video.get("status") == "completed" and video.get("video_url"):
+                # 找到完成的视频
+                await update_order_completed(order_id, video.get("video_url"))
+                return None
+            elif video.get("status") == "failed":
+                # 视频生成失败（审核不通过等）
+                error_msg = video.get("error", "视频生成失败")
+                await update_order_failed(order_id, error_msg)
+                return None
+            elif video.get("status") == "generating":
+                # 更新进度
+                progress = video.get("progress", 0)
+                update_order_progress(order_id, progress, user_id)
+            elif video.get("status") == "queuing":
+                # 排队中，保持 progress 为 0
+                update_order_progress(order_id, 0, user_id)
+        finished = False
+        return SCAN_INTERVAL
+
+    except Exception as e:
+        # 单次检查失败不影响订单，超时前继续检查
+        print(f"[JIMENG-BG] 订单 #{order_id} 检查异常: {e}")
+        finished = False
+        return SCAN_INTERVAL
+    finally:
+        if finished and account_id:
+            # 无论成功失败，订单结束时减少账号任务计数
+            decrement_account_tasks(account_id)
+
+
+def get_jimeng_account(account_id: str) -> Optional[dict]:
+    """按 ID 获取即梦账号"""
+    for account in _load_jimeng_accounts().get("accounts", []):
+        if account.get("account_id") == account_id:
+            return account
+    return None
 
 
 def get_available_jimeng_account() -> dict:
@@ -182,43 +347,60 @@ def decrement_account_tasks(account_id: str):
     _save_jimeng_accounts(data)
 
 
-def update_order_failed(order_id: int, error: str):
+def _fail_order(session: Session, order_id: int, error: str) -> Optional[JimengOrder]:
+    order = session.get(JimengOrder, order_id)
+    if order:
+        # 检查是否已经退款（防止重复退款）
+        already_failed = order.status == "failed"
+
+        order.status = "failed"
+        order.error_message = error
+        session.add(order)
+
+        # 失败订单自动退回余额（仅首次标记为failed时退）
+        if not already_failed and order.cost and order.cost > 0:
+            user = session.get(User, order.user_id)
+            if user:
+                user.balance += order.cost
+                session.add(user)
+
+                # 记录退款交易
+                refund = Transaction(
+                    user_id=order.user_id,
+                    amount=order.cost,
+                    bonus=0,
+                    type="refund"
+                )
+                session.add(refund)
+                print(f"[JIMENG-BG] 订单 #{order_id} 已退款 {order.cost} 元")
+
+        session.commit()
+    return order
+
+
+async def update_order_failed(order_id: int, error: str):
     """更新订单为失败状态，并退还余额"""
-    with Session(engine) as session:
-        order = session.get(JimengOrder, order_id)
-        if order:
-            # 检查是否已经退款（防止重复退款）
-            already_failed = order.status == "failed"
-            
-            order.status = "failed"
-            order.error_message = error
-            session.add(order)
-            
-            # 失败订单自动退回余额（仅首次标记为failed时退）
-            if not already_failed and order.cost and order.cost > 0:
-                user = session.get(User, order.user_id)
-                if user:
-                    user.balance += order.cost
-                    session.add(user)
-                    
-                    # 记录退款交易
-                    refund = Transaction(
-                        user_id=order.user_id,
-                        amount=order.cost,
-                        bonus=0,
-                        type="refund"
-                    )
-                    session.add(refund)
-                    print(f"[JIMENG-BG] 订单 #{order_id} 已退款 {order.cost} 元")
-            
-            session.commit()
+    progress_buffer.discard(JimengOrder, order_id)
+    order = await run_in_session(_fail_order, order_id, error)
+    if order:
+        order_events.publish(order.user_id, "jimeng", order_id, status="failed", error_message=error)
     print(f"[JIMENG-BG] 订单 #{order_id} 失败: {error}")
 
 
+def _complete_order(session: Session, order_id: int, local_url: str) -> Optional[JimengOrder]:
+    order = session.get(JimengOrder, order_id)
+    if order:
+        order.status = "completed"
+        order.video_url = local_url
+        order.progress = 100
+        order.completed_at = datetime.utcnow()
+        session.add(order)
+        session.commit()
+    return order
+
+
 async def update_order_completed(order_id: int, video_url: str):
     """下载视频到本地，然后更新订单为完成状态"""
-    import httpx
-
     VIDEOS_DIR = os.path.join(os.path.dirname(__file__), "..", "videos")
     os.makedirs(VIDEOS_DIR, exist_ok=True)
 
@@ -229,38 +411,24 @@ async def update_order_completed(order_id: int, video_url: str):
     # 下载视频到本地
     try:
         print(f"[JIMENG-BG] 订单 #{order_id} 开始下载视频...")
-        async with httpx.AsyncClient(timeout=120, follow_redirects=True) as client:
-            resp = await client.get(video_url)
-            if resp.status_code == 200:
-                with open(filepath, "wb") as f:
-                    f.write(resp.content)
-                size_mb = os.path.getsize(filepath) / (1024 * 1024)
-                print(f"[JIMENG-BG] 订单 #{order_id} 下载完成 ({size_mb:.1f}MB)")
-            else:
-                print(f"[JIMENG-BG] 订单 #{order_id} 下载失败 HTTP {resp.status_code}，使用远程URL")
-                local_url = video_url
+        size = await video_downloader.download(video_url, filepath)
+        print(f"[JIMENG-BG] 订单 #{order_id} 下载完成 ({size / (1024 * 1024):.1f}MB)")
     except Exception as e:
         print(f"[JIMENG-BG] 订单 #{order_id} 下载异常: {str(e)[:100]}，使用远程URL")
         local_url = video_url
 
-    with Session(engine) as session:
-        order = session.get(JimengOrder, order_id)
-        if order:
-            order.status = "completed"
-            order.video_url = local_url
-            order.progress = 100
-            order.completed_at = datetime.utcnow()
-            session.add(order)
-            session.commit()
+    progress_buffer.discard(JimengOrder, order_id)
+    order = await run_in_session(_complete_order, order_id, local_url)
+    if order:
+        order_events.publish(
+            order.user_id, "jimeng", order_id,
+            status="completed", progress=100, video_url=local_url,
+        )
     print(f"[JIMENG-BG] 订单 #{order_id} 完成: {local_url}")
 
 
-def update_order_progress(order_id: int, progress: int):
-    """更新订单进度"""
-    with Session(engine) as session:
-        order = session.get(JimengOrder, order_id)
-        if order and order.progress != progress:
-            order.progress = progress
-            session.add(order)
-            session.commit()
+def update_order_progress(order_id: int, progress: int, user_id: int = None):
+    """更新订单进度（经 progress_buffer 合并写入），并推送给订阅的用户"""
+    progress_buffer.set(JimengOrder, order_id, progress=progress)
+    order_events.publish(user_id, "jimeng", order_id, status="generating", progress=progress)
     print(f"[JIMENG-BG] 订单 #{order_id} 进度: {progress}%")
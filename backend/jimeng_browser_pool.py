@@ -0,0 +1,286 @@
+"""
+即梦浏览器池
+进程内常驻一个 Chromium，每个账号一个长期存活的 BrowserContext（已注入 cookie），
+提交/扫描通过 lease 借用页面，用完归还；空闲的上下文按 TTL 回收，
+Chromium 进程树内存超过上限时先回收最久未用的上下文，仍超限则重启浏览器。
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+LAUNCH_ARGS = ["--disable-dev-shm-usage", "--disable-gpu"]
+
+MAX_CONTEXTS = int(os.getenv("JIMENG_BROWSER_MAX_CONTEXTS", "4"))        # 同时保留的账号上下文数
+PAGES_PER_CONTEXT = int(os.getenv("JIMENG_BROWSER_PAGES_PER_CONTEXT", "2"))  # 单账号同时借出的页面数
+CONTEXT_IDLE_TTL = int(os.getenv("JIMENG_BROWSER_CONTEXT_IDLE", "300"))  # 上下文空闲回收（秒）
+BROWSER_IDLE_TTL = int(os.getenv("JIMENG_BROWSER_IDLE", "900"))          # 无上下文时关闭浏览器（秒）
+MEMORY_LIMIT_MB = int(os.getenv("JIMENG_BROWSER_MEMORY_MB", "700"))      # Chromium 进程树内存上限
+SWEEP_INTERVAL = 30
+
+
+def _cookie_fingerprint(cookie: str) -> str:
+    return hashlib.sha1(cookie.encode()).hexdigest()
+
+
+def _parse_cookie(cookie: str) -> list[dict]:
+    parsed = []
+    for part in cookie.split(";"):
+        part = part.strip()
+        if "=" in part:
+            name, _, value = part.partition("=")
+            parsed.append({"name": name.strip(), "value": value.strip(), "domain": ".jianying.com", "path": "/"})
+    return parsed
+
+
+def _descendant_rss_mb(root_pid: int) -> Optional[float]:
+    """统计 root_pid 所有子孙进程中 Chromium 相关进程的 RSS（MB）；非 Linux 返回 None"""
+    if not os.path.isdir("/proc"):
+        return None
+    children: dict[int, list[int]] = {}
+    names: dict[int, str] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # 格式: pid (comm) state ppid ...，comm 可能含空格
+        comm = stat[stat.find("(") + 1:stat.rfind(")")]
+        ppid = int(stat[stat.rfind(")") + 2:].split()[1])
+        children.setdefault(ppid, []).append(int(entry))
+        names[int(entry)] = comm
+    total_kb = 0
+    stack = list(children.get(root_pid, []))
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        if "chrom" not in names.get(pid, "") and "headless" not in names.get(pid, ""):
+            continue
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+class _AccountContext:
+    def __init__(self, account_id: str, context: BrowserContext, fingerprint: str):
+        self.account_id = account_id
+        self.context = context
+        self.fingerprint = fingerprint
+        self.idle_pages: list[Page] = []
+        self.leased = 0
+        self.slots = asyncio.Semaphore(PAGES_PER_CONTEXT)
+        self.last_used = time.monotonic()
+
+
+class JimengBrowserPool:
+    """单浏览器 + 按账号复用的上下文/页面"""
+
+    def __init__(self):
+        self._playwright = None
+        self._browser: Optional[Browser] = None
+        self._contexts: dict[str, _AccountContext] = {}
+        self._lock: Optional[asyncio.Lock] = None
+        self._sweeper: Optional[asyncio.Task] = None
+        self._browser_idle_since = time.monotonic()
+        self._launches = 0
+        self._leases = 0
+        self._page_reuses = 0
+        self._evictions = 0
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _ensure_browser(self) -> Browser:
+        if self._browser is not None and self._browser.is_connected():
+            return self._browser
+        await self._shutdown_browser()
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=True, args=LAUNCH_ARGS)
+        self._browser.on("disconnected", lambda _: self._on_disconnected())
+        self._launches += 1
+        logger.info(f"[jimeng-browser] Chromium 已启动（第{self._launches}次）")
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+        return self._browser
+
+    def _on_disconnected(self):
+        logger.warning("[jimeng-browser] Chromium 连接断开，所有上下文失效")
+        self._browser = None
+        self._contexts.clear()
+
+    async def _get_context(self, account: dict) -> _AccountContext:
+        account_id = account.get("account_id", "unknown")
+        cookie = account.get("cookie", "")
+        fingerprint = _cookie_fingerprint(cookie)
+        async with self._get_lock():
+            entry = self._contexts.get(account_id)
+            if entry and entry.fingerprint != fingerprint and entry.leased == 0:
+                # 账号重新登录过，旧上下文的 cookie 作废
+                await self._close_context(account_id)
+                entry = None
+            if entry is None:
+                await self._enforce_limits(reserve=1)
+                browser = await self._ensure_browser()
+                context = await browser.new_context(user_agent=USER_AGENT)
+                parsed = _parse_cookie(cookie)
+                if parsed:
+                    await context.add_cookies(parsed)
+                entry = _AccountContext(account_id, context, fingerprint)
+                self._contexts[account_id] = entry
+                logger.info(f"[jimeng-browser] 账号 {account_id} 上下文已创建")
+            # 在锁内登记借用，避免等待页面槽位期间被回收
+            entry.leased += 1
+            entry.last_used = time.monotonic()
+            return entry
+
+    @asynccontextmanager
+    async def page(self, account: dict, reuse: bool = True):
+        """借用该账号的一个页面；reuse=False 时用完即关（适合会改动页面状态的提交流程）"""
+        entry = await self._get_context(account)
+        page = None
+        ok = False
+        try:
+            async with entry.slots:
+                self._leases += 1
+                while entry.idle_pages:
+                    candidate = entry.idle_pages.pop()
+                    if not candidate.is_closed():
+                        page = candidate
+                        self._page_reuses += 1
+                        break
+                if page is None:
+                    page = await entry.context.new_page()
+                yield page
+                ok = True
+        finally:
+            entry.leased -= 1
+            entry.last_used = time.monotonic()
+            if page is not None and not page.is_closed():
+                if ok and reuse and self._contexts.get(entry.account_id) is entry:
+                    entry.idle_pages.append(page)
+                else:
+                    try:
+                        await page.close()
+                    except Exception:
+                        pass
+
+    async def _close_context(self, account_id: str):
+        entry = self._contexts.pop(account_id, None)
+        if entry is None:
+            return
+        self._evictions += 1
+        try:
+            await entry.context.close()
+        except Exception as e:
+            logger.debug(f"[jimeng-browser] 关闭上下文 {account_id} 异常: {e}")
+        if not self._contexts:
+            self._browser_idle_since = time.monotonic()
+
+    def _idle_contexts_lru(self) -> list[_AccountContext]:
+        return sorted((e for e in self._contexts.values() if e.leased == 0), key=lambda e: e.last_used)
+
+    async def _enforce_limits(self, reserve: int = 0):
+        """上下文数量与内存超限时回收最久未用的空闲上下文（调用方持有锁）"""
+        for entry in self._idle_contexts_lru():
+            if len(self._contexts) + reserve <= MAX_CONTEXTS:
+                break
+            logger.info(f"[jimeng-browser] 上下文数量超限，回收账号 {entry.account_id}")
+            await self._close_context(entry.account_id)
+
+        rss = _descendant_rss_mb(os.getpid())
+        if rss is None or rss <= MEMORY_LIMIT_MB:
+            return
+        for entry in self._idle_contexts_lru():
+            logger.warning(f"[jimeng-browser] Chromium 内存 {rss:.0f}MB 超过上限，回收账号 {entry.account_id}")
+            await self._close_context(entry.account_id)
+            rss = _descendant_rss_mb(os.getpid()) or 0
+            if rss <= MEMORY_LIMIT_MB:
+                return
+        if not any(e.leased for e in self._contexts.values()) and self._browser is not None:
+            # 只剩浏览器本身仍超限（内存泄漏/碎片），整体重启
+            logger.warning(f"[jimeng-browser] Chromium 内存 {rss:.0f}MB 仍超限，重启浏览器")
+            await self._shutdown_browser()
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(SWEEP_INTERVAL)
+            try:
+                async with self._get_lock():
+                    now = time.monotonic()
+                    for entry in self._idle_contexts_lru():
+                        if now - entry.last_used > CONTEXT_IDLE_TTL:
+                            logger.info(f"[jimeng-browser] 账号 {entry.account_id} 上下文空闲超时，回收")
+                            await self._close_context(entry.account_id)
+                    await self._enforce_limits()
+                    if (self._browser is not None and not self._contexts
+                            and now - self._browser_idle_since > BROWSER_IDLE_TTL):
+                        logger.info("[jimeng-browser] 浏览器空闲超时，关闭")
+                        await self._shutdown_browser()
+            except Exception as e:
+                logger.warning(f"[jimeng-browser] 回收检查异常: {e}")
+
+    async def _shutdown_browser(self):
+        for account_id in list(self._contexts):
+            await self._close_context(account_id)
+        if self._browser is not None:
+            try:
+                await self._browser.close()
+            except Exception:
+                pass
+            self._browser = None
+        if self._playwright is not None:
+            try:
+                await self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+        async with self._get_lock():
+            await self._shutdown_browser()
+
+    def stats(self) -> dict:
+        return {
+            "browser_running": self._browser is not None and self._browser.is_connected(),
+            "launches": self._launches,
+            "leases": self._leases,
+            "page_reuses": self._page_reuses,
+            "evictions": self._evictions,
+            "memory_mb": round(_descendant_rss_mb(os.getpid()) or 0, 1),
+            "memory_limit_mb": MEMORY_LIMIT_MB,
+            "contexts": {
+                account_id: {
+                    "leased": e.leased,
+                    "idle_pages": len(e.idle_pages),
+                    "idle_seconds": int(time.monotonic() - e.last_used),
+                }
+                for account_id, e in self._contexts.items()
+            },
+        }
+
+
+# 全局单例
+jimeng_browser_pool = JimengBrowserPool()
@@ -0,0 +1,157 @@
+"""
+即梦 HTTP API 客户端
+直接请求网页端使用的 mweb 接口，无需 Playwright 浏览器；失败时由调用方回退到浏览器。
+
+签名（网页端 Sign 请求头）:
+  sign = md5("9e2c|" + uri[-7:] + "|" + 平台码 + "|" + 版本号 + "|" + device_time + "||11ac")
+"""
+import hashlib
+import logging
+import os
+import random
+import time
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# ============ 常量 ============
+
+BASE_URL = "https://jimeng.jianying.com"
+ASSET_LIST_PATH = "/mweb/v1/get_asset_list"
+APP_ID = "513695"
+APP_VERSION = "5.8.0"
+PLATFORM_CODE = "7"
+DEFAULT_UA = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36"
+)
+
+DIRECT_API_ENABLED = os.getenv("JIMENG_DIRECT_API", "1") == "1"
+FAILURE_COOLDOWN = 600   # 直连失败后该账号回退浏览器的时长（秒），避免每次扫描都白请求一次
+ASSET_PAGE_SIZE = 30
+
+
+class JimengApiError(RuntimeError):
+    pass
+
+
+# ============ 签名工具 ============
+
+def _md5(s: str) -> str:
+    return hashlib.md5(s.encode()).hexdigest()
+
+
+def _sign(uri: str, device_time: str) -> str:
+    return _md5(f"9e2c|{uri[-7:]}|{PLATFORM_CODE}|{APP_VERSION}|{device_time}||11ac")
+
+
+def _cookie_value(cookie: str, key: str) -> str:
+    for part in cookie.split(";"):
+        name, _, value = part.strip().partition("=")
+        if name == key:
+            return value
+    return ""
+
+
+# ============ 共享连接 ============
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """所有账号共用的长连接客户端；cookie 通过请求头传入，jar 拒绝保存任何 Set-Cookie"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            timeout=15,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=5, keepalive_expiry=60.0),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        )
+    return _http_client
+
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# ============ API 客户端 ============
+
+class JimengApiClient:
+    """单个即梦账号的接口调用"""
+
+    def __init__(self, cookie: str):
+        self.cookie = cookie
+        self.web_id = _cookie_value(cookie, "_tea_web_id") or str(random.randint(10**18, 10**19 - 1))
+
+    def _headers(self, uri: str) -> dict:
+        device_time = str(int(time.time()))
+        return {
+            "Accept": "application/json, text/plain, */*",
+            "Content-Type": "application/json",
+            "Appid": APP_ID,
+            "Appvr": APP_VERSION,
+            "Pf": PLATFORM_CODE,
+            "Device-Time": device_time,
+            "Sign": _sign(uri, device_time),
+            "Sign-Ver": "1",
+            "Origin": BASE_URL,
+            "Referer": f"{BASE_URL}/ai-tool/generate?type=video",
+            "User-Agent": DEFAULT_UA,
+            "Cookie": self.cookie,
+        }
+
+    def _params(self) -> dict:
+        return {
+            "aid": APP_ID,
+            "device_platform": "web",
+            "region": "CN",
+            "web_id": self.web_id,
+        }
+
+    async def _post(self, uri: str, body: dict) -> dict:
+        resp = await _get_http_client().post(uri, params=self._params(), headers=self._headers(uri), json=body)
+        if resp.status_code != 200:
+            raise JimengApiError(f"{uri} HTTP {resp.status_code}")
+        data = resp.json()
+        if str(data.get("ret", "0")) != "0":
+            raise JimengApiError(f"{uri} ret={data.get('ret')} errmsg={data.get('errmsg')}")
+        return data.get("data") or {}
+
+    async def get_asset_list(self, count: int = ASSET_PAGE_SIZE) -> list[dict]:
+        """最近生成的资产（与网页生成页加载的 get_asset_list 一致），按时间倒序"""
+        data = await self._post(ASSET_LIST_PATH, {
+            "count": count,
+            "direction": 1,
+            "mode": "workbench",
+            "option": {
+                "origin_image_info": {"width": 96, "format": "webp"},
+                "only_favorited": False,
+                "end_time_stamp": 0,
+            },
+        })
+        if "asset_list" not in data:
+            raise JimengApiError(f"{ASSET_LIST_PATH} 响应缺少 asset_list")
+        return data["asset_list"] or []
+
+
+# ============ 直连熔断 ============
+
+_failed_until: dict[str, float] = {}
+
+
+def direct_api_available(account_id: str) -> bool:
+    """该账号当前是否尝试直连（全局开关打开且不在失败冷却期内）"""
+    return DIRECT_API_ENABLED and _failed_until.get(account_id, 0) <= time.monotonic()
+
+
+def mark_direct_api_failed(account_id: str, error: Exception):
+    _failed_until[account_id] = time.monotonic() + FAILURE_COOLDOWN
+    logger.warning(f"[jimeng-api] 账号 {account_id} 直连失败，{FAILURE_COOLDOWN}s 内回退浏览器: {error}")
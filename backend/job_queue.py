@@ -0,0 +1,374 @@
+"""
+持久化订单任务队列
+替代 asyncio.create_task 的即发即弃：任务写入 orderjob 表，由固定大小的 worker 池
+通过单条原子 UPDATE 领取（带租约），进程重启后租约过期的任务会被重新领取。
+
+轮询/等待类任务每次只检查一次：处理函数返回秒数表示订单尚未结束，任务按该延迟重新排队，
+不占用 worker 等待上游生成。因此 worker 数限制的是同时进行的提交/检查数，而不是进行中的订单数。
+"""
+import asyncio
+import json
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import DateTime, bindparam, text
+from sqlmodel import Session, select
+
+from backend.models import OrderJob, engine, run_in_session
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 60           # 租约时长，运行中每 1/3 租约续期一次
+IDLE_SLEEP = 2.0             # 队列为空时的最长等待
+RETRY_BACKOFF_BASE = 5       # 失败重试退避（秒）：5, 10, 20 ...
+RETRY_BACKOFF_MAX = 300
+ACTIVE_STATES = ("queued", "leased")
+
+# worker 池：名称 -> (任务类型, 并发数)
+POOLS: dict[str, tuple[tuple[str, ...], int]] = {
+    "submit": (("hailuo_submit",), int(os.getenv("JOB_SUBMIT_WORKERS", "4"))),
+    # 每个任务只做一次检查，占用 worker 的时间是一次上游请求而不是整个生成过程
+    "poll": (("hailuo_poll", "kling_poll", "jimeng_poll", "gptimage_poll"), int(os.getenv("JOB_POLL_WORKERS", "32"))),
+    # 只负责提交（Playwright），提交后转为 jimeng_poll
+    "jimeng": (("jimeng_process",), int(os.getenv("JOB_JIMENG_WORKERS", "3"))),
+    # 只负责创建 NOVART 任务（受速率限制器和调度器放行名额约束），创建后转为 gptimage_poll
+    "gptimage": (("gptimage_generate",), int(os.getenv("JOB_GPTIMAGE_WORKERS", "4"))),
+}
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_CLAIM_SQL = text(
+    """
+    UPDATE orderjob
+    SET state = 'leased', lease_owner = :owner, lease_expires_at = :lease_until,
+        attempts = attempts + 1, updated_at = :now
+    WHERE id = (
+        SELECT id FROM orderjob
+        WHERE kind IN :kinds
+          AND attempts < max_attempts
+          AND ((state = 'queued' AND next_run_at <= :now)
+               OR (state = 'leased' AND lease_expires_at < :now))
+        ORDER BY next_run_at, id
+        LIMIT 1{row_lock}
+    )
+    RETURNING id, kind, order_id, payload, attempts, max_attempts
+    """.format(
+        # PostgreSQL 并发领取时跳过其他 worker 正在更新的行，避免同一任务被领取两次
+        row_lock="" if engine.dialect.name == "sqlite" else "\n        FOR UPDATE SKIP LOCKED"
+    )
+).bindparams(
+    bindparam("kinds", expanding=True),
+    bindparam("now", type_=DateTime),
+    bindparam("lease_until", type_=DateTime),
+)
+
+
+async def _run_handler(kind: str, order_id: int, payload: dict) -> Optional[float]:
+    """
+    按任务类型分发到对应的处理协程（延迟导入，避免循环依赖）
+    返回 None 表示任务完成；返回秒数表示订单未结束，任务在该时间后再次执行
+    """
+    if kind == "hailuo_submit":
+        from backend.order_worker import submit_order
+        await submit_order(order_id)
+    elif kind == "hailuo_poll":
+        from backend.order_worker import poll_order_status
+        return await poll_order_status(order_id, acc_id=payload.get("acc_id"), started_at=payload.get("started_at"))
+    elif kind == "kling_poll":
+        from backend.order_worker import poll_kling_order
+        return await poll_kling_order(order_id, acc_id=payload.get("acc_id"), started_at=payload.get("started_at"))
+    elif kind == "jimeng_process":
+        from backend.jimeng_background import process_jimeng_order
+        await process_jimeng_order(order_id)
+    elif kind == "jimeng_poll":
+        from backend.jimeng_background import poll_jimeng_order
+        return await poll_jimeng_order(
+            order_id, account_id=payload.get("account_id"), started_at=payload.get("started_at")
+        )
+    elif kind == "gptimage_generate":
+        from backend.gptimage_api import generate_image
+        await generate_image(order_id)
+    elif kind == "gptimage_poll":
+        from backend.gptimage_api import poll_gptimage_order
+        return await poll_gptimage_order(order_id, started_at=payload.get("started_at"))
+    else:
+        raise ValueError(f"未知任务类型: {kind}")
+    return None
+
+
+def _pool_for_kind(kind: str) -> Optional[str]:
+    for name, (kinds, _) in POOLS.items():
+        if kind in kinds:
+            return name
+    return None
+
+
+class JobQueue:
+    """orderjob 表之上的 worker 池"""
+
+    def __init__(self):
+        self._workers: list[asyncio.Task] = []
+        self._wakeups: dict[str, asyncio.Event] = {}
+        self._running = False
+
+    # ---- 入队 ----
+
+    async def enqueue(self, kind: str, order_id: int, payload: Optional[dict] = None,
+                      delay: float = 0, max_attempts: int = 3) -> int:
+        """
+        写入任务；同一订单同类型已有未完成任务时直接返回已有任务 ID
+        （已有任务排在更晚执行时提前到本次指定的时间，如手动触发扫描）
+        """
+        if _pool_for_kind(kind) is None:
+            raise ValueError(f"未知任务类型: {kind}")
+        run_at = datetime.utcnow() + timedelta(seconds=delay)
+        job_id, changed = await run_in_session(self._insert, kind, order_id, payload, run_at, max_attempts)
+        if changed:
+            self._wake(kind)
+        return job_id
+
+    @staticmethod
+    def _insert(session: Session, kind: str, order_id: int, payload: Optional[dict],
+                run_at: datetime, max_attempts: int) -> tuple[int, bool]:
+        """返回 (任务 ID, 是否新建或提前)"""
+        existing = session.exec(
+            select(OrderJob).where(
+                OrderJob.kind == kind,
+                OrderJob.order_id == order_id,
+                OrderJob.state.in_(ACTIVE_STATES),
+            )
+        ).first()
+        if existing:
+            if existing.state == "queued" and existing.next_run_at > run_at:
+                existing.next_run_at = run_at
+                session.add(existing)
+                session.commit()
+                return existing.id, True
+            return existing.id, False
+        job = OrderJob(
+            kind=kind,
+            order_id=order_id,
+            payload=json.dumps(payload, ensure_ascii=False) if payload else None,
+            max_attempts=max_attempts,
+            next_run_at=run_at,
+        )
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+        logger.info(f"[queue] 入队 job#{job.id} {kind} 订单#{order_id}")
+        return job.id, True
+
+    def _wake(self, kind: str):
+        event = self._wakeups.get(_pool_for_kind(kind))
+        if event:
+            event.set()
+
+    # ---- 领取 / 完成 ----
+
+    # _insert / _claim / _renew / _finish 都通过 run_in_session 执行，不阻塞事件循环
+
+    @staticmethod
+    def _claim(session: Session, kinds: tuple[str, ...]) -> Optional[dict]:
+        now = datetime.utcnow()
+        row = session.execute(_CLAIM_SQL, {
+            "owner": WORKER_ID,
+            "now": now,
+            "lease_until": now + timedelta(seconds=LEASE_SECONDS),
+            "kinds": list(kinds),
+        }).first()
+        session.commit()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "order_id": row[2],
+            "payload": json.loads(row[3]) if row[3] else {},
+            "attempts": row[4],
+            "max_attempts": row[5],
+        }
+
+    @staticmethod
+    def _renew(session: Session, job_id: int):
+        job = session.get(OrderJob, job_id)
+        if job and job.state == "leased" and job.lease_owner == WORKER_ID:
+            job.lease_expires_at = datetime.utcnow() + timedelta(seconds=LEASE_SECONDS)
+            session.add(job)
+            session.commit()
+
+    @staticmethod
+    def _finish(session: Session, job_id: int, error: Optional[str] = None, rerun_in: Optional[float] = None):
+        job = session.get(OrderJob, job_id)
+        if not job:
+            return
+        job.lease_owner = None
+        job.lease_expires_at = None
+        job.updated_at = datetime.utcnow()
+        if error is None and rerun_in is not None:
+            # 订单未结束：按处理函数给出的延迟再次检查，不计入失败次数
+            job.state = "queued"
+            job.attempts = 0
+            job.last_error = None
+            job.next_run_at = datetime.utcnow() + timedelta(seconds=rerun_in)
+        elif error is None:
+            job.state = "done"
+            job.last_error = None
+        elif job.attempts >= job.max_attempts:
+            job.state = "failed"
+            job.last_error = error[:500]
+        else:
+            backoff = min(RETRY_BACKOFF_MAX, RETRY_BACKOFF_BASE * 2 ** (job.attempts - 1))
+            job.state = "queued"
+            job.last_error = error[:500]
+            job.next_run_at = datetime.utcnow() + timedelta(seconds=backoff)
+        session.add(job)
+        session.commit()
+
+    # ---- worker ----
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            try:
+                await run_in_session(self._renew, job_id)
+            except Exception as e:
+                logger.warning(f"[queue] job#{job_id} 续租失败: {e}")
+
+    async def _worker(self, pool: str, kinds: tuple[str, ...]):
+        wakeup = self._wakeups[pool]
+        while self._running:
+            try:
+                job = await run_in_session(self._claim, kinds)
+            except Exception as e:
+                logger.error(f"[queue] 领取任务失败: {e}")
+                job = None
+            if not job:
+                wakeup.clear()
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout=IDLE_SLEEP)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            logger.info(
+                f"[queue] 执行 job#{job['id']} {job['kind']} 订单#{job['order_id']} "
+                f"(第{job['attempts']}/{job['max_attempts']}次)"
+            )
+            heartbeat = asyncio.create_task(self._heartbeat(job["id"]))
+            error = None
+            rerun_in = None
+            try:
+                rerun_in = await _run_handler(job["kind"], job["order_id"], job["payload"])
+            except asyncio.CancelledError:
+                heartbeat.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"[queue] job#{job['id']} 执行异常: {e}", exc_info=True)
+                error = str(e) or type(e).__name__
+            finally:
+                heartbeat.cancel()
+            try:
+                await run_in_session(self._finish, job["id"], error, rerun_in)
+            except Exception as e:
+                # 未写回的任务租约到期后会被重新领取
+                logger.error(f"[queue] job#{job['id']} 状态写回失败: {e}")
+
+    def start(self):
+        """按 POOLS 配置启动 worker（需在事件循环中调用）"""
+        if self._running:
+            return
+        self._running = True
+        for pool, (kinds, size) in POOLS.items():
+            self._wakeups[pool] = asyncio.Event()
+            for _ in range(max(1, size)):
+                self._workers.append(asyncio.create_task(self._worker(pool, kinds)))
+        logger.info(f"[queue] worker 已启动: {WORKER_ID}, " + ", ".join(
+            f"{pool}={size}" for pool, (_, size) in POOLS.items()
+        ))
+
+    async def stop(self):
+        """停止 worker，并把本进程持有的租约立即放回队列"""
+        self._running = False
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        released = await run_in_session(self._release_leases)
+        logger.info(f"[queue] worker 已停止，归还租约 {released} 个")
+
+    @staticmethod
+    def _release_leases(session: Session) -> int:
+        jobs = session.exec(
+            select(OrderJob).where(OrderJob.state == "leased", OrderJob.lease_owner == WORKER_ID)
+        ).all()
+        for job in jobs:
+            # 被中断不算一次失败
+            job.state = "queued"
+            job.attempts = max(0, job.attempts - 1)
+            job.lease_owner = None
+            job.lease_expires_at = None
+            job.next_run_at = datetime.utcnow()
+            session.add(job)
+        session.commit()
+        return len(jobs)
+
+    # ---- 运维 ----
+
+    def recover(self) -> int:
+        """启动时把租约已过期且重试次数用尽的任务标记为 failed，返回数量"""
+        now = datetime.utcnow()
+        with Session(engine) as session:
+            jobs = session.exec(
+                select(OrderJob).where(
+                    OrderJob.state == "leased",
+                    OrderJob.lease_expires_at < now,
+                    OrderJob.attempts >= OrderJob.max_attempts,
+                )
+            ).all()
+            for job in jobs:
+                job.state = "failed"
+                job.last_error = job.last_error or "租约过期且重试次数用尽"
+                job.lease_owner = None
+                job.updated_at = now
+                session.add(job)
+            session.commit()
+        return len(jobs)
+
+    def purge_finished(self, days: int = 7) -> int:
+        """清理 N 天前已结束的任务记录"""
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        with Session(engine) as session:
+            jobs = session.exec(
+                select(OrderJob).where(
+                    OrderJob.state.in_(("done", "failed")),
+                    OrderJob.updated_at < cutoff,
+                )
+            ).all()
+            for job in jobs:
+                session.delete(job)
+            session.commit()
+        return len(jobs)
+
+    def stats(self) -> dict:
+        """各任务类型/状态计数"""
+        with Session(engine) as session:
+            rows = session.execute(
+                text("SELECT kind, state, COUNT(*) FROM orderjob GROUP BY kind, state")
+            ).all()
+        counts: dict = {}
+        for kind, state, n in rows:
+            counts.setdefault(kind, {})[state] = n
+        return {
+            "worker_id": WORKER_ID,
+            "running": self._running,
+            "pools": {pool: size for pool, (_, size) in POOLS.items()},
+            "jobs": counts,
+        }
+
+
+# 全局单例
+job_queue = JobQueue()
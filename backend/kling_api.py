@@ -17,6 +17,8 @@ import os
 import random
 import string
 import time
+from contextlib import asynccontextmanager
+from http.cookiejar import CookieJar, DefaultCookiePolicy
 from pathlib import Path
 from typing import Optional
 
@@ -30,6 +32,7 @@ logger = logging.getLogger(__name__)
 ID_BASE = "https://id.klingai.com"
 APP_BASE = "https://app.klingai.com"
 WEB_BASE = "https://klingai.com"
+API_BASE = "https://api-app-cn.klingai.com"  # 签名接口所在域名（sign_server 生成的 signedUrl）
 DEFAULT_UA = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
     "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -482,32 +485,98 @@ async def mobile_code_login(
     }
 
 
+# ============ 共享 HTTP 连接池 ============
+# 业务接口（签名请求、上传、积分查询等）共用一个长连接客户端，避免每次请求都做 TLS 握手。
+# 登录流程（扫码、验证码、passToken 刷新）依赖各自的会话 cookie，仍使用独立客户端。
+
+API_MAX_CONNECTIONS = int(os.getenv("KLING_API_MAX_CONNECTIONS", "20"))
+OTHER_MAX_CONNECTIONS = int(os.getenv("KLING_OTHER_MAX_CONNECTIONS", "10"))
+KEEPALIVE_EXPIRY = 60.0
+
+try:
+    import h2  # noqa: F401
+    HTTP2_ENABLED = True
+except ImportError:
+    HTTP2_ENABLED = False
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def _no_cookie_jar() -> CookieJar:
+    """不保存任何 Set-Cookie 的 cookie jar：各账号的 cookie 通过请求头传入，不能在共享客户端里串号"""
+    return CookieJar(policy=DefaultCookiePolicy(allowed_domains=[]))
+
+
+def _get_http_client() -> httpx.AsyncClient:
+    """懒加载共享客户端；API 域名与其他域名（上传节点、CDN）各自一个连接池"""
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        api_transport = httpx.AsyncHTTPTransport(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=API_MAX_CONNECTIONS,
+                max_keepalive_connections=API_MAX_CONNECTIONS // 2,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2_ENABLED,
+            limits=httpx.Limits(
+                max_connections=OTHER_MAX_CONNECTIONS,
+                max_keepalive_connections=OTHER_MAX_CONNECTIONS // 2,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+            mounts={API_BASE: api_transport},
+            cookies=_no_cookie_jar(),
+        )
+        logger.info(f"[kling-http] 共享客户端已创建 (http2={HTTP2_ENABLED})")
+    return _http_client
+
+
+class _SharedClientView:
+    """共享客户端的轻量视图：每次请求带上调用方指定的超时"""
+
+    def __init__(self, client: httpx.AsyncClient, timeout: float):
+        self._client = client
+        self._timeout = timeout
+
+    async def get(self, url, **kwargs) -> httpx.Response:
+        kwargs.setdefault("timeout", self._timeout)
+        return await self._client.get(url, **kwargs)
+
+    async def post(self, url, **kwargs) -> httpx.Response:
+        kwargs.setdefault("timeout", self._timeout)
+        return await self._client.post(url, **kwargs)
+
+
+@asynccontextmanager
+async def _kling_http(timeout: float = 15):
+    """用法同 httpx.AsyncClient(timeout=...)，但退出时不关闭连接"""
+    yield _SharedClientView(_get_http_client(), timeout)
+
+
+async def close_http_client():
+    """应用关闭时释放共享连接池"""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
 async def _sign_url(url_path: str, query: dict = None, request_body: dict = None) -> str:
     """
-    调用 Node.js sign_cli.js 生成带签名的完整 URL。
+    通过常驻 Node.js 签名进程池（sign_server.js）生成带签名的完整 URL。
     返回 signedUrl，形如 https://api-app-cn.klingai.com/api/...?__NS_hxfalcon=...&caver=2&key=val...
     注意: sign_cli 生成的 signedUrl 只包含 __NS_hxfalcon 和 caver，
     额外的 query 参数需要手动追加。
     """
-    import asyncio
-    import json as _json
     from urllib.parse import urlencode
+    from backend.kling_signer import signer_pool
 
-    sign_cli = Path(__file__).parent.parent / "可灵逆向" / "sign_cli.js"
     sign_input = {"url": url_path, "query": query or {}}
     if request_body:
         sign_input["requestBody"] = request_body
-    payload = _json.dumps(sign_input)
-    proc = await asyncio.create_subprocess_exec(
-        "node", str(sign_cli),
-        stdin=asyncio.subprocess.PIPE,
-        stdout=asyncio.subprocess.PIPE,
-        stderr=asyncio.subprocess.PIPE,
-    )
-    stdout, stderr = await asyncio.wait_for(proc.communicate(payload.encode()), timeout=10)
-    if proc.returncode != 0:
-        raise RuntimeError(f"sign_cli error: {stderr.decode()}")
-    result = _json.loads(stdout.decode().strip())
+    result = await signer_pool.sign(sign_input)
     signed_url = result["signedUrl"]
     # 追加额外的 query 参数到签名URL后面
     if query:
@@ -524,7 +593,7 @@ async def check_login(cookie: str) -> bool:
             "pageDirection": "NEXT", "extra": "BASE_WORK",
         })
         headers = {**_make_headers(), "Cookie": cookie}
-        async with httpx.AsyncClient(timeout=10) as client:
+        async with _kling_http(timeout=10) as client:
             resp = await client.get(signed_url, headers=headers)
             logger.debug(f"[check_login] feeds HTTP {resp.status_code}")
             if resp.status_code == 401:
@@ -558,7 +627,7 @@ async def upload_image(cookie: str, image_path: str) -> str:
 
     # 1. 获取上传 token
     signed_issue = await _sign_url("/api/upload/issue/token", {"filename": filename})
-    async with httpx.AsyncClient(timeout=15) as client:
+    async with _kling_http(timeout=15) as client:
         r = await client.get(signed_issue, headers={**_make_headers(), "Cookie": cookie})
         r.raise_for_status()
         issue_data = r.json()
@@ -572,7 +641,7 @@ async def upload_image(cookie: str, image_path: str) -> str:
     upload_headers = {"x-token": upload_token, "User-Agent": DEFAULT_UA}
 
     # 2. 上传文件（POST fragment）
-    async with httpx.AsyncClient(timeout=60) as client:
+    async with _kling_http(timeout=60) as client:
         r = await client.post(
             f"{upload_base}/api/upload/fragment",
             headers={**upload_headers, "Content-Type": "application/octet-stream"},
@@ -586,7 +655,7 @@ async def upload_image(cookie: str, image_path: str) -> str:
         raise RuntimeError(f"upload fragment failed: {frag_data}")
 
     # 3. 通知上传完成（POST complete）
-    async with httpx.AsyncClient(timeout=15) as client:
+    async with _kling_http(timeout=15) as client:
         r = await client.post(
             f"{upload_base}/api/upload/complete",
             headers=upload_headers,
@@ -604,7 +673,7 @@ async def upload_image(cookie: str, image_path: str) -> str:
         signed_verify = await _sign_url("/api/upload/verify/token", {
             "token": upload_token, "type": "image"
         })
-        async with httpx.AsyncClient(timeout=15) as client:
+        async with _kling_http(timeout=15) as client:
             r = await client.get(signed_verify, headers={**_make_headers(), "Cookie": cookie})
             r.raise_for_status()
             verify_data = r.json()
@@ -708,7 +777,7 @@ async def submit_task(
     signed_price_url = await _sign_url("/api/task/price", request_body=price_body)
     headers = {**_make_headers(), "Cookie": cookie, "Content-Type": "application/json"}
     show_price = 0
-    async with httpx.AsyncClient(timeout=15) as client:
+    async with _kling_http(timeout=15) as client:
         try:
             pr = await client.post(signed_price_url, headers=headers, json=price_body)
             pr.raise_for_status()
@@ -723,7 +792,7 @@ async def submit_task(
         body["arguments"].append({"name": "showPrice", "value": show_price})
 
     signed_url = await _sign_url("/api/task/submit", request_body=body)
-    async with httpx.AsyncClient(timeout=30) as client:
+    async with _kling_http(timeout=30) as client:
         r = await client.post(signed_url, headers=headers, json=body)
         r.raise_for_status()
         data = r.json()
@@ -743,7 +812,7 @@ async def get_task_status(cookie: str, task_id: str) -> dict:
     """Fetch Kling task status once and normalize the first work payload."""
     signed_url = await _sign_url("/api/task/status", {"taskId": task_id})
     headers = {**_make_headers(), "Cookie": cookie}
-    async with httpx.AsyncClient(timeout=15) as client:
+    async with _kling_http(timeout=15) as client:
         r = await client.get(signed_url, headers=headers)
         r.raise_for_status()
         data = r.json()
@@ -891,7 +960,7 @@ async def lip_sync_tts(
         "origin": "https://app.klingai.com",
         "referer": "https://app.klingai.com/",
     }
-    async with httpx.AsyncClient(timeout=30) as client:
+    async with _kling_http(timeout=30) as client:
         resp = await client.post(signed_url, headers=headers, json=body)
         resp.raise_for_status()
         data = resp.json()
@@ -963,7 +1032,7 @@ async def submit_lip_sync_task(
 
     show_price = 0
     signed_price_url = await _sign_url("/api/task/price", request_body=body)
-    async with httpx.AsyncClient(timeout=20) as client:
+    async with _kling_http(timeout=20) as client:
         try:
             price_resp = await client.post(signed_price_url, headers=headers, json=body)
             price_resp.raise_for_status()
@@ -976,7 +1045,7 @@ async def submit_lip_sync_task(
         body["arguments"].append({"name": "showPrice", "value": show_price})
 
     signed_submit_url = await _sign_url("/api/task/submit", request_body=body)
-    async with httpx.AsyncClient(timeout=30) as client:
+    async with _kling_http(timeout=30) as client:
         submit_resp = await client.post(signed_submit_url, headers=headers, json=body)
         submit_resp.raise_for_status()
         submit_data = submit_resp.json()
@@ -1011,7 +1080,7 @@ async def get_lip_sync_status(cookie: str, task_id: str) -> dict:
         "referer": f"https://klingai.com/app/ai-human/video/{task_id}",
     }
 
-    async with httpx.AsyncClient(timeout=20) as client:
+    async with _kling_http(timeout=20) as client:
         resp = await client.get(signed_url, headers=headers)
         resp.raise_for_status()
         data = resp.json()
@@ -1081,7 +1150,7 @@ async def download_creative(cookie: str, creative_id: str) -> str:
     }
     signed_url = await _sign_url("/api/creatives/download", request_body=body)
     headers = {**_make_headers(), "Cookie": cookie, "Content-Type": "application/json"}
-    async with httpx.AsyncClient(timeout=30) as client:
+    async with _kling_http(timeout=30) as client:
         r = await client.post(signed_url, headers=headers, json=body)
         r.raise_for_status()
         data = r.json()
@@ -1136,7 +1205,7 @@ async def get_user_points(cookie: str) -> dict:
     })
     logger.info(f"[points] cookie长度={len(cookie)}, cookie前50={cookie[:50]}...")
     headers = {**_make_headers(), "Cookie": cookie}
-    async with httpx.AsyncClient(timeout=15) as client:
+    async with _kling_http(timeout=15) as client:
         r = await client.get(signed_url, headers=headers)
         logger.info(f"[points] HTTP {r.status_code}, resp_len={len(r.text)}")
         if r.status_code == 401:
@@ -1166,7 +1235,7 @@ async def init_remove_watermark(cookie: str):
     path1 = "/api/user/extra-details/user_remove_aigc_watermark"
     try:
         signed_get = await _sign_url(path1)
-        async with httpx.AsyncClient(timeout=15) as client:
+        async with _kling_http(timeout=15) as client:
             r = await client.get(signed_get, headers=headers)
         logger.info(f"[watermark] GET user_remove_aigc_watermark: {r.json()}")
     except Exception as e:
@@ -1174,7 +1243,7 @@ async def init_remove_watermark(cookie: str):
 
     try:
         signed_post = await _sign_url(path1, request_body=body)
-        async with httpx.AsyncClient(timeout=15) as client:
+        async with _kling_http(timeout=15) as client:
             r = await client.post(signed_post, headers=post_headers, json=body)
         logger.info(f"[watermark] POST user_remove_aigc_watermark=true: {r.json()}")
     except Exception as e:
@@ -1184,7 +1253,7 @@ async def init_remove_watermark(cookie: str):
     path2 = "/api/user/extra-details/user_watermark_switch"
     try:
         signed_post2 = await _sign_url(path2, request_body=body)
-        async with httpx.AsyncClient(timeout=15) as client:
+        async with _kling_http(timeout=15) as client:
             r = await client.post(signed_post2, headers=post_headers, json=body)
         logger.info(f"[watermark] POST user_watermark_switch=true: {r.json()}")
     except Exception as e:
@@ -0,0 +1,290 @@
+"""
+可灵签名进程池
+常驻若干个 node sign_server.js 进程，通过 stdin/stdout 的 NDJSON 协议签名，按请求 id 多路复用；
+定时 ping 做健康检查，进程退出/无响应/服务次数达到上限时自动重启。
+签名从每次冷启动 node（数百毫秒）降到毫秒级。
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SIGNER_DIR = Path(__file__).parent.parent / "可灵逆向"
+SIGN_SERVER = SIGNER_DIR / "sign_server.js"
+SIGN_CLI = SIGNER_DIR / "sign_cli.js"
+
+POOL_SIZE = int(os.getenv("KLING_SIGNER_WORKERS", "2"))
+START_TIMEOUT = 10         # 等待进程输出 ready 的秒数
+SIGN_TIMEOUT = 10          # 单次签名超时
+HEALTH_INTERVAL = 30       # 健康检查间隔
+PING_TIMEOUT = 5
+MAX_REQUESTS = 20000       # 单个进程服务次数上限，达到后换新进程（防止 SDK 内存增长）
+STREAM_LIMIT = 1024 * 1024  # stdout 单行上限
+
+
+class SignerError(RuntimeError):
+    pass
+
+
+class _SignerProcess:
+    """单个常驻签名进程"""
+
+    def __init__(self):
+        self.proc: Optional[asyncio.subprocess.Process] = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._reader: Optional[asyncio.Task] = None
+        self._stderr: Optional[asyncio.Task] = None
+        self.dead = False
+        self.served = 0
+        self.started_at = 0.0
+
+    @property
+    def alive(self) -> bool:
+        return not self.dead and self.proc is not None and self.proc.returncode is None
+
+    @property
+    def inflight(self) -> int:
+        return len(self._pending)
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            "node", str(SIGN_SERVER),
+            cwd=str(SIGNER_DIR),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+            limit=STREAM_LIMIT,
+        )
+        try:
+            line = await asyncio.wait_for(self.proc.stdout.readline(), timeout=START_TIMEOUT)
+            if not json.loads(line or b"{}").get("ready"):
+                raise SignerError(f"签名进程启动失败: {line[:200]!r}")
+        except Exception:
+            await self.close()
+            raise
+        self.started_at = time.monotonic()
+        self._reader = asyncio.create_task(self._read_loop())
+        self._stderr = asyncio.create_task(self._drain_stderr())
+
+    async def _read_loop(self):
+        try:
+            while True:
+                line = await self.proc.stdout.readline()
+                if not line:
+                    break
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    logger.warning(f"[kling-signer] 无法解析的输出: {line[:200]!r}")
+                    continue
+                fut = self._pending.pop(msg.get("id"), None)
+                if fut and not fut.done():
+                    fut.set_result(msg)
+        except Exception as e:
+            logger.warning(f"[kling-signer] 读取签名进程输出异常: {e}")
+        finally:
+            self._mark_dead("签名进程已退出")
+
+    async def _drain_stderr(self):
+        # SDK 会往 stderr 打日志，必须持续读走，否则管道写满会阻塞 node
+        while True:
+            line = await self.proc.stderr.readline()
+            if not line:
+                return
+            logger.debug(f"[kling-signer] node: {line.decode(errors='replace').rstrip()}")
+
+    def _mark_dead(self, reason: str):
+        self.dead = True
+        pending, self._pending = self._pending, {}
+        for fut in pending.values():
+            if not fut.done():
+                fut.set_exception(SignerError(reason))
+
+    async def request(self, payload: dict, timeout: float = SIGN_TIMEOUT) -> dict:
+        if not self.alive:
+            raise SignerError("签名进程不可用")
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = fut
+        try:
+            self.proc.stdin.write((json.dumps({**payload, "id": req_id}) + "\n").encode())
+            await self.proc.stdin.drain()
+            msg = await asyncio.wait_for(fut, timeout=timeout)
+        except (BrokenPipeError, ConnectionResetError) as e:
+            self._mark_dead(f"签名进程管道断开: {e}")
+            raise SignerError(f"签名进程管道断开: {e}")
+        finally:
+            self._pending.pop(req_id, None)
+        if not msg.get("ok"):
+            raise SignerError(f"sign_server error: {msg.get('error')}")
+        return msg
+
+    async def close(self):
+        self.dead = True
+        if self.proc and self.proc.returncode is None:
+            try:
+                self.proc.stdin.close()
+                await asyncio.wait_for(self.proc.wait(), timeout=2)
+            except Exception:
+                try:
+                    self.proc.kill()
+                    await self.proc.wait()
+                except ProcessLookupError:
+                    pass
+        for task in (self._reader, self._stderr):
+            if task:
+                task.cancel()
+        self._mark_dead("签名进程已关闭")
+
+
+class KlingSignerPool:
+    """签名进程池：按在途请求数最少选择进程，进程异常时自动替换"""
+
+    def __init__(self, size: int = POOL_SIZE):
+        self.size = max(1, size)
+        self._procs: list[_SignerProcess] = []
+        self._lock: Optional[asyncio.Lock] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self._restarts = 0
+        self._requests = 0
+        self._fallbacks = 0
+        self._total_ms = 0.0
+
+    async def _ensure_started(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._procs = [p for p in self._procs if p.alive]
+            while len(self._procs) < self.size:
+                proc = _SignerProcess()
+                await proc.start()
+                self._procs.append(proc)
+                logger.info(f"[kling-signer] 签名进程已启动 pid={proc.proc.pid}")
+            if self._health_task is None or self._health_task.done():
+                self._health_task = asyncio.create_task(self._health_loop())
+
+    def _pick(self) -> Optional[_SignerProcess]:
+        alive = [p for p in self._procs if p.alive]
+        if not alive:
+            return None
+        return min(alive, key=lambda p: p.inflight)
+
+    async def sign(self, payload: dict) -> dict:
+        """签名一次，返回 {signResult, signInput, signedUrl}"""
+        loop = asyncio.get_running_loop()
+        if self._loop is None:
+            self._loop = loop
+        if loop is not self._loop:
+            # 进程管道绑定在主事件循环上，其他线程/事件循环退回一次性 CLI
+            self._fallbacks += 1
+            return await _sign_once(payload)
+
+        started = time.monotonic()
+        last_error = None
+        for _ in range(2):
+            proc = None
+            try:
+                await self._ensure_started()
+                proc = self._pick()
+                if proc is None:
+                    raise SignerError("没有可用的签名进程")
+                msg = await proc.request(payload)
+                proc.served += 1
+                if proc.served >= MAX_REQUESTS:
+                    self._retire(proc, "服务次数达到上限")
+                self._requests += 1
+                self._total_ms += (time.monotonic() - started) * 1000
+                return msg
+            except asyncio.TimeoutError:
+                last_error = SignerError("签名超时")
+                if proc:
+                    self._retire(proc, "签名超时")
+            except (SignerError, OSError, ValueError) as e:
+                last_error = e
+        # 进程池不可用时退回一次性 CLI，保证签名不中断
+        logger.warning(f"[kling-signer] 进程池签名失败，退回 sign_cli: {last_error}")
+        self._fallbacks += 1
+        return await _sign_once(payload)
+
+    def _retire(self, proc: _SignerProcess, reason: str):
+        if proc in self._procs:
+            self._procs.remove(proc)
+            self._restarts += 1
+            logger.info(f"[kling-signer] 替换签名进程 pid={proc.proc.pid if proc.proc else None}: {reason}")
+        asyncio.create_task(self._close_when_idle(proc))
+
+    async def _close_when_idle(self, proc: _SignerProcess):
+        # 等在途请求结束再关闭，最多等一个签名超时
+        deadline = time.monotonic() + SIGN_TIMEOUT
+        while proc.inflight and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        await proc.close()
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL)
+            for proc in list(self._procs):
+                if not proc.alive:
+                    self._retire(proc, "进程已退出")
+                    continue
+                try:
+                    await proc.request({"op": "ping"}, timeout=PING_TIMEOUT)
+                except Exception as e:
+                    self._retire(proc, f"健康检查失败: {e}")
+            try:
+                await self._ensure_started()
+            except Exception as e:
+                logger.error(f"[kling-signer] 补充签名进程失败: {e}")
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        procs, self._procs = self._procs, []
+        await asyncio.gather(*(p.close() for p in procs), return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size,
+            "processes": [
+                {
+                    "pid": p.proc.pid if p.proc else None,
+                    "alive": p.alive,
+                    "inflight": p.inflight,
+                    "served": p.served,
+                    "uptime": int(time.monotonic() - p.started_at) if p.started_at else 0,
+                }
+                for p in self._procs
+            ],
+            "requests": self._requests,
+            "restarts": self._restarts,
+            "fallbacks": self._fallbacks,
+            "avg_ms": round(self._total_ms / self._requests, 2) if self._requests else None,
+        }
+
+
+async def _sign_once(payload: dict) -> dict:
+    """一次性启动 node sign_cli.js 签名（进程池不可用时的兜底）"""
+    proc = await asyncio.create_subprocess_exec(
+        "node", str(SIGN_CLI),
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    stdout, stderr = await asyncio.wait_for(proc.communicate(json.dumps(payload).encode()), timeout=SIGN_TIMEOUT)
+    if proc.returncode != 0:
+        raise RuntimeError(f"sign_cli error: {stderr.decode()}")
+    return json.loads(stdout.decode().strip())
+
+
+# 全局单例
+signer_pool = KlingSignerPool()
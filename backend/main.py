@@ -3,6 +3,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 import asyncio
+import base64
 
 # 加载环境变量（必须在其他导入之前）
 load_dotenv()
@@ -15,19 +16,22 @@ from starlette.exceptions import HTTPException as StarletteHTTPException
 from sqlmodel import Session, select
 from pydantic import BaseModel
 from typing import Optional
-from datetime import datetime
+from datetime import datetime, timedelta
 import uuid
-from backend.models import User, VideoOrder, Transaction, VerificationCode, AIModel, Ticket, engine
+from backend.models import User, VideoOrder, Transaction, VerificationCode, AIModel, Ticket, engine, get_session
 from backend.db_utils import db_manager
 from backend.error_handler import security_logger, error_handler, RateLimitError, SecurityError
 import re
-from backend.auth import get_password_hash, verify_password, create_access_token, SECRET_KEY, ALGORITHM, generate_invite_code
-from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from backend.auth import (
+    get_password_hash, verify_password, create_access_token, SECRET_KEY, ALGORITHM, generate_invite_code,
+    get_current_user, user_token_claims,
+)
+from fastapi.security import OAuth2PasswordRequestForm
 from jose import JWTError, jwt
 from backend.automation import run_hailuo_task, start_automation_worker  # 单账号模式保留
 from backend.security import (
-    generate_captcha_challenge, verify_captcha,
-    check_rate_limit, is_ip_banned, record_fail, record_success,
+    generate_captcha_challenge, verify_captcha, check_captcha_quota,
+    check_rate_limit, match_rate_limit_rule, is_ip_banned, record_fail, record_success,
     get_ban_remaining_seconds, get_fail_count
 )
 from backend.admin import router as admin_router, get_admin_user
@@ -96,13 +100,14 @@ class RateLimitMiddleware(BaseHTTPMiddleware):
                     status_code=403,
                     content={"detail": f"行为异常，已被临时封禁，剩余 {remaining // 60} 分钟"}
                 )
-            
-            # 敏感接口检查请求频率（严格）
-            if not check_rate_limit(client_ip):
-                return JSONResponse(
-                    status_code=429,
-                    content={"detail": "请求过于频繁，请稍后再试"}
-                )
+
+        # 按路由规则检查请求频率（规则见 security.RATE_LIMIT_RULES）
+        route = match_rate_limit_rule(path)
+        if route and not check_rate_limit(client_ip, route):
+            return JSONResponse(
+                status_code=429,
+                content={"detail": "请求过于频繁，请稍后再试"}
+            )
         
         response = await call_next(request)
         return response
@@ -193,6 +198,27 @@ async def startup_event():
         app_logger.info("Recovery process completed")
     except Exception as e:
         app_logger.error(f"Recovery process failed: {e}", exc_info=True)
+
+    # 用最近完成的订单初始化各模型耗时统计（自适应轮询间隔），在 worker 启动前加载
+    from backend.models import run_in_session
+    from backend.poll_schedule import generation_stats
+    await run_in_session(generation_stats.seed_from_db)
+
+    # 启动持久化任务队列 worker（会领取上次进程遗留的未完成任务）
+    from backend.job_queue import job_queue
+    job_queue.start()
+
+    # GPT-Image 公平调度（恢复尚未提交到 NOVART 的订单）
+    from backend.gptimage_scheduler import gptimage_scheduler
+    await gptimage_scheduler.start()
+
+    # 启动订单进度批量写入
+    from backend.progress_buffer import progress_buffer
+    progress_buffer.start()
+
+    # 加载 IP 封禁/失败计数缓存并启动后台写回
+    from backend.security import ip_state
+    ip_state.start()
     
     # 自动启动自动化工作线程（单账号模式） - 多账号系统启用时禁用
     enable_auto_worker = os.getenv("ENABLE_AUTO_WORKER", "true").lower() == "true"
@@ -234,6 +260,50 @@ async def startup_event():
     app_logger.info("可灵账号登录监测已启动")
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    # 停止 GPT-Image 调度（排队中的订单下次启动时从数据库恢复）
+    from backend.gptimage_scheduler import gptimage_scheduler
+    await gptimage_scheduler.stop()
+
+    # 停止任务队列 worker，归还租约
+    from backend.job_queue import job_queue
+    await job_queue.stop()
+
+    # 写入缓冲中剩余的订单进度
+    from backend.progress_buffer import progress_buffer
+    await progress_buffer.stop()
+
+    # 写回未落库的 IP 封禁/失败计数
+    from backend.security import ip_state
+    await ip_state.stop()
+
+    # 关闭池化的海螺 HTTP 客户端
+    from backend.hailuo_api import client_pool
+    await client_pool.close_all()
+    app_logger.info("Hailuo client pool closed")
+
+    # 关闭可灵签名进程
+    from backend.kling_signer import signer_pool
+    await signer_pool.close()
+
+    # 关闭可灵共享 HTTP 连接池
+    from backend import kling_api
+    await kling_api.close_http_client()
+
+    # 关闭视频下载连接
+    from backend.video_download import video_downloader
+    await video_downloader.close()
+
+    # 关闭即梦浏览器池
+    from backend.jimeng_browser_pool import jimeng_browser_pool
+    await jimeng_browser_pool.close()
+
+    # 关闭即梦直连 HTTP 连接
+    from backend import jimeng_client
+    await jimeng_client.close_http_client()
+
+
 def init_default_models():
     """初始化默认模型数据（只创建缺失的模型，保护已有价格设置）"""
     from backend.model_config import model_config
@@ -312,15 +382,6 @@ def init_default_models():
             app_logger.info("All models already exist, no changes made")
 
 
-oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-
-
-# Dependency
-def get_session():
-    with Session(engine) as session:
-        yield session
-
-
 def get_client_ip(request: Request) -> str:
     """获取客户端 IP"""
     return request.client.host if request.client else "unknown"
@@ -359,23 +420,6 @@ def validate_username(username: str) -> tuple[bool, str]:
     return True, "用户名格式正确"
 
 
-async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    user = session.exec(select(User).where(User.username == username)).first()
-    if user is None:
-        raise credentials_exception
-    return user
 
 
 # --- Pydantic Schemas ---
@@ -536,8 +580,10 @@ def validate_username_api(data: dict):
 # --- 安全相关 API ---
 
 @app.get("/api/captcha")
-def get_captcha():
+def get_captcha(request: Request):
     """获取验证码挑战"""
+    if not check_captcha_quota(get_client_ip(request)):
+        raise HTTPException(status_code=429, detail="验证码请求过于频繁，请稍后再试")
     challenge = generate_captcha_challenge()
     return challenge
 
@@ -720,7 +766,7 @@ def register(user: UserCreateWithCaptcha, request: Request, session: Session = D
         device_fingerprint=user.device_fingerprint
     )
     
-    access_token = create_access_token(data={"sub": new_user.username})
+    access_token = create_access_token(data=user_token_claims(new_user))
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -771,7 +817,7 @@ def login(data: LoginWithCaptcha, request: Request, session: Session = Depends(g
         record_success(client_ip)
         # 安全获取管理员状态，防止数据库字段不存在
         is_admin = getattr(user, 'is_superuser', False)
-        access_token = create_access_token(data={"sub": user.username, "is_admin": is_admin})
+        access_token = create_access_token(data=user_token_claims(user, is_admin=is_admin))
         return {"access_token": access_token, "token_type": "bearer", "is_admin": is_admin}
         
     except HTTPException:
@@ -877,7 +923,7 @@ def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), ses
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = create_access_token(data={"sub": user.username})
+    access_token = create_access_token(data=user_token_claims(user))
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -897,6 +943,8 @@ def recharge(request: RechargeRequest, current_user: User = Depends(get_current_
         
     total_add = amount + bonus
     
+    # 鉴权用户可能来自缓存，改余额前在本事务内重新读取用户行（PostgreSQL 下加行锁）
+    session.refresh(current_user, with_for_update=True)
     current_user.balance += total_add
     current_user.paid_balance = (current_user.paid_balance or 0) + amount  # 充值金额计入 paid_balance（不含赠送）
     session.add(current_user)
@@ -1054,6 +1102,7 @@ def create_payment(
 
 
 import threading as _pay_threading
+from backend.shared_state import shared_state
 
 _payment_locks: dict = {}
 _payment_locks_guard = _pay_threading.Lock()
@@ -1076,6 +1125,12 @@ def _process_payment(out_trade_no: str, trade_no: str) -> dict:
     if not lock.acquire(timeout=10):
         app_logger.warning(f"[Payment] 获取锁超时: {out_trade_no}")
         return {"ok": False, "already": False}
+    # 多 worker 部署时再取跨进程锁（本地后端下只是多一次字典操作）
+    shared_token = shared_state.acquire_lock(f"payment:{out_trade_no}", ttl=30, timeout=10)
+    if shared_token is None:
+        lock.release()
+        app_logger.warning(f"[Payment] 获取跨进程锁超时: {out_trade_no}")
+        return {"ok": False, "already": False}
 
     try:
         with Session(engine) as session:
@@ -1128,6 +1183,7 @@ def _process_payment(out_trade_no: str, trade_no: str) -> dict:
         app_logger.error(f"[Payment] 处理异常: {out_trade_no}, error={e}", exc_info=True)
         return {"ok": False, "already": False}
     finally:
+        shared_state.release_lock(f"payment:{out_trade_no}", shared_token)
         lock.release()
         # 清理过期锁（避免内存泄漏）
         with _payment_locks_guard:
@@ -1534,7 +1590,7 @@ async def kling_lip_sync_submit(
     total_cost = _calc_lipsync_cost(model, charge_seconds)
 
     # Refresh latest balance before charging.
-    session.refresh(current_user)
+    session.refresh(current_user, with_for_update=True)
     if current_user.balance < total_cost:
         raise HTTPException(status_code=400, detail=f"余额不足，需 {total_cost:.2f} 元")
 
@@ -1713,6 +1769,8 @@ async def create_order(
             cost = model.price if model and model.price else 0.99
 
     total_cost = round(cost * quantity, 2)
+    # 鉴权用户可能来自缓存，改余额前在本事务内重新读取用户行（PostgreSQL 下加行锁）
+    session.refresh(current_user, with_for_update=True)
     if current_user.balance < total_cost:
         raise HTTPException(status_code=400, detail=f"余额不足，需要 ¥{total_cost}（单价 ¥{cost} × {quantity}）")
     
@@ -1794,8 +1852,8 @@ async def create_order(
     enable_multi_account = os.getenv("ENABLE_MULTI_ACCOUNT", "true").lower() == "true"
     if enable_multi_account:
         try:
-            from backend.order_worker import submit_order
-            asyncio.create_task(submit_order(new_order.id))
+            from backend.job_queue import job_queue
+            await job_queue.enqueue("hailuo_submit", new_order.id)
             app_logger.info(f"订单#{new_order.id}(quantity={quantity})已提交HTTP API处理")
         except Exception as e:
             app_logger.error(f"提交订单处理失败: {e}")
@@ -1805,11 +1863,145 @@ async def create_order(
     return new_order
 
 
+ORDERS_PAGE_DEFAULT = 20
+ORDERS_PAGE_MAX = 100
+ORDER_PROMPT_PREVIEW = 200  # 精简模式下 prompt 截断长度
+ORDERS_SINCE_OVERLAP = 5    # server_time 往前回退的秒数，覆盖查询期间尚未提交的更新
+# 精简模式返回的列（不含 task_id、首尾帧路径等列表页用不到的大字段）
+ORDER_LITE_COLUMNS = (
+    "id", "status", "progress", "status_message", "video_url", "video_urls", "cost",
+    "model_name", "video_type", "resolution", "duration", "aspect_ratio", "quantity",
+    "created_at", "updated_at",
+)
+
+
+def _encode_order_cursor(created_at: datetime, order_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{order_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def _decode_order_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, order_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(order_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="无效的分页游标")
+
+
 @app.get("/api/orders")
-def get_orders(current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
-    statement = select(VideoOrder).where(VideoOrder.user_id == current_user.id).order_by(VideoOrder.created_at.desc())
-    results = session.exec(statement).all()
-    return results
+def get_orders(
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session),
+):
+    """用户订单列表（按创建时间倒序）
+    - 不带参数：返回全部订单（兼容旧客户端）
+    - limit/cursor：按 (created_at, id) 游标分页，返回 {items, next_cursor, server_time}
+    - since：只返回 updated_at 晚于该时间的订单，用于增量刷新（传上次响应的 server_time）
+    - fields=lite：只返回列表展示需要的列，prompt 截断
+    """
+    from sqlalchemy import func, tuple_
+
+    if fields not in (None, "full", "lite"):
+        raise HTTPException(status_code=400, detail="fields 只支持 full 或 lite")
+    paginated = limit is not None or cursor is not None or since is not None
+    lite = fields == "lite"
+    server_time = datetime.utcnow() - timedelta(seconds=ORDERS_SINCE_OVERLAP)
+
+    if lite:
+        columns = [getattr(VideoOrder, name) for name in ORDER_LITE_COLUMNS]
+        columns.append(func.substr(VideoOrder.prompt, 1, ORDER_PROMPT_PREVIEW).label("prompt"))
+        statement = select(*columns)
+    else:
+        statement = select(VideoOrder)
+    statement = statement.where(VideoOrder.user_id == current_user.id)
+    if since is not None:
+        statement = statement.where(VideoOrder.updated_at > since)
+    if cursor:
+        cursor_created_at, cursor_id = _decode_order_cursor(cursor)
+        statement = statement.where(
+            tuple_(VideoOrder.created_at, VideoOrder.id) < tuple_(cursor_created_at, cursor_id)
+        )
+    statement = statement.order_by(VideoOrder.created_at.desc(), VideoOrder.id.desc())
+
+    page_size = None
+    if paginated:
+        page_size = max(1, min(limit or ORDERS_PAGE_DEFAULT, ORDERS_PAGE_MAX))
+        # 多取一条判断是否还有下一页
+        statement = statement.limit(page_size + 1)
+
+    if lite:
+        items = [dict(row._mapping) for row in session.exec(statement).all()]
+    else:
+        items = session.exec(statement).all()
+
+    if not paginated:
+        return items
+
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        last_created_at, last_id = (last["created_at"], last["id"]) if lite else (last.created_at, last.id)
+        next_cursor = _encode_order_cursor(last_created_at, last_id)
+    return {"items": items, "next_cursor": next_cursor, "server_time": server_time}
+
+
+ORDER_EVENTS_KEEPALIVE = 15  # SSE 心跳间隔（秒），防止反代因空闲断开
+
+
+@app.get("/api/orders/events")
+async def order_events_stream(request: Request, token: Optional[str] = None):
+    """订单状态事件流（SSE）：推送当前用户所有平台订单的状态/进度/完成事件
+    EventSource 无法设置请求头，token 通过 query 参数传递（同 /videos）
+    """
+    from starlette.responses import StreamingResponse
+    from backend.order_events import order_events
+
+    if not token:
+        auth = request.headers.get("Authorization", "")
+        token = auth[7:] if auth.startswith("Bearer ") else None
+    if not token:
+        raise HTTPException(status_code=401, detail="未登录")
+    # 只在建立连接时短暂使用数据库会话，推送期间不占用连接
+    with Session(engine) as session:
+        user = await get_current_user(token, session)
+        user_id = user.id
+
+    async def event_stream():
+        queue = order_events.subscribe(user_id)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=ORDER_EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: order\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+        finally:
+            order_events.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.get("/api/orders/{order_id}")
+def get_order(order_id: int, current_user: User = Depends(get_current_user), session: Session = Depends(get_session)):
+    """单个订单的完整字段（列表页为精简字段，重试等需要完整 prompt 时使用）"""
+    order = session.get(VideoOrder, order_id)
+    if not order or order.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="订单不存在")
+    return order
 
 
 @app.post("/api/orders/{order_id}/force-scan")
@@ -1823,8 +2015,10 @@ async def force_scan_order(order_id: int, current_user: User = Depends(get_curre
     if order.status not in ("generating", "processing"):
         raise HTTPException(status_code=400, detail="订单状态不允许扫描")
     
-    from backend.order_worker import poll_order_status
-    asyncio.create_task(poll_order_status(order_id))
+    from backend.job_queue import job_queue
+    from backend.order_worker import _is_kling_model
+    kind = "kling_poll" if _is_kling_model(order.model_name) else "hailuo_poll"
+    await job_queue.enqueue(kind, order_id)
     return {"message": "已触发扫描", "order_id": order_id}
 
 
@@ -1832,10 +2026,81 @@ async def force_scan_order(order_id: int, current_user: User = Depends(get_curre
 async def force_scan_all(admin=Depends(get_admin_user)):
     """强制扫描所有生成中的订单（管理员专用）"""
     from backend.order_worker import poll_all_pending_orders
-    asyncio.create_task(poll_all_pending_orders())
+    await poll_all_pending_orders()
     return {"message": "已触发全量扫描"}
 
 
+@app.get("/api/admin/job-queue")
+def get_job_queue_stats(admin=Depends(get_admin_user)):
+    """后台任务队列状态（各类型任务计数、worker 池大小）"""
+    from backend.job_queue import job_queue
+    return job_queue.stats()
+
+
+@app.get("/api/admin/poll-stats")
+def get_poll_stats(admin=Depends(get_admin_user)):
+    """各模型生成耗时分布（样本数、p50/p90 秒），用于自适应轮询"""
+    from backend.poll_schedule import generation_stats
+    return generation_stats.snapshot()
+
+
+@app.get("/api/admin/kling-signer")
+def get_kling_signer_stats(admin=Depends(get_admin_user)):
+    """可灵签名进程池状态（进程、在途请求、重启次数、平均耗时）"""
+    from backend.kling_signer import signer_pool
+    return signer_pool.stats()
+
+
+@app.get("/api/admin/jimeng-browser")
+def get_jimeng_browser_stats(admin=Depends(get_admin_user)):
+    """即梦浏览器池状态（上下文、页面复用、内存占用）"""
+    from backend.jimeng_browser_pool import jimeng_browser_pool
+    return jimeng_browser_pool.stats()
+
+
+@app.get("/api/admin/order-events")
+def get_order_events_stats(admin=Depends(get_admin_user)):
+    """订单事件推送状态（在线订阅用户数、连接数、已发布/丢弃事件数）"""
+    from backend.order_events import order_events
+    return order_events.stats()
+
+
+@app.get("/api/admin/novart-limiter")
+def get_novart_limiter_stats(admin=Depends(get_admin_user)):
+    """NOVART 速率限制器状态（窗口占用、排队数、预计等待）"""
+    from backend.novart_limiter import novart_limiter
+    return novart_limiter.stats()
+
+
+@app.get("/api/admin/shared-state")
+def get_shared_state_stats(admin=Depends(get_admin_user)):
+    """共享状态后端（local/sqlite/redis）及 IP 封禁缓存写回状态"""
+    from backend.security import ip_state
+    return {**shared_state.stats(), "ip_state": ip_state.stats()}
+
+
+@app.get("/api/admin/db-stats")
+def get_db_stats(admin=Depends(get_admin_user)):
+    """数据库引擎状态（连接池占用、SQLite 参数、写语句耗时与锁冲突次数）"""
+    from backend.db_engine import engine_stats
+    from backend.models import async_engine
+    return engine_stats(engine, async_engine)
+
+
+@app.get("/api/admin/auth-cache")
+def get_auth_cache_stats(admin=Depends(get_admin_user)):
+    """登录用户缓存状态（缓存用户数、命中率、失效次数）"""
+    from backend.auth import user_cache
+    return user_cache.stats()
+
+
+@app.get("/api/admin/gptimage-scheduler")
+def get_gptimage_scheduler_stats(admin=Depends(get_admin_user)):
+    """GPT-Image 公平调度状态（排队订单、各用户排队数、已放行数）"""
+    from backend.gptimage_scheduler import gptimage_scheduler
+    return gptimage_scheduler.stats()
+
+
 @app.post("/api/hailuo/code")
 def upload_verification_code(request: VerificationCodeRequest, session: Session = Depends(get_session)):
     match = re.search(r'【海螺AI】(\d{6})', request.text)
@@ -0,0 +1,282 @@
+"""
+数据库版本化迁移
+schema_version 表记录已执行的迁移版本。启动时先建表（create_all 只会建缺失的表），
+再执行版本号大于当前版本的迁移；已是最新版本时只有一次查询。
+
+每个迁移是按版本号排序的一组步骤，步骤本身幂等（列/索引已存在时跳过），
+所以在由 create_all 新建的库上执行也是安全的。可用的步骤：
+  add_column   添加列
+  drop_column  删除列（SQLite 需 3.35+）
+  create_index 建索引
+  drop_index   删除索引
+  backfill     按主键分批回填数据，每批单独提交，避免长事务锁表
+
+普通步骤在同一个事务里执行；backfill 在迁移事务之外逐批提交（where 条件保证中断后重跑幂等），
+迁移版本号在全部步骤完成后才写入。
+
+新增迁移：在 MIGRATIONS 末尾追加 Migration(下一个版本号, 说明, [步骤...])，不要修改已发布的迁移。
+
+命令行：
+  python -m backend.migrations          执行待处理的迁移
+  python -m backend.migrations status   查看当前版本与待执行的迁移
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH = 1000
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    steps: list[Callable[[Connection], None]] = field(default_factory=list)
+
+
+# ============ 步骤 ============
+
+def _quote(conn: Connection, name: str) -> str:
+    return conn.dialect.identifier_preparer.quote(name)
+
+
+def _columns(conn: Connection, table: str) -> set[str]:
+    return {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def add_column(table: str, column: str, ddl: str):
+    """ALTER TABLE ADD COLUMN；列已存在时跳过"""
+    def step(conn: Connection):
+        if column in _columns(conn, table):
+            return
+        conn.execute(text(f"ALTER TABLE {_quote(conn, table)} ADD COLUMN {column} {ddl}"))
+        print(f"[DB迁移] 添加列 {table}.{column}")
+    step.__name__ = f"add_column({table}.{column})"
+    return step
+
+
+def drop_column(table: str, column: str):
+    """ALTER TABLE DROP COLUMN；列不存在时跳过"""
+    def step(conn: Connection):
+        if column not in _columns(conn, table):
+            return
+        conn.execute(text(f"ALTER TABLE {_quote(conn, table)} DROP COLUMN {column}"))
+        print(f"[DB迁移] 删除列 {table}.{column}")
+    step.__name__ = f"drop_column({table}.{column})"
+    return step
+
+
+def create_index(name: str, table: str, columns: str, unique: bool = False):
+    """CREATE INDEX IF NOT EXISTS"""
+    def step(conn: Connection):
+        kind = "UNIQUE INDEX" if unique else "INDEX"
+        conn.execute(text(f"CREATE {kind} IF NOT EXISTS {name} ON {_quote(conn, table)} ({columns})"))
+    step.__name__ = f"create_index({name})"
+    return step
+
+
+def drop_index(name: str):
+    """DROP INDEX IF EXISTS"""
+    def step(conn: Connection):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    step.__name__ = f"drop_index({name})"
+    return step
+
+
+def backfill(table: str, assignments: str, where: str, batch: int = BACKFILL_BATCH):
+    """
+    UPDATE table SET assignments WHERE where，按主键区间分批执行，每批一个事务
+    where 条件应在回填后不再成立（如 "x IS NULL"），保证中断后重复执行幂等
+    """
+    def step(engine: Engine):
+        with engine.connect() as conn:
+            t = _quote(conn, table)
+            bounds = conn.execute(text(f"SELECT MIN(id), MAX(id) FROM {t} WHERE {where}")).first()
+        if not bounds or bounds[0] is None:
+            return
+        total = 0
+        for start in range(bounds[0], bounds[1] + 1, batch):
+            with engine.begin() as conn:
+                result = conn.execute(
+                    text(f"UPDATE {t} SET {assignments} WHERE id >= :lo AND id < :hi AND ({where})"),
+                    {"lo": start, "hi": start + batch},
+                )
+            total += result.rowcount or 0
+        print(f"[DB迁移] 回填 {table}: {total} 行")
+    step.__name__ = f"backfill({table})"
+    step.batched = True   # 接收 Engine 并自行分批提交，不在迁移事务内执行
+    return step
+
+
+# ============ 迁移列表（只追加，不修改） ============
+
+MIGRATIONS: list[Migration] = [
+    Migration(1, "legacy columns (videoorder / aimodel / user)", [
+        add_column("videoorder", "video_type", "TEXT DEFAULT 'image_to_video'"),
+        add_column("videoorder", "resolution", "TEXT DEFAULT '768p'"),
+        add_column("videoorder", "duration", "TEXT DEFAULT '6s'"),
+        add_column("videoorder", "status_message", "TEXT"),
+        add_column("aimodel", "model_type", "TEXT DEFAULT 'image_to_video'"),
+        add_column("aimodel", "platform", "TEXT DEFAULT 'hailuo'"),
+        add_column("aimodel", "features", "TEXT DEFAULT '[]'"),
+        add_column("aimodel", "badge", "TEXT"),
+        add_column("aimodel", "supports_last_frame", "BOOLEAN DEFAULT FALSE"),
+        add_column("aimodel", "is_default", "BOOLEAN DEFAULT FALSE"),
+        add_column("aimodel", "is_enabled", "BOOLEAN DEFAULT TRUE"),
+        add_column("aimodel", "sort_order", "INTEGER DEFAULT 0"),
+        add_column("aimodel", "price_per_second", "REAL DEFAULT 0"),
+        add_column("aimodel", "price_10s", "REAL DEFAULT 0"),
+        add_column("aimodel", "pricing_matrix", "TEXT"),
+        add_column("aimodel", "created_at", "TIMESTAMP"),
+        add_column("aimodel", "updated_at", "TIMESTAMP"),
+        # 批量订单简化
+        add_column("videoorder", "quantity", "INTEGER DEFAULT 1"),
+        add_column("videoorder", "video_urls", "TEXT"),
+        # 宽高比
+        add_column("videoorder", "aspect_ratio", "TEXT DEFAULT '16:9'"),
+        # 充值余额（GPT Image 专用）
+        add_column("user", "paid_balance", "REAL DEFAULT 0"),
+        # 后加的时间列在老数据上为空
+        backfill("aimodel", "created_at = CURRENT_TIMESTAMP", "created_at IS NULL"),
+        backfill("aimodel", "updated_at = CURRENT_TIMESTAMP", "updated_at IS NULL"),
+    ]),
+    Migration(2, "jimengorder duration / ratio / resolution", [
+        # 原 migrate_jimeng_order.py
+        add_column("jimengorder", "duration", "INTEGER DEFAULT 5"),
+        add_column("jimengorder", "ratio", "TEXT DEFAULT '16:9'"),
+        add_column("jimengorder", "resolution", "TEXT DEFAULT '720P'"),
+    ]),
+    Migration(3, "videoorder (user_id, created_at) index", [
+        # 用户订单列表按 (user_id, created_at) 游标分页
+        create_index("ix_videoorder_user_created", "videoorder", "user_id, created_at"),
+    ]),
+    Migration(4, "hot query indexes", [
+        # 与 models.py 中 __table_args__ 的声明保持一致（新库由 create_all 建好，这里补老库）
+        create_index("ix_videoorder_status_created", "videoorder", "status, created_at"),
+        create_index("ix_videoorder_created", "videoorder", "created_at"),
+        create_index("ix_transaction_user_created", "transaction", "user_id, created_at"),
+        create_index("ix_transaction_type_created", "transaction", "type, created_at"),
+        create_index("ix_jimengorder_user_created", "jimengorder", "user_id, created_at"),
+        create_index("ix_jimengorder_status_created", "jimengorder", "status, created_at"),
+        create_index("ix_gptimageorder_user_created", "gptimageorder", "user_id, created_at"),
+        create_index("ix_gptimageorder_status_created", "gptimageorder", "status, created_at"),
+        create_index("ix_user_invited_created", "user", "invited_by, created_at"),
+        # 被 (user_id, created_at) 复合索引的前缀覆盖
+        drop_index("ix_gptimageorder_user_id"),
+    ]),
+    Migration(5, "jimengorder account_id", [
+        # 记录提交所用的账号，任务被重新领取时继续等待结果而不是重复提交
+        add_column("jimengorder", "account_id", "TEXT"),
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version if MIGRATIONS else 0
+
+
+# ============ 执行 ============
+
+def _ensure_version_table(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version ("
+            "version INTEGER PRIMARY KEY, name VARCHAR(200) NOT NULL, applied_at TIMESTAMP NOT NULL)"
+        ))
+
+
+def current_version(engine: Engine) -> int:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version")).scalar() or 0
+
+
+def pending_migrations(engine: Engine) -> list[Migration]:
+    version = current_version(engine)
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+def _step_groups(migration: Migration) -> list[list[Callable]]:
+    """把步骤切成若干段：连续的普通步骤合为一段（同一事务），分批步骤各自单独一段"""
+    groups: list[list[Callable]] = []
+    for step in migration.steps:
+        if groups and not getattr(step, "batched", False) and not getattr(groups[-1][0], "batched", False):
+            groups[-1].append(step)
+        else:
+            groups.append([step])
+    return groups
+
+
+def _record_version(conn: Connection, migration: Migration):
+    conn.execute(
+        text("INSERT INTO schema_version (version, name, applied_at) VALUES (:v, :n, :t)"),
+        {"v": migration.version, "n": migration.name, "t": datetime.utcnow()},
+    )
+
+
+def run_migrations(engine: Optional[Engine] = None) -> int:
+    """
+    执行所有待处理的迁移，返回执行的数量
+    普通步骤与版本记录在同一事务中；backfill 在事务外逐批提交，版本号在其完成后写入
+    """
+    if engine is None:
+        from backend.models import engine
+    _ensure_version_table(engine)
+    pending = pending_migrations(engine)
+    if not pending:
+        return 0
+
+    applied = 0
+    for migration in sorted(pending, key=lambda m: m.version):
+        try:
+            with engine.connect() as conn:
+                # 多个进程同时启动时，别的进程可能已经执行过
+                done = conn.execute(
+                    text("SELECT 1 FROM schema_version WHERE version = :v"), {"v": migration.version}
+                ).first()
+            if done:
+                continue
+            print(f"[DB迁移] 执行 #{migration.version}: {migration.name}")
+            groups = _step_groups(migration)
+            recorded = False
+            for i, group in enumerate(groups):
+                if getattr(group[0], "batched", False):
+                    group[0](engine)
+                    continue
+                with engine.begin() as conn:
+                    for step in group:
+                        step(conn)
+                    if i == len(groups) - 1:
+                        _record_version(conn, migration)
+                        recorded = True
+            if not recorded:
+                with engine.begin() as conn:
+                    _record_version(conn, migration)
+        except IntegrityError:
+            # 并发执行时版本号已被另一个进程写入（步骤幂等，回滚本次即可）
+            logger.info(f"[migrations] #{migration.version} 已由其他进程执行")
+            continue
+        applied += 1
+    logger.info(f"[migrations] 已执行 {applied} 个迁移，当前版本 {LATEST_VERSION}")
+    return applied
+
+
+if __name__ == "__main__":
+    import sys
+
+    from sqlmodel import SQLModel
+
+    from backend.models import engine
+
+    SQLModel.metadata.create_all(engine)
+    _ensure_version_table(engine)
+    if len(sys.argv) > 1 and sys.argv[1] == "status":
+        print(f"当前版本: {current_version(engine)} / 最新版本: {LATEST_VERSION}")
+        for m in pending_migrations(engine):
+            print(f"  待执行 #{m.version}: {m.name}")
+    else:
+        print(f"执行迁移 {run_migrations(engine)} 个，当前版本 {current_version(engine)}")
@@ -0,0 +1,158 @@
+"""
+NOVART 全局速率限制器
+多个滑动窗口（每秒/每分钟）同时约束，等待方在事件循环上 await 许可，
+按到达顺序（FIFO）发放；只有一个定时器在下一个许可可用时唤醒队首，没有轮询。
+多 worker 部署（shared_state 为 sqlite/redis）时，发放前还要在共享计数上占到名额，
+保证所有进程合计不超过 NOVART 的配额。
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Optional
+
+from backend.shared_state import shared_state
+
+logger = logging.getLogger(__name__)
+
+# NOVART API 限制：每秒 ≤4 请求，每分钟 ≤20 请求
+MAX_PER_SECOND = 3   # 保守值，留余量
+MAX_PER_MINUTE = 18  # 保守值，留余量
+SHARED_RETRY_DELAY = 0.25  # 共享计数已满时的重试间隔（秒）
+
+
+class WindowRateLimiter:
+    """多窗口速率限制：windows 为 [(次数上限, 窗口秒数), ...]，需同时满足"""
+
+    def __init__(self, windows: list[tuple[int, float]], shared_key: Optional[str] = None):
+        self._windows = [(limit, period, deque()) for limit, period in windows]
+        self.shared_key = shared_key
+        self._shared_backoff_until = 0.0
+        self._shared_rejects = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._granted = 0
+        self._total_wait = 0.0
+
+    def _purge(self, now: float):
+        for _, period, stamps in self._windows:
+            while stamps and now - stamps[0] >= period:
+                stamps.popleft()
+
+    def _delay(self, now: float) -> float:
+        """距离下一个许可可用的秒数，0 表示现在即可发放"""
+        self._purge(now)
+        delay = max(0.0, self._shared_backoff_until - now)
+        for limit, period, stamps in self._windows:
+            if len(stamps) >= limit:
+                delay = max(delay, stamps[-limit] + period - now)
+        return delay
+
+    def _take_shared(self) -> bool:
+        """在跨进程共享计数上占一个名额；单进程（local 后端）时直接通过"""
+        if not self.shared_key or not shared_state.shared:
+            return True
+        now = time.time()
+        taken = []
+        try:
+            for limit, period, _ in self._windows:
+                key, window = f"{self.shared_key}:{period:g}", max(1, int(period))
+                if not shared_state.hit_window(key, limit, window, now):
+                    # 前面窗口已占的名额要还回去，否则每次被拒都会白白消耗配额
+                    for taken_key, taken_window in taken:
+                        shared_state.unhit_window(taken_key, taken_window, now)
+                    self._shared_backoff_until = time.monotonic() + SHARED_RETRY_DELAY
+                    self._shared_rejects += 1
+                    return False
+                taken.append((key, window))
+        except Exception as e:
+            logger.warning(f"[novart-limiter] 共享计数不可用，仅按本进程限流: {e}")
+        return True
+
+    def _record(self, now: float):
+        for _, _, stamps in self._windows:
+            stamps.append(now)
+        self._granted += 1
+
+    async def acquire(self) -> float:
+        """等待一个许可，返回实际等待秒数"""
+        now = time.monotonic()
+        if not self._waiters and self._delay(now) == 0 and self._take_shared():
+            self._record(now)
+            return 0.0
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        self._schedule()
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if not fut.done():
+                fut.cancel()
+            self._schedule()
+            raise
+        waited = time.monotonic() - now
+        self._total_wait += waited
+        return waited
+
+    def _schedule(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._waiters and self._waiters[0].done():
+            self._waiters.popleft()
+        if not self._waiters:
+            return
+        delay = self._delay(time.monotonic())
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self):
+        self._timer = None
+        now = time.monotonic()
+        while self._waiters:
+            fut = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()
+                continue
+            if self._delay(now) > 0 or not self._take_shared():
+                break
+            self._waiters.popleft()
+            self._record(now)
+            fut.set_result(None)
+        self._schedule()
+
+    def estimate_wait(self, ahead: int = 0) -> float:
+        """再有 ahead 个请求排在前面时，新请求预计需要等待的秒数"""
+        now = time.monotonic()
+        self._purge(now)
+        windows = [(limit, period, list(stamps)) for limit, period, stamps in self._windows]
+        t = now
+        for _ in range(len(self._waiters) + ahead + 1):
+            delay = 0.0
+            for limit, period, stamps in windows:
+                if len(stamps) >= limit:
+                    delay = max(delay, stamps[-limit] + period - t)
+            t += delay
+            for _, _, stamps in windows:
+                stamps.append(t)
+        return round(t - now, 1)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for f in self._waiters if not f.done())
+
+    def stats(self) -> dict:
+        self._purge(time.monotonic())
+        return {
+            "limits": {f"{period:g}s": limit for limit, period, _ in self._windows},
+            "in_window": {f"{period:g}s": len(stamps) for _, period, stamps in self._windows},
+            "queue_depth": self.queue_depth,
+            "expected_wait": self.estimate_wait(),
+            "granted": self._granted,
+            "avg_wait": round(self._total_wait / self._granted, 2) if self._granted else 0,
+            "shared_backend": shared_state.name,
+            "shared_rejects": self._shared_rejects,
+        }
+
+
+# 全局单例
+novart_limiter = WindowRateLimiter([(MAX_PER_SECOND, 1.0), (MAX_PER_MINUTE, 60.0)], shared_key="quota:novart")
@@ -0,0 +1,88 @@
+"""
+订单事件推送
+进程内按用户分发的发布/订阅：订单 worker 发布 状态/进度/完成 事件，SSE 端点按用户订阅并推送。
+无订阅者的用户发布时直接丢弃，不产生任何开销。
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 100   # 单个连接的待发送事件上限，慢客户端溢出时丢弃最旧的事件
+
+
+class OrderEventBus:
+    """user_id -> 订阅队列集合（publish 线程安全，可在线程池中调用）"""
+
+    def __init__(self):
+        self._subscribers: dict[int, set[asyncio.Queue]] = {}
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._published = 0
+        self._dropped = 0
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        """在事件循环中调用，返回该连接的事件队列"""
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get(user_id)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def publish(self, user_id: Optional[int], platform: str, order_id: int, **fields):
+        """发布订单事件；fields 为变化的字段（status/progress/status_message/video_url 等）"""
+        if user_id is None:
+            return
+        with self._lock:
+            if user_id not in self._subscribers:
+                return
+        event = {"platform": platform, "order_id": order_id, "ts": time.time(), **fields}
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            self._dispatch(user_id, event)
+        else:
+            loop.call_soon_threadsafe(self._dispatch, user_id, event)
+
+    def _dispatch(self, user_id: int, event: dict):
+        with self._lock:
+            queues = list(self._subscribers.get(user_id, ()))
+        for queue in queues:
+            if queue.full():
+                try:
+                    queue.get_nowait()
+                    self._dropped += 1
+                except asyncio.QueueEmpty:
+                    pass
+            queue.put_nowait(event)
+        self._published += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "users": len(self._subscribers),
+                "connections": sum(len(q) for q in self._subscribers.values()),
+                "published": self._published,
+                "dropped": self._dropped,
+            }
+
+
+# 全局单例
+order_events = OrderEventBus()
@@ -6,18 +6,23 @@ import asyncio
 import json
 import logging
 import os
-from datetime import datetime
+import time
+from datetime import datetime, timezone
 from typing import Optional
 
-import httpx
 from sqlmodel import Session, select
 
-from backend.models import AIModel, VideoOrder, User, Transaction, engine
+from backend.models import AIModel, VideoOrder, User, Transaction, run_in_session
 from backend.account_store import account_store
 from backend.hailuo_api import HailuoApiClient
 from backend import hailuo_api as hailuo_account_mgr
 from backend.hailuo_api import build_generate_video_body
 from backend import kling_api
+from backend.job_queue import job_queue
+from backend.poll_schedule import generation_stats, video_order_key
+from backend.order_events import order_events
+from backend.progress_buffer import progress_buffer
+from backend.video_download import video_downloader
 
 logger = logging.getLogger(__name__)
 
@@ -67,8 +72,12 @@ MODEL_ID_MAP: dict = {
 }
 
 
-POLL_INTERVAL = 5       # 秒
+POLL_INTERVAL = 5       # 秒，无耗时统计时的默认轮询间隔（有统计时见 poll_schedule）
+KLING_POLL_INTERVAL = 10  # 可灵无耗时统计时的默认轮询间隔
 MAX_POLL_SECONDS = 600  # 10 分钟超时
+POLL_TICK_SLACK = 2     # 账号轮询时顺带合并 N 秒内即将到期的订单
+POLL_GATHER_SECONDS = 0.5  # 订阅后等待合并同时到期订单的时间
+POLL_TICK_TIMEOUT = 60  # 单次检查等待账号 tick 的上限
 
 
 def _get_api_model_id(model_name: Optional[str]) -> str:
@@ -248,26 +257,23 @@ def _pick_account() -> Optional[tuple]:
         return None
     candidates.sort(key=lambda x: (-x[1].priority, x[1].current_tasks))
     acc_id, _ = candidates[0]
-    creds = account_store.get_credentials(acc_id)
-    client = HailuoApiClient(
-        cookie=creds["cookie"],
-        uuid=creds["uuid"],
-        device_id=creds["device_id"],
-    )
-    return acc_id, client
+    return acc_id, _store_client(acc_id)
 
 
 async def submit_order(order_id: int):
     """选账号、调API提交生成任务，更新订单状态为 generating"""
-    with Session(engine) as session:
-        order = session.get(VideoOrder, order_id)
-        if not order:
-            logger.error(f"[worker] 订单#{order_id}不存在")
-            return
-        if order.status != "pending":
-            logger.warning(f"[worker] 订单#{order_id}状态={order.status}，跳过提交")
-            return
-        model_name = order.model_name
+    order = await run_in_session(_get_order, order_id)
+    if not order:
+        logger.error(f"[worker] 订单#{order_id}不存在")
+        return
+    if order.status != "pending":
+        logger.warning(f"[worker] 订单#{order_id}状态={order.status}，跳过提交")
+        # 提交后、轮询任务入队前被中断：补入轮询任务
+        if order.status == "generating" and order.task_id:
+            kind = "kling_poll" if _is_kling_model(order.model_name) else "hailuo_poll"
+            await job_queue.enqueue(kind, order_id)
+        return
+    model_name = order.model_name
 
     if _is_kling_model(model_name):
         await _submit_kling_order(order_id)
@@ -279,7 +285,7 @@ async def submit_order(order_id: int):
         await asyncio.sleep(5)
         result = _pick_account()
         if not result:
-            _fail_order(order_id, "无可用账号")
+            await _fail_order(order_id, "无可用账号")
             return
 
     acc_id, client = result
@@ -291,81 +297,78 @@ async def submit_order(order_id: int):
             credits = await client.get_credits()
             if credits is not None and credits <= 0:
                 logger.error(f"[worker] 海螺账号{acc_id}积分为0，订单#{order_id}失败")
-                _fail_order(order_id, "海螺账号积分不足，请联系管理员充值")
+                await _fail_order(order_id, "海螺账号积分不足，请联系管理员充值")
                 return
             logger.info(f"[worker] 海螺账号{acc_id}积分={credits}")
         except Exception as e:
             logger.warning(f"[worker] 海螺积分查询失败: {e}，继续尝试提交")
 
-        with Session(engine) as session:
-            order = session.get(VideoOrder, order_id)
-
-            model_id = _resolve_hailuo_model_id(session, order)
-            duration_int = int((order.duration or "6s").replace("s", ""))
-            resolution_str = (order.resolution or "768p").replace("p", "")
-            aspect_ratio = order.aspect_ratio or ""
-            quantity = order.quantity or 1
+        model_id = await run_in_session(_resolve_hailuo_model_id, order)
+        duration_int = int((order.duration or "6s").replace("s", ""))
+        resolution_str = (order.resolution or "768p").replace("p", "")
+        aspect_ratio = order.aspect_ratio or ""
+        quantity = order.quantity or 1
 
-            file_list = []
-            if order.first_frame_image:
-                try:
-                    r = await client.upload_image(order.first_frame_image)
-                    if r:
-                        file_list.append({
-                            "id": r["id"],
-                            "url": r["url"],
-                            "type": r["type"],
-                            "frameType": 0,
-                            "assetFileType": r.get("assetFileType", 1),
-                        })
-                except Exception as e:
-                    logger.warning(f"[worker] upload first frame failed: {e}")
-            if order.last_frame_image:
-                try:
-                    r = await client.upload_image(order.last_frame_image)
-                    if r:
-                        file_list.append({
-                            "id": r["id"],
-                            "url": r["url"],
-                            "type": r["type"],
-                            "frameType": 1,
-                            "assetFileType": r.get("assetFileType", 1),
-                        })
-                except Exception as e:
-                    logger.warning(f"[worker] upload last frame failed: {e}")
+        file_list = []
+        if order.first_frame_image:
+            try:
+                r = await client.upload_image(order.first_frame_image)
+                if r:
+                    file_list.append({
+                        "id": r["id"],
+                        "url": r["url"],
+                        "type": r["type"],
+                        "frameType": 0,
+                        "assetFileType": r.get("assetFileType", 1),
+                    })
+            except Exception as e:
+                logger.warning(f"[worker] upload first frame failed: {e}")
+        if order.last_frame_image:
+            try:
+                r = await client.upload_image(order.last_frame_image)
+                if r:
+                    file_list.append({
+                        "id": r["id"],
+                        "url": r["url"],
+                        "type": r["type"],
+                        "frameType": 1,
+                        "assetFileType": r.get("assetFileType", 1),
+                    })
+            except Exception as e:
+                logger.warning(f"[worker] upload last frame failed: {e}")
 
-            model_id, resolution_str, aspect_ratio = _normalize_hailuo_generation_params(
-                model_id=model_id,
-                resolution=resolution_str,
-                aspect_ratio=aspect_ratio,
-                file_count=len(file_list),
-            )
+        model_id, resolution_str, aspect_ratio = _normalize_hailuo_generation_params(
+            model_id=model_id,
+            resolution=resolution_str,
+            aspect_ratio=aspect_ratio,
+            file_count=len(file_list),
+        )
 
-            logger.info(
-                f"[worker] 海螺订单#{order_id} 提交参数: model_name={order.model_name}, "
-                f"model_id={model_id}, duration={duration_int}, resolution={resolution_str}, aspect_ratio={aspect_ratio or ''}, "
-                f"quantity={quantity}, first_frame={bool(order.first_frame_image)}, "
-                f"last_frame={bool(order.last_frame_image)}, file_list={len(file_list)}"
-            )
-            request_body = build_generate_video_body(
-                desc=order.prompt,
-                model_id=model_id,
-                duration=duration_int,
-                resolution=resolution_str,
-                aspect_ratio=aspect_ratio,
-                file_list=file_list,
-                quantity=quantity,
-            )
+        logger.info(
+            f"[worker] 海螺订单#{order_id} 提交参数: model_name={order.model_name}, "
+            f"model_id={model_id}, duration={duration_int}, resolution={resolution_str}, aspect_ratio={aspect_ratio or ''}, "
+            f"quantity={quantity}, first_frame={bool(order.first_frame_image)}, "
+            f"last_frame={bool(order.last_frame_image)}, file_list={len(file_list)}"
+        )
+        request_body = build_generate_video_body(
+            desc=order.prompt,
+            model_id=model_id,
+            duration=duration_int,
+            resolution=resolution_str,
+            aspect_ratio=aspect_ratio,
+            file_list=file_list,
+            quantity=quantity,
+        )
 
-            resp = await client.generate_video(
-                desc=order.prompt,
-                model_id=model_id,
-                duration=duration_int,
-                resolution=resolution_str,
-                aspect_ratio=aspect_ratio,
-                file_list=file_list,
-                quantity=quantity,
-            )
+        resp = await client.generate_video(
+            desc=order.prompt,
+            model_id=model_id,
+            duration=duration_int,
+            resolution=resolution_str,
+            aspect_ratio=aspect_ratio,
+            file_list=file_list,
+            quantity=quantity,
+        )
 
         status_code = resp.get("statusInfo", {}).get("code", -1)
         if status_code == 2400001 and not file_list and aspect_ratio:
@@ -404,201 +407,327 @@ async def submit_order(order_id: int):
             msg = _format_hailuo_failure_message(status_code, raw_msg)
             logger.error(f"[worker] order#{order_id} request body={json.dumps(request_body, ensure_ascii=False)[:5000]}")
             logger.error(f"[worker] order#{order_id} submit failed: code={status_code}, raw_msg={raw_msg}, msg={msg}, resp={json.dumps(resp, ensure_ascii=False)[:5000]}")
-            _fail_order(order_id, msg)
+            await _fail_order(order_id, msg)
             return
 
         tracking = _extract_hailuo_tracking(resp)
         task_ids = tracking["ids"]
         if not task_ids:
-            _fail_order(order_id, "API未返回taskID")
+            await _fail_order(order_id, "API未返回taskID")
             return
 
-        with Session(engine) as session:
-            order = session.get(VideoOrder, order_id)
-            order.status = "generating"
-            order.progress = max(order.progress or 0, 5)
-            order.status_message = "任务已提交，等待海螺开始生成..."
-            order.task_id = json.dumps(tracking, ensure_ascii=False)
-            order.updated_at = datetime.utcnow()
-            session.add(order)
-            session.commit()
+        order = await run_in_session(
+            _mark_generating, order_id, json.dumps(tracking, ensure_ascii=False),
+            "任务已提交，等待海螺开始生成...", 5,
+        )
+        _publish_order(order)
 
         logger.info(f"[worker] 订单#{order_id}已提交，tracking={tracking}，账号={acc_id}")
-        asyncio.create_task(poll_order_status(order_id, acc_id=acc_id))
+        await job_queue.enqueue("hailuo_poll", order_id, {"acc_id": acc_id, "started_at": time.time()}, delay=POLL_INTERVAL)
 
     except Exception as e:
         logger.error(f"[worker] 订单#{order_id}提交异常: {e}", exc_info=True)
-        _fail_order(order_id, str(e))
+        await _fail_order(order_id, str(e))
     finally:
         account_store.dec_tasks(acc_id)
 
 
-async def poll_order_status(order_id: int, acc_id: Optional[str] = None):
-    """轮询海螺任务状态直到完成或超时
+# ============ 海螺账号级轮询 ============
+# 每个 hailuo_poll 任务只检查一次：订阅所属账号的轮询器、取一次 tick 后按耗时统计重新排队。
+# 同一账号下同一时刻到期的订单共用一次请求：每个 tick 只请求一次 processing 列表，
+# 需要时再请求一次 batch 历史，然后按 taskID/batchID 把 feed 分发给各订单。
+
+class _PollTick:
+    """一次账号级轮询的结果"""
+
+    __slots__ = ("client", "processing_feeds", "history_feeds", "error")
+
+    def __init__(self, client=None, processing_feeds=None, history_feeds=None, error: str = ""):
+        self.client = client
+        self.processing_feeds = processing_feeds or []
+        self.history_feeds = history_feeds or []
+        self.error = error
+
+
+class _PollWaiter:
+    """订单在账号轮询器上的一次订阅，收到一次 tick 后即被移出"""
+
+    def __init__(self, order_id: int, match_ids: set[str], batch_ids: list[str]):
+        self.order_id = order_id
+        self.match_ids = match_ids
+        self.batch_ids = batch_ids
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        # 稍等片刻再请求，让同一时刻到期的其他订单并入同一个 tick
+        self.next_due = time.monotonic() + POLL_GATHER_SECONDS
+
+    def offer(self, tick: _PollTick):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(tick)
+
+
+def _feed_match_ids(feed: dict) -> set[str]:
+    ci = feed.get("commonInfo") or {}
+    candidate_ids = {
+        str(ci.get("taskID", "") or ""),
+        str(ci.get("id", "") or ""),
+        str(ci.get("batchID", "") or ""),
+    }
+    candidate_ids.discard("")
+    return candidate_ids
+
+
+def _flatten_batch_feeds(resp: dict) -> list[dict]:
+    feeds = []
+    for batch in (resp.get("data") or {}).get("batchFeeds") or []:
+        feeds.extend(batch.get("feeds") or [])
+    return feeds
+
+
+class HailuoAccountPoller:
+    """单个海螺账号的轮询循环，上游请求数与账号数成正比而不是与订单数成正比"""
+
+    def __init__(self, acc_id: Optional[str]):
+        self.acc_id = acc_id
+        self._waiters: list[_PollWaiter] = []
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+
+    def subscribe(self, order_id: int, match_ids: set[str], batch_ids: list[str]) -> _PollWaiter:
+        waiter = _PollWaiter(order_id, match_ids, batch_ids)
+        self._waiters.append(waiter)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+        return waiter
+
+    def unsubscribe(self, waiter: _PollWaiter):
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+
+    @property
+    def waiting_orders(self) -> list[int]:
+        return [w.order_id for w in self._waiters]
+
+    async def _run(self):
+        while self._waiters:
+            wait = min(w.next_due for w in self._waiters) - time.monotonic()
+            if wait > 0:
+                # 睡到最早到期的订单；期间有新订单订阅时提前醒来重新计算
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            horizon = time.monotonic() + POLL_TICK_SLACK
+            waiters = [w for w in self._waiters if w.next_due <= horizon]
+            tick = await self._fetch_tick(waiters)
+            for waiter in waiters:
+                self.unsubscribe(waiter)
+                waiter.offer(tick)
+
+    async def _fetch_tick(self, waiters: list[_PollWaiter]) -> _PollTick:
+        client = _make_client(self.acc_id)
+        if not client:
+            return _PollTick(error="找不到可用客户端")
+
+        batch_ids = sorted({b for w in waiters for b in w.batch_ids if b})
+        try:
+            resp = await client.get_processing_tasks(batch_ids)
+            processing_feeds = _flatten_batch_feeds(resp)
+
+            matched_ids: set[str] = set()
+            for feed in processing_feeds:
+                matched_ids |= _feed_match_ids(feed)
+            unmatched = [w for w in waiters if not w.match_ids & matched_ids]
+
+            history_feeds = []
+            if unmatched:
+                batch_resp = await client.get_batch_feeds(limit=min(50, max(10, len(unmatched) + 5)))
+                history_feeds = _flatten_batch_feeds(batch_resp)
+        except Exception as e:
+            return _PollTick(client=client, error=str(e))
+
+        logger.debug(
+            f"[poller] 账号{self.acc_id or 'auto'} tick: 订单数={len(waiters)}, "
+            f"processing={len(processing_feeds)}, history={len(history_feeds)}"
+        )
+        return _PollTick(client=client, processing_feeds=processing_feeds, history_feeds=history_feeds)
+
+
+_account_pollers: dict[Optional[str], HailuoAccountPoller] = {}
+
+
+def _get_account_poller(acc_id: Optional[str]) -> HailuoAccountPoller:
+    poller = _account_pollers.get(acc_id)
+    if poller is None:
+        poller = HailuoAccountPoller(acc_id)
+        _account_pollers[acc_id] = poller
+    return poller
+
+
+def get_poller_status() -> dict:
+    """各账号轮询器当前等待 tick 的订单"""
+    return {
+        (acc_id or "auto"): poller.waiting_orders
+        for acc_id, poller in _account_pollers.items()
+        if poller.waiting_orders
+    }
+
+
+def _poll_info(session: Session, order_id: int) -> Optional[dict]:
+    """轮询需要的订单字段；订单不存在或已结束时返回 None"""
+    order = session.get(VideoOrder, order_id)
+    if not order or order.status in ("completed", "failed"):
+        return None
+    return {
+        "task_id": order.task_id,
+        "quantity": order.quantity or 1,
+        "stats_key": video_order_key(order.model_name, order.resolution, order.duration),
+        "created_at": order.created_at,
+        "user_id": order.user_id,
+    }
+
+
+def _poll_started(started_at: Optional[float], created_at: Optional[datetime]) -> float:
+    """轮询开始时间（unix 秒）：优先取入队时记录的提交时间，缺失时（手动触发/全量扫描）按订单创建时间"""
+    if started_at:
+        return float(started_at)
+    if created_at:
+        return created_at.replace(tzinfo=timezone.utc).timestamp()
+    return time.time()
+
+
+async def poll_order_status(order_id: int, acc_id: Optional[str] = None,
+                            started_at: Optional[float] = None) -> Optional[float]:
+    """检查一次海螺订单状态，订单未结束时返回下次检查前的等待秒数
     海螺API没有按taskID查询的接口，需要通过 processing列表 + batch历史 来匹配
     支持 quantity>1 的批量订单：等所有视频都完成后再标记 completed
     """
-    elapsed = 0
-
     # 读取订单的 task_ids 和 quantity
-    with Session(engine) as session:
-        order = session.get(VideoOrder, order_id)
-        if not order:
-            return
-        task_ids_raw = order.task_id
-        expected_quantity = order.quantity or 1
+    info = await run_in_session(_poll_info, order_id)
+    if info is None:
+        return None
+    task_ids_raw = info["task_id"]
+    expected_quantity = info["quantity"]
+    stats_key = info["stats_key"]
+    created_at = info["created_at"]
+    user_id = info["user_id"]
 
     if not task_ids_raw:
         logger.warning(f"[worker] 订单#{order_id}没有task_id，停止轮询")
-        return
+        return None
+
+    elapsed = int(time.time() - _poll_started(started_at, created_at))
+    if elapsed >= MAX_POLL_SECONDS:
+        logger.error(f"[worker] 订单#{order_id}轮询超时")
+        await _fail_order(order_id, "生成超时")
+        return None
+    # 按该模型的历史耗时分布安排下次检查（以订单创建时间为起点）
+    next_check = generation_stats.next_interval(
+        stats_key, (datetime.utcnow() - created_at).total_seconds() if created_at else elapsed, POLL_INTERVAL
+    )
 
     target_task_ids, target_batch_ids = _load_hailuo_tracking(task_ids_raw)
     target_match_ids = set(target_task_ids) | {str(x) for x in target_batch_ids if x}
 
-    while elapsed < MAX_POLL_SECONDS:
-        await asyncio.sleep(POLL_INTERVAL)
-        elapsed += POLL_INTERVAL
-
-        with Session(engine) as session:
-            order = session.get(VideoOrder, order_id)
-            if not order:
-                return
-            if order.status in ("completed", "failed"):
-                return
+    poller = _get_account_poller(acc_id)
+    waiter = poller.subscribe(order_id, target_match_ids, target_batch_ids)
+    try:
+        tick = await asyncio.wait_for(waiter.queue.get(), timeout=POLL_TICK_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"[worker] 订单#{order_id}等待账号轮询超时")
+        return next_check
+    finally:
+        poller.unsubscribe(waiter)
 
-        client = _make_client(acc_id)
-        if not client:
-            logger.warning(f"[worker] 轮询订单#{order_id}找不到可用客户端")
-            continue
+    if tick.error:
+        logger.warning(f"[worker] 轮询订单#{order_id}异常: {tick.error}")
+        return next_check
 
-        try:
-            # 1. 先查 processing 列表
-            resp = await client.get_processing_tasks(target_batch_ids)
-            batch_feeds = (resp.get("data") or {}).get("batchFeeds") or []
-            feeds = []
-            for batch in batch_feeds:
-                feeds.extend((batch.get("feeds") or []))
-
-            # 收集 processing 中匹配的 feed 状态
-            still_processing = False
-            processing_completed_urls = []
-            all_failed = True  # 假设全部失败，有任何非失败的就置 False
-            has_matched_feed = False
-            last_fail_msg = ""
-            for feed in feeds:
+    client = tick.client
+    try:
+        # 1. 先看 processing 列表
+        still_processing = False
+        processing_completed_urls = []
+        all_failed = True  # 假设全部失败，有任何非失败的就置 False
+        has_matched_feed = False
+        last_fail_msg = ""
+        hinted_progress, hinted_message = 0, ""
+        for feed in tick.processing_feeds:
+            if target_match_ids.intersection(_feed_match_ids(feed)):
                 ci = feed.get("commonInfo") or {}
-                candidate_ids = {
-                    str(ci.get("taskID", "") or ""),
-                    str(ci.get("id", "") or ""),
-                    str(ci.get("batchID", "") or ""),
-                }
-                candidate_ids.discard("")
-                if target_match_ids.intersection(candidate_ids):
-                    has_matched_feed = True
-                    status = ci.get("status", 0)
-                    feed_message = (feed.get("feedMessage") or {}).get("message", "")
-                    if status == 2:
-                        all_failed = False
-                        parsed = client._parse_feed(feed)
-                        if parsed.get("video_url"):
-                            processing_completed_urls.append(parsed["video_url"])
-                    elif status >= 90:
-                        last_fail_msg = feed_message or "生成失败"
-                    else:
-                        all_failed = False
-                        still_processing = True
-                        hinted_progress, hinted_message = _hailuo_progress_hint(status, feed_message, 0)
-                        with Session(engine) as session:
-                            order = session.get(VideoOrder, order_id)
-                            if order and order.status == "generating":
-                                order.progress = max(order.progress or 0, hinted_progress)
-                                order.status_message = hinted_message
-                                if expected_quantity > 1 and processing_completed_urls:
-                                    order.status_message = f"已完成 {len(processing_completed_urls)}/{expected_quantity}，{hinted_message}"
-                                order.updated_at = datetime.utcnow()
-                                session.add(order)
-                                session.commit()
-
-            # 如果所有匹配的 feed 都失败了
-            if has_matched_feed and all_failed and not processing_completed_urls:
-                _fail_order(order_id, last_fail_msg or "生成失败")
-                return
-
-            # 如果 processing 中有已完成的视频，但还有未完成的，继续等待
-            if still_processing:
-                with Session(engine) as session:
-                    order = session.get(VideoOrder, order_id)
-                    if order and order.status == "generating":
-                        order.progress = max(order.progress or 0, min(80, 10 + elapsed * 70 // MAX_POLL_SECONDS))
-                        if not order.status_message:
-                            if expected_quantity > 1 and processing_completed_urls:
-                                order.status_message = f"已完成 {len(processing_completed_urls)}/{expected_quantity}，正在生成中..."
-                            else:
-                                order.status_message = "海螺正在生成中..."
-                        order.updated_at = datetime.utcnow()
-                        session.add(order)
-                        session.commit()
-                continue
+                has_matched_feed = True
+                status = ci.get("status", 0)
+                feed_message = (feed.get("feedMessage") or {}).get("message", "")
+                if status == 2:
+                    all_failed = False
+                    parsed = client._parse_feed(feed)
+                    if parsed.get("video_url"):
+                        processing_completed_urls.append(parsed["video_url"])
+                elif status >= 90:
+                    last_fail_msg = feed_message or "生成失败"
+                else:
+                    all_failed = False
+                    still_processing = True
+                    feed_progress, hinted_message = _hailuo_progress_hint(status, feed_message, 0)
+                    hinted_progress = max(hinted_progress, feed_progress)
+
+        # 如果所有匹配的 feed 都失败了
+        if has_matched_feed and all_failed and not processing_completed_urls:
+            await _fail_order(order_id, last_fail_msg or "生成失败")
+            return None
 
-            # processing 中所有匹配的都完成了（无 still_processing），直接用收集到的 URL
-            if processing_completed_urls:
-                # 对于批量订单，检查是否收集够了数量（至少有一个即可标记完成）
-                with Session(engine) as session:
-                    order = session.get(VideoOrder, order_id)
-                    if not order or order.status in ("completed", "failed"):
-                        return
-                    order.status = "completed"
-                    order.progress = 100
-                    order.status_message = "已生成完成"
-                    order.video_url = processing_completed_urls[0]
-                    order.video_urls = json.dumps(processing_completed_urls)
-                    order.updated_at = datetime.utcnow()
-                    session.add(order)
-                    session.commit()
-                logger.info(f"[worker] 订单#{order_id}在processing中完成，视频数={len(processing_completed_urls)}/{expected_quantity}")
-                return
+        # 如果 processing 中有已完成的视频，但还有未完成的，继续等待
+        # 进度只写入缓冲，由 progress_buffer 合并后批量落库
+        if still_processing:
+            if expected_quantity > 1 and processing_completed_urls:
+                hinted_message = f"已完成 {len(processing_completed_urls)}/{expected_quantity}，{hinted_message}"
+            progress = max(hinted_progress, min(80, 10 + elapsed * 70 // MAX_POLL_SECONDS))
+            status_message = hinted_message or "海螺正在生成中..."
+            progress_buffer.set(VideoOrder, order_id, progress=progress, status_message=status_message)
+            order_events.publish(
+                user_id, "video", order_id,
+                status="generating", progress=progress, status_message=status_message,
+            )
+            return next_check
 
-            # 2. processing 里没有了，去 batch 历史查完成的视频
-            batch_resp = await client.get_batch_feeds(limit=10)
-            batch_feeds = (batch_resp.get("data") or {}).get("batchFeeds") or []
-
-            video_urls = []
-            for batch in batch_feeds:
-                for feed in (batch.get("feeds") or []):
-                    ci = feed.get("commonInfo") or {}
-                    candidate_ids = {
-                        str(ci.get("taskID", "") or ""),
-                        str(ci.get("id", "") or ""),
-                        str(ci.get("batchID", "") or ""),
-                    }
-                    candidate_ids.discard("")
-                    if target_match_ids.intersection(candidate_ids) and ci.get("status") == 2:
-                        parsed = client._parse_feed(feed)
-                        if parsed.get("video_url"):
-                            video_urls.append(parsed["video_url"])
-
-            if video_urls:
-                with Session(engine) as session:
-                    order = session.get(VideoOrder, order_id)
-                    if not order or order.status in ("completed", "failed"):
-                        return
-                    order.status = "completed"
-                    order.progress = 100
-                    order.status_message = "已生成完成"
-                    order.video_url = video_urls[0]
-                    order.video_urls = json.dumps(video_urls)
-                    order.updated_at = datetime.utcnow()
-                    session.add(order)
-                    session.commit()
-                logger.info(f"[worker] 订单#{order_id}完成，视频数={len(video_urls)}/{expected_quantity}")
-                return
+        # processing 中所有匹配的都完成了（无 still_processing），直接用收集到的 URL
+        if processing_completed_urls:
+            # 对于批量订单，检查是否收集够了数量（至少有一个即可标记完成）
+            progress_buffer.discard(VideoOrder, order_id)
+            order = await run_in_session(_complete_order, order_id, processing_completed_urls, "已生成完成")
+            if not order:
+                return None
+            _publish_order(order)
+            generation_stats.record_since(stats_key, created_at)
+            logger.info(f"[worker] 订单#{order_id}在processing中完成，视频数={len(processing_completed_urls)}/{expected_quantity}")
+            return None
 
-        except Exception as e:
-            logger.warning(f"[worker] 轮询订单#{order_id}异常: {e}")
-            continue
+        # 2. processing 里没有了，去 batch 历史查完成的视频
+        video_urls = []
+        for feed in tick.history_feeds:
+            ci = feed.get("commonInfo") or {}
+            if target_match_ids.intersection(_feed_match_ids(feed)) and ci.get("status") == 2:
+                parsed = client._parse_feed(feed)
+                if parsed.get("video_url"):
+                    video_urls.append(parsed["video_url"])
+
+        if video_urls:
+            progress_buffer.discard(VideoOrder, order_id)
+            order = await run_in_session(_complete_order, order_id, video_urls, "已生成完成")
+            if not order:
+                return None
+            _publish_order(order)
+            generation_stats.record_since(stats_key, created_at)
+            logger.info(f"[worker] 订单#{order_id}完成，视频数={len(video_urls)}/{expected_quantity}")
+            return None
 
-    logger.error(f"[worker] 订单#{order_id}轮询超时")
-    _fail_order(order_id, "生成超时")
+    except Exception as e:
+        logger.warning(f"[worker] 轮询订单#{order_id}异常: {e}")
+    return next_check
 
 
 def _make_client(acc_id: Optional[str]) -> Optional[HailuoApiClient]:
@@ -615,31 +744,85 @@ def _make_client(acc_id: Optional[str]) -> Optional[HailuoApiClient]:
         return client
     # 回退到旧的 account_store
     if acc_id and account_store.has_credentials(acc_id):
-        creds = account_store.get_credentials(acc_id)
-    else:
-        creds = None
-        for aid, acc in account_store.accounts.items():
-            if acc.is_active and account_store.has_credentials(aid):
-                creds = account_store.get_credentials(aid)
-                break
-        if not creds:
-            return None
-    return HailuoApiClient(
-        cookie=creds["cookie"],
-        uuid=creds["uuid"],
-        device_id=creds["device_id"],
+        return _store_client(acc_id)
+    for aid, acc in account_store.accounts.items():
+        if acc.is_active and account_store.has_credentials(aid):
+            return _store_client(aid)
+    return None
+
+
+def _store_client(acc_id: str) -> HailuoApiClient:
+    """旧 account_store 账号的池化客户端（key 加前缀避免与 hailuo_api 账号冲突）"""
+    creds = account_store.get_credentials(acc_id)
+    return hailuo_account_mgr.client_pool.get(
+        f"store:{acc_id}", creds["cookie"], creds["uuid"], creds["device_id"]
     )
 
 
-def _fail_order(order_id: int, reason: str = ""):
-    with Session(engine) as session:
-        order = session.get(VideoOrder, order_id)
-        if order:
-            _fail_order_in_session(session, order, reason)
-            session.commit()
+def _publish_order(order: VideoOrder):
+    """推送订单当前状态给订阅了事件流的用户"""
+    order_events.publish(
+        order.user_id, "video", order.id,
+        status=order.status,
+        progress=order.progress,
+        status_message=order.status_message,
+        video_url=order.video_url,
+    )
+
+
+def _get_order(session: Session, order_id: int) -> Optional[VideoOrder]:
+    return session.get(VideoOrder, order_id)
+
+
+def _mark_generating(session: Session, order_id: int, task_id: str,
+                     status_message: Optional[str] = None, min_progress: int = 0) -> VideoOrder:
+    order = session.get(VideoOrder, order_id)
+    order.status = "generating"
+    order.task_id = task_id
+    if min_progress:
+        order.progress = max(order.progress or 0, min_progress)
+    if status_message:
+        order.status_message = status_message
+    order.updated_at = datetime.utcnow()
+    session.add(order)
+    session.commit()
+    return order
+
+
+def _complete_order(session: Session, order_id: int, video_urls: list[str],
+                    status_message: Optional[str] = None) -> Optional[VideoOrder]:
+    """标记订单完成；订单不存在或已结束时返回 None"""
+    order = session.get(VideoOrder, order_id)
+    if not order or order.status in ("completed", "failed"):
+        return None
+    order.status = "completed"
+    order.progress = 100
+    if status_message:
+        order.status_message = status_message
+    order.video_url = video_urls[0] if video_urls else ""
+    order.video_urls = json.dumps(video_urls)
+    order.updated_at = datetime.utcnow()
+    session.add(order)
+    session.commit()
+    return order
+
+
+def _fail_order_by_id(session: Session, order_id: int, reason: str) -> Optional[VideoOrder]:
+    order = session.get(VideoOrder, order_id)
+    if order:
+        _fail_order_in_session(session, order, reason)
+        session.commit()
+    return order
+
+
+async def _fail_order(order_id: int, reason: str = ""):
+    order = await run_in_session(_fail_order_by_id, order_id, reason)
+    if order:
+        _publish_order(order)
 
 
 def _fail_order_in_session(session, order, reason: str = ""):
+    progress_buffer.discard(VideoOrder, order.id)
     order.status = "failed"
     order.progress = 0
     order.status_message = reason or "生成失败"
@@ -663,22 +846,21 @@ def _fail_order_in_session(session, order, reason: str = ""):
     session.add(order)
 
 
+def _in_progress_orders(session: Session) -> list[tuple[int, Optional[str]]]:
+    return session.exec(
+        select(VideoOrder.id, VideoOrder.model_name).where(
+            VideoOrder.status.in_(["generating", "processing"])
+        )
+    ).all()
+
+
 async def poll_all_pending_orders():
-    """扫描所有 generating/processing 状态的订单并触发轮询"""
-    with Session(engine) as session:
-        orders = session.exec(
-            select(VideoOrder).where(
-                VideoOrder.status.in_(["generating", "processing"])
-            )
-        ).all()
-        order_data = [(o.id, o.model_name) for o in orders]
+    """扫描所有 generating/processing 状态的订单，为缺少轮询任务的订单入队"""
+    order_data = await run_in_session(_in_progress_orders)
 
     logger.info(f"[worker] 全量扫描：找到 {len(order_data)} 个进行中订单")
     for oid, mname in order_data:
-        if _is_kling_model(mname):
-            asyncio.create_task(poll_kling_order(oid))
-        else:
-            asyncio.create_task(poll_order_status(oid))
+        await job_queue.enqueue("kling_poll" if _is_kling_model(mname) else "hailuo_poll", oid)
 
 
 # ============ 可灵分支 ============
@@ -705,7 +887,7 @@ async def _submit_kling_order(order_id: int):
     """可灵订单提交：预检积分 → 上传图片（如有）→ 提交任务 → 更新状态为 generating"""
     result = _pick_kling_account()
     if not result:
-        _fail_order(order_id, "无可用可灵账号")
+        await _fail_order(order_id, "无可用可灵账号")
         return
 
     acc_id, cookie = result
@@ -716,25 +898,24 @@ async def _submit_kling_order(order_id: int):
         #     pts = await kling_api.get_user_points(cookie)
         #     total_pts = pts.get("total", 0)
         #     if total_pts < 100:
-        #         _fail_order(order_id, f"可灵账号积分不足（剩余{total_pts}），需要至少100积分，请联系管理员充值")
+        #         await _fail_order(order_id, f"可灵账号积分不足（剩余{total_pts}），需要至少100积分，请联系管理员充值")
         #         return
         # except Exception as e:
         #     logger.warning(f"[worker] 可灵积分查询失败: {e}，继续尝试提交")
 
-        with Session(engine) as session:
-            order = session.get(VideoOrder, order_id)
-            if not order:
-                return
-            version = KLING_MODEL_MAP[order.model_name]
-            duration_int = int((order.duration or "5s").replace("s", ""))
-            prompt = order.prompt or ""
-            first_frame = order.first_frame_image
-            last_frame = order.last_frame_image
-            video_type = order.video_type or "image_to_video"
-            order_resolution = order.resolution or "1080p"
-            aspect_ratio = order.aspect_ratio or "16:9"
-            # mode 由分辨率决定：std=720p, pro=1080p
-            mode = "pro" if order_resolution == "1080p" else "std"
+        order = await run_in_session(_get_order, order_id)
+        if not order:
+            return
+        version = KLING_MODEL_MAP[order.model_name]
+        duration_int = int((order.duration or "5s").replace("s", ""))
+        prompt = order.prompt or ""
+        first_frame = order.first_frame_image
+        last_frame = order.last_frame_image
+        video_type = order.video_type or "image_to_video"
+        order_resolution = order.resolution or "1080p"
+        aspect_ratio = order.aspect_ratio or "16:9"
+        # mode 由分辨率决定：std=720p, pro=1080p
+        mode = "pro" if order_resolution == "1080p" else "std"
 
         image_url = ""
         if first_frame:
@@ -769,20 +950,15 @@ async def _submit_kling_order(order_id: int):
             aspect_ratio=aspect_ratio,
         )
 
-        with Session(engine) as session:
-            order = session.get(VideoOrder, order_id)
-            order.status = "generating"
-            order.task_id = task_id
-            order.updated_at = datetime.utcnow()
-            session.add(order)
-            session.commit()
+        order = await run_in_session(_mark_generating, order_id, task_id)
+        _publish_order(order)
 
         logger.info(f"[worker] 可灵订单#{order_id}已提交，task_id={task_id}，账号={acc_id}")
-        asyncio.create_task(poll_kling_order(order_id, cookie=cookie))
+        await job_queue.enqueue("kling_poll", order_id, {"acc_id": acc_id, "started_at": time.time()}, delay=KLING_POLL_INTERVAL)
 
     except Exception as e:
         logger.error(f"[worker] 可灵订单#{order_id}提交异常: {e}", exc_info=True)
-        _fail_order(order_id, str(e))
+        await _fail_order(order_id, str(e))
 
 
 VIDEOS_DIR = os.path.join(os.path.dirname(__file__), "..", "videos")
@@ -797,45 +973,61 @@ async def _download_video_to_local(url: str, order_id: int, idx: int = 0) -> str
     local_url = f"/videos/{filename}"
 
     try:
-        async with httpx.AsyncClient(timeout=120, follow_redirects=True) as client:
-            r = await client.get(url)
-            r.raise_for_status()
-            with open(filepath, "wb") as f:
-                f.write(r.content)
-        logger.info(f"[worker] 可灵订单#{order_id} 视频已下载到 {filepath} ({len(r.content)} bytes)")
+        size = await video_downloader.download(url, filepath)
+        logger.info(f"[worker] 可灵订单#{order_id} 视频已下载到 {filepath} ({size} bytes)")
         return local_url
     except Exception as e:
         logger.warning(f"[worker] 可灵订单#{order_id} 视频下载失败: {e}，保留原始URL")
         return url
 
 
-async def poll_kling_order(order_id: int, cookie: Optional[str] = None):
-    """轮询可灵任务直到完成或超时"""
-    with Session(engine) as session:
-        order = session.get(VideoOrder, order_id)
-        if not order:
-            return
-        task_id = order.task_id
-        model_name = order.model_name
-        want_no_watermark = getattr(order, 'remove_watermark', True)
+async def poll_kling_order(order_id: int, cookie: Optional[str] = None, acc_id: Optional[str] = None,
+                           started_at: Optional[float] = None) -> Optional[float]:
+    """检查一次可灵任务状态，未结束时返回下次检查前的等待秒数（acc_id 为提交时使用的账号，用于取回 cookie）"""
+    order = await run_in_session(_get_order, order_id)
+    if not order or order.status in ("completed", "failed"):
+        return None
+    task_id = order.task_id
+    want_no_watermark = getattr(order, 'remove_watermark', True)
+    stats_key = video_order_key(order.model_name, order.resolution, order.duration)
+    created_at = order.created_at
 
     if not task_id:
         logger.warning(f"[worker] 可灵订单#{order_id}没有task_id，停止轮询")
-        return
+        return None
+
+    if time.time() - _poll_started(started_at, created_at) >= MAX_POLL_SECONDS:
+        logger.error(f"[worker] 可灵订单#{order_id}生成超时")
+        await _fail_order(order_id, "生成超时")
+        return None
+
+    if not cookie and acc_id:
+        creds = kling_api.get_kling_credentials(acc_id)
+        if creds:
+            cookie = creds.get("cookie")
 
     # 若没有传入 cookie，尝试从账号列表中获取任意可用账号
     if not cookie:
         result = _pick_kling_account()
         if not result:
             logger.warning(f"[worker] 可灵轮询订单#{order_id}：无可用账号")
-            _fail_order(order_id, "无可用可灵账号")
-            return
+            await _fail_order(order_id, "无可用可灵账号")
+            return None
         _, cookie = result
 
     try:
-        result = await kling_api.poll_task(cookie, task_id, timeout=MAX_POLL_SECONDS)
+        result = await kling_api.get_task_status(cookie, task_id)
+        status = result.get("status", 0)
         video_url = result.get("video_url", "")
+        if not video_url:
+            if status >= 90:
+                data = (result.get("raw") or {}).get("data") or {}
+                raise RuntimeError(f"task {task_id} failed with status {status}: {data.get('message', '')}")
+            # 轮询间隔按该模型的历史耗时分布自适应（elapsed 以订单创建时间为起点）
+            elapsed = (datetime.utcnow() - created_at).total_seconds() if created_at else 0
+            return generation_stats.next_interval(stats_key, elapsed, KLING_POLL_INTERVAL)
         creative_id = result.get("creative_id", "")
+        logger.info(f"[worker] 可灵订单#{order_id} 任务完成, status={status}, creativeId={creative_id}")
 
         # 根据用户选择决定是否去水印
         if want_no_watermark and creative_id:
@@ -857,23 +1049,15 @@ async def poll_kling_order(order_id: int, cookie: Optional[str] = None):
         else:
             local_url = ""
 
-        with Session(engine) as session:
-            order = session.get(VideoOrder, order_id)
-            if not order or order.status in ("completed", "failed"):
-                return
-            order.status = "completed"
-            order.progress = 100
-            order.video_url = local_url
-            order.video_urls = json.dumps([local_url]) if local_url else "[]"
-            order.updated_at = datetime.utcnow()
-            session.add(order)
-            session.commit()
+        order = await run_in_session(_complete_order, order_id, [local_url] if local_url else [])
+        if not order:
+            return None
+        _publish_order(order)
+        generation_stats.record_since(stats_key, created_at)
 
         logger.info(f"[worker] 可灵订单#{order_id}完成，video_url={local_url}")
 
-    except TimeoutError:
-        logger.error(f"[worker] 可灵订单#{order_id}生成超时")
-        _fail_order(order_id, "生成超时")
     except Exception as e:
         logger.error(f"[worker] 可灵订单#{order_id}轮询异常: {e}", exc_info=True)
-        _fail_order(order_id, str(e))
+        await _fail_order(order_id, str(e))
+    return None
@@ -0,0 +1,143 @@
+"""
+自适应轮询调度
+按 平台/模型/分辨率/时长 记录订单从创建到完成的耗时分布，据此安排轮询：
+预期完成前稀疏、p50~p90 区间密集、超过 p90 后指数退避。样本不足时退回固定间隔。
+"""
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_WINDOW = 200      # 每个 key 保留最近 N 个样本
+MIN_SAMPLES = 5          # 样本数不足时使用默认固定间隔
+DENSE_INTERVAL = 3.0     # p50~p90 区间的轮询间隔（秒）
+SPARSE_MAX_INTERVAL = 20.0
+BACKOFF_MAX_INTERVAL = 30.0
+SEED_LIMIT = 2000        # 启动时从数据库加载的最近完成订单数（每张表），加载前使用默认固定间隔
+
+
+def video_order_key(model_name: Optional[str], resolution: Optional[str], duration) -> str:
+    """VideoOrder（海螺/可灵）的统计 key"""
+    from backend.order_worker import _is_kling_model
+    platform = "kling" if _is_kling_model(model_name) else "hailuo"
+    return f"{platform}:{model_name or ''}:{resolution or ''}:{duration or ''}"
+
+
+def gptimage_order_key(model_name: Optional[str], quality: Optional[str]) -> str:
+    return f"gptimage:{model_name or ''}:{quality or ''}"
+
+
+def _quantile(sorted_values: list[float], q: float) -> float:
+    idx = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[idx]
+
+    """各模型生成耗时样本（线程安全，启动时的 seed_from_db 在线程池中执行）"""
+class GenerationStats:
+    """各模型生成耗时样本（线程安全，GPT-Image 后台线程也会写入）"""
+
+    def __init__(self):
+        self._samples: dict[str, deque] = {}
+        self._lock = threading.Lock()
+        self._seeded = False
+
+    def record(self, key: str, seconds: float):
+        if seconds <= 0:
+            return
+        with self._lock:
+            self._samples.setdefault(key, deque(maxlen=SAMPLE_WINDOW)).append(float(seconds))
+
+    def record_since(self, key: str, created_at: Optional[datetime]):
+        if created_at:
+            self.record(key, (datetime.utcnow() - created_at).total_seconds())
+
+    def quantiles(self, key: str) -> Optional[tuple[float, float]]:
+        """返回 (p50, p90)，样本不足时返回 None"""
+        with self._lock:
+            samples = self._samples.get(key)
+            if not samples or len(samples) < MIN_SAMPLES:
+                return None
+            values = sorted(samples)
+        return _quantile(values, 0.5), _quantile(values, 0.9)
+
+    def next_interval(self, key: str, elapsed: float, default: float) -> float:
+        """距订单创建 elapsed 秒时，到下一次轮询应等待的秒数"""
+        q = self.quantiles(key)
+        if not q:
+            return default
+        p50, p90 = q
+        dense = min(default, DENSE_INTERVAL)
+        dense_start = p50 * 0.5
+        if elapsed < dense_start:
+            # 稀疏阶段：直接睡到密集区间开始（有上限，防止统计偏差导致漏掉早完成的任务）
+            return min(SPARSE_MAX_INTERVAL, max(dense, dense_start - elapsed))
+        if elapsed <= p90:
+            return dense
+        # 超过 p90：按超出程度指数退避
+        overdue = (elapsed - p90) / max(p90 * 0.25, 10.0)
+        return min(BACKOFF_MAX_INTERVAL, dense * (2 ** overdue))
+
+    def seed_from_db(self, session) -> int:
+        """
+        用最近完成的订单初始化样本，返回加载的样本数
+        启动时通过 run_in_session 执行一次（不在事件循环上查库），只查询计算耗时需要的列
+        """
+        if self._seeded:
+            return 0
+        self._seeded = True
+        from sqlmodel import select
+        from backend.models import VideoOrder, GptimageOrder
+        try:
+            videos = session.exec(
+                select(
+                    VideoOrder.model_name, VideoOrder.resolution, VideoOrder.duration,
+                    VideoOrder.created_at, VideoOrder.updated_at,
+                ).where(VideoOrder.status == "completed")
+                .order_by(VideoOrder.id.desc()).limit(SEED_LIMIT)
+            ).all()
+            for model_name, resolution, duration, created_at, updated_at in reversed(videos):
+                if created_at and updated_at:
+                    self.record(
+                        video_order_key(model_name, resolution, duration),
+                        (updated_at - created_at).total_seconds(),
+                    )
+            images = session.exec(
+                select(
+                    GptimageOrder.model_name, GptimageOrder.quality,
+                    GptimageOrder.created_at, GptimageOrder.completed_at,
+                ).where(GptimageOrder.status == "completed")
+                .order_by(GptimageOrder.id.desc()).limit(SEED_LIMIT)
+            ).all()
+            for model_name, quality, created_at, completed_at in reversed(images):
+                if created_at and completed_at:
+                    self.record(
+                        gptimage_order_key(model_name, quality),
+                        (completed_at - created_at).total_seconds(),
+                    )
+        except Exception as e:
+            logger.warning(f"[poll-schedule] 加载历史耗时样本失败: {e}")
+            return 0
+        logger.info(f"[poll-schedule] 已从数据库加载 {len(videos) + len(images)} 个耗时样本")
+        return len(videos) + len(images)
+
+    def snapshot(self) -> dict:
+        """各 key 的样本数与 p50/p90（秒）"""
+        with self._lock:
+            keys = list(self._samples.keys())
+        result = {}
+        for key in keys:
+            with self._lock:
+                count = len(self._samples[key])
+            q = self.quantiles(key)
+            result[key] = {
+                "samples": count,
+                "p50": round(q[0], 1) if q else None,
+                "p90": round(q[1], 1) if q else None,
+            }
+        return result
+
+
+# 全局单例
+generation_stats = GenerationStats()
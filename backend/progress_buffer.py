@@ -0,0 +1,166 @@
+"""
+订单进度写缓冲
+轮询过程中的 progress/status_message 变化先合并在内存中，每隔 N 毫秒用一个事务批量 UPDATE；
+值未变化的不写。终态（完成/失败/退款）仍由调用方立即提交，并通过 discard 丢弃缓冲中的旧值；
+其他途径进入终态的订单不再有进度写入，其"已写入值"记录在空闲 FLUSHED_IDLE_SECONDS 后由 flush 清理。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import bindparam, case, update
+from sqlmodel import Session
+
+from backend.models import engine
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_MS = int(os.getenv("PROGRESS_FLUSH_MS", "1000"))
+TERMINAL_STATUSES = ("completed", "failed")
+BUFFERED_FIELDS = ("progress", "status_message")
+FLUSHED_IDLE_SECONDS = 600  # 超过该时长没有进度写入的订单不再保留已写入值
+
+
+class ProgressBuffer:
+    """按 (表, 订单ID) 合并进度写入（线程安全，flush 在线程池中执行）"""
+
+    def __init__(self, flush_interval_ms: int = FLUSH_INTERVAL_MS):
+        self.flush_interval = flush_interval_ms / 1000
+        self._pending: dict[tuple, dict] = {}
+        self._flushed: dict[tuple, dict] = {}  # 最近一次写入数据库的值，用于跳过无变化写入
+        self._touched: dict[tuple, float] = {}  # 每个订单最近一次 set 的时间，用于清理 _flushed
+        self._pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+        self._task = None
+        self._writes = 0
+        self._skipped = 0
+
+    def set(self, model, order_id: int, **fields):
+        """记录进度变化；progress 只增不减"""
+        unknown = set(fields) - set(BUFFERED_FIELDS)
+        if unknown:
+            raise ValueError(f"不支持缓冲的字段: {unknown}")
+        key = (model, order_id)
+        with self._lock:
+            self._touched[key] = time.monotonic()
+            row = self._pending.get(key, {})
+            known = {**self._flushed.get(key, {}), **row}
+            for name, value in fields.items():
+                if name == "progress" and known.get("progress") is not None:
+                    value = max(known["progress"], value)
+                row[name] = value
+            if all(self._flushed.get(key, {}).get(k) == v for k, v in row.items()):
+                self._pending.pop(key, None)
+                self._skipped += 1
+            else:
+                self._pending[key] = row
+        if self._task is None:
+            # 未启动后台刷新（如脚本/测试环境）时直接写穿
+            self.flush()
+
+    def discard(self, model, order_id: int):
+        """订单进入终态时丢弃未写入的进度，避免覆盖终态"""
+        key = (model, order_id)
+        with self._lock:
+            self._pending.pop(key, None)
+            self._flushed.pop(key, None)
+            self._touched.pop(key, None)
+
+    def _prune_idle(self):
+        """清理长时间没有进度写入的订单（已由其他途径进入终态，或被终态保护跳过的行）；调用方持有锁"""
+        now = time.monotonic()
+        if now - self._pruned_at < FLUSHED_IDLE_SECONDS / 10:
+            return
+        self._pruned_at = now
+        for key in [k for k, t in self._touched.items() if now - t >= FLUSHED_IDLE_SECONDS]:
+            if key not in self._pending:
+                self._flushed.pop(key, None)
+                self._touched.pop(key, None)
+
+    def flush(self) -> int:
+        """把缓冲中的变化批量写入数据库，返回写入行数"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._prune_idle()
+        if not pending:
+            return 0
+
+        # 按 (表, 字段集合) 分组，每组一条 executemany UPDATE
+        groups: dict[tuple, list] = {}
+        for (model, order_id), row in pending.items():
+            groups.setdefault((model, tuple(sorted(row))), []).append((order_id, row))
+
+        now = datetime.utcnow()
+        try:
+            with Session(engine) as session:
+                for (model, names), rows in groups.items():
+                    values = {}
+                    for name in names:
+                        if name == "progress":
+                            values["progress"] = case(
+                                (model.progress > bindparam("v_progress"), model.progress),
+                                else_=bindparam("v_progress"),
+                            )
+                        else:
+                            values[name] = bindparam(f"v_{name}")
+                    if hasattr(model, "updated_at"):
+                        values["updated_at"] = bindparam("v_updated_at")
+                    stmt = (
+                        update(model)
+                        .where(model.id == bindparam("b_id"))
+                        .where(*(model.status != st for st in TERMINAL_STATUSES))
+                        .values(values)
+                        .execution_options(synchronize_session=False)
+                    )
+                    params = [
+                        {"b_id": order_id, "v_updated_at": now, **{f"v_{k}": v for k, v in row.items()}}
+                        for order_id, row in rows
+                    ]
+                    session.connection().execute(stmt, params)
+                session.commit()
+        except Exception as e:
+            logger.error(f"[progress] 批量写入失败: {e}")
+            with self._lock:
+                # 放回缓冲，较新的值优先
+                for key, row in pending.items():
+                    self._pending[key] = {**row, **self._pending.get(key, {})}
+            return 0
+
+        with self._lock:
+            for key, row in pending.items():
+                self._flushed[key] = {**self._flushed.get(key, {}), **row}
+            self._writes += len(pending)
+        return len(pending)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "tracked": len(self._flushed),
+                "rows_written": self._writes,
+                "unchanged_skipped": self._skipped,
+                "flush_interval_ms": int(self.flush_interval * 1000),
+            }
+
+
+# 全局单例
+progress_buffer = ProgressBuffer()
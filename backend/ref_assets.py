@@ -0,0 +1,129 @@
+"""
+参考图资产
+上传时边读边算 sha256 并写入 uploads/gptimage/refs/<sha256>.<ext>，相同内容只存一份，
+订单里保存的就是这个按内容寻址的路径，重试、重启后都能直接复用。
+生成时需要的 data URL 分块编码（不阻塞事件循环），按路径缓存在有大小上限的 LRU 中，
+同一批次/同一张参考图的多个订单共用一个字符串。
+"""
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+import aiofiles
+from fastapi import UploadFile
+
+logger = logging.getLogger(__name__)
+
+REF_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "uploads", "gptimage", "refs")
+CACHE_MAX_BYTES = int(os.getenv("REF_CACHE_MB", "64")) * 1024 * 1024
+READ_CHUNK = 3 * 256 * 1024   # 3 的倍数，分块 base64 拼接后与整体编码结果一致
+
+MIME_MAP = {"jpg": "image/jpeg", "jpeg": "image/jpeg", "png": "image/png", "webp": "image/webp", "gif": "image/gif"}
+
+
+def _ext_of(filename: str) -> str:
+    ext = filename.rsplit(".", 1)[-1].lower() if "." in filename else "jpg"
+    return ext if ext in MIME_MAP else "jpg"
+
+
+class RefAssetCache:
+    """参考图的落盘去重 + data URL 缓存"""
+
+    def __init__(self, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._size = 0
+        self._locks: dict[str, asyncio.Lock] = {}
+        self._hits = 0
+        self._misses = 0
+        self._dedup_uploads = 0
+
+    async def save_upload(self, upload: UploadFile) -> str:
+        """流式保存上传文件，返回按内容寻址的路径"""
+        os.makedirs(REF_DIR, exist_ok=True)
+        tmp_path = os.path.join(REF_DIR, f".{uuid.uuid4().hex}.tmp")
+        digest = hashlib.sha256()
+        try:
+            async with aiofiles.open(tmp_path, "wb") as f:
+                while True:
+                    chunk = await upload.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    await f.write(chunk)
+            path = os.path.join(REF_DIR, f"{digest.hexdigest()}.{_ext_of(upload.filename or '')}")
+            if os.path.exists(path):
+                self._dedup_uploads += 1
+                os.remove(tmp_path)
+            else:
+                os.replace(tmp_path, path)
+            return path
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    async def data_url(self, path: Optional[str]) -> Optional[str]:
+        """参考图的 data URL；文件不存在返回 None"""
+        if not path:
+            return None
+        cached = self._get(path)
+        if cached is not None:
+            return cached
+        lock = self._locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            # 同一张图的并发请求只编码一次
+            cached = self._get(path)
+            if cached is not None:
+                return cached
+            if not os.path.exists(path):
+                self._locks.pop(path, None)
+                return None
+            self._misses += 1
+            mime_type = MIME_MAP.get(path.rsplit(".", 1)[-1].lower(), "image/png")
+            parts = [f"data:{mime_type};base64,"]
+            async with aiofiles.open(path, "rb") as f:
+                while True:
+                    chunk = await f.read(READ_CHUNK)
+                    if not chunk:
+                        break
+                    parts.append(base64.b64encode(chunk).decode("ascii"))
+            value = "".join(parts)
+            self._put(path, value)
+        self._locks.pop(path, None)
+        return value
+
+    def _get(self, path: str) -> Optional[str]:
+        value = self._cache.get(path)
+        if value is not None:
+            self._cache.move_to_end(path)
+            self._hits += 1
+        return value
+
+    def _put(self, path: str, value: str):
+        if len(value) > self.max_bytes:
+            return
+        self._cache[path] = value
+        self._size += len(value)
+        while self._size > self.max_bytes:
+            _, evicted = self._cache.popitem(last=False)
+            self._size -= len(evicted)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cache),
+            "bytes": self._size,
+            "max_bytes": self.max_bytes,
+            "hits": self._hits,
+            "misses": self._misses,
+            "dedup_uploads": self._dedup_uploads,
+        }
+
+
+# 全局单例
+ref_asset_cache = RefAssetCache()
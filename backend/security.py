@@ -10,9 +10,10 @@ import base64
 import json
 from typing import Dict, Optional
 from datetime import datetime, timedelta
-from collections import defaultdict
 from threading import Lock
 
+from backend.shared_state import shared_state
+
 # ============ 配置 ============
 import os
 # 多层密钥（从环境变量读取，提供安全默认值）
@@ -20,18 +21,34 @@ SECRET_LAYER_1 = os.getenv("SECRET_LAYER_1", "dadi_ai_L1_x7k9m2p5")
 SECRET_LAYER_2 = os.getenv("SECRET_LAYER_2", "cipher_L2_q3w8e1r6")
 SECRET_LAYER_3 = os.getenv("SECRET_LAYER_3", "verify_L3_t4y0u9i2")
 CAPTCHA_EXPIRE_SECONDS = 300
+# 验证码签发上限：每个 IP、以及全站在一个有效期内最多签发的数量。
+# 验证码存活时间固定为 CAPTCHA_EXPIRE_SECONDS，限住签发速率即限住了存量，被刷接口时内存保持平稳
+CAPTCHA_PER_IP_LIMIT = int(os.getenv("CAPTCHA_PER_IP_LIMIT", "30"))
+CAPTCHA_MAX_ACTIVE = int(os.getenv("CAPTCHA_MAX_ACTIVE", "20000"))
+CAPTCHA_PRUNE_INTERVAL = 60  # 签发时顺带清理过期状态的最小间隔（秒）
 RATE_LIMIT_REQUESTS = 100  # 每分钟最大请求数（调高避免正常使用被限制）
 RATE_LIMIT_WINDOW = 60
+
+# 按路由前缀的限流规则：前缀 -> (窗口内最大请求数, 窗口秒数)，最长前缀匹配
+# 可通过环境变量 RATE_LIMIT_RULES 覆盖/追加，如 {"/api/login": [20, 60]}
+RATE_LIMIT_RULES: Dict[str, tuple] = {
+    "/api/login": (RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW),
+    "/api/register": (RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW),
+    "/api/admin/login": (RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW),
+}
+try:
+    RATE_LIMIT_RULES.update({
+        prefix: (int(rule[0]), int(rule[1]))
+        for prefix, rule in json.loads(os.getenv("RATE_LIMIT_RULES", "{}")).items()
+    })
+except (ValueError, TypeError, IndexError) as _e:
+    print(f"[SECURITY] RATE_LIMIT_RULES 配置无效，已忽略: {_e}")
 BAN_THRESHOLD = 10
 BAN_DURATION_MINUTES = 30
 
 
-# ============ 内存存储 ============
-_lock = Lock()
-_captcha_store: Dict[str, dict] = {}
-_rate_limit_store: Dict[str, list] = defaultdict(list)
-_fail_count_store: Dict[str, dict] = defaultdict(lambda: {"count": 0, "last_fail": None})
-_banned_ips: Dict[str, datetime] = {}
+# ============ 短期状态存储 ============
+# 验证码、限流计数、封禁状态都放在 shared_state：默认进程内存，多 worker 部署时切换为 sqlite/redis 共享
 
 
 # ============ 加密工具函数 ============
@@ -98,6 +115,28 @@ def _deobfuscate_number(obfuscated: str, salt: str, original_range: tuple = (0,
 
 # ============ 验证码生成与验证（增强版）============
 
+_capacity_warned_at = 0.0
+
+
+def check_captcha_quota(ip: str) -> bool:
+    """
+    签发验证码前检查配额：单 IP 与全站存量都未超限才放行（被拒绝的请求不计数）
+    先占单 IP 名额再占全站名额，全站拒绝时归还单 IP 名额；同一 IP 的并发请求不会在单 IP 被拒后仍消耗全站容量
+    """
+    global _capacity_warned_at
+    now = time.time()
+    ip_key = f"captcha-issued:{ip}"
+    if not shared_state.hit_window(ip_key, CAPTCHA_PER_IP_LIMIT, CAPTCHA_EXPIRE_SECONDS, now):
+        return False
+    if not shared_state.hit_window("captcha-issued:*", CAPTCHA_MAX_ACTIVE, CAPTCHA_EXPIRE_SECONDS, now):
+        shared_state.unhit_window(ip_key, CAPTCHA_EXPIRE_SECONDS, now)
+        if now - _capacity_warned_at >= CAPTCHA_PRUNE_INTERVAL:
+            _capacity_warned_at = now
+            print(f"[CAPTCHA] 全站验证码存量已达上限 {CAPTCHA_MAX_ACTIVE}，暂停签发")
+        return False
+    return True
+
+
 def generate_captcha_challenge() -> dict:
     """
     生成验证码挑战（多层加密）
@@ -126,17 +165,14 @@ def generate_captcha_challenge() -> dict:
     # ===== 生成 proof（验证链）=====
     proof = _hash_combine(challenge, puzzle, cipher, nonce, timestamp)[:32]
     
-    # 存储用于验证
-    expires = datetime.now() + timedelta(seconds=CAPTCHA_EXPIRE_SECONDS)
-    with _lock:
-        _captcha_store[token] = {
-            "target": target,
-            "timestamp": timestamp,
-            "nonce": nonce,
-            "expires": expires,
-            "proof": proof
-        }
-        _cleanup_expired_captchas()
+    # 存储用于验证（TTL 到期自动失效）
+    shared_state.set_json(f"captcha:{token}", {
+        "target": target,
+        "timestamp": timestamp,
+        "nonce": nonce,
+        "proof": proof
+    }, CAPTCHA_EXPIRE_SECONDS)
+    _maybe_cleanup()
     
     return {
         "challenge": challenge,
@@ -170,47 +206,41 @@ def verify_captcha(challenge: str, puzzle: str, cipher: str, nonce: str,
             print(f"[CAPTCHA] 验证失败：token 或 timestamp 为空")
             return False
         
-        with _lock:
-            # 检查 token 是否存在
-            if token not in _captcha_store:
-                print(f"[CAPTCHA] 验证失败：token 不存在（可能已被使用或过期）")
-                return False
-            
-            stored = _captcha_store[token]
-            
-            # 检查是否过期
-            if datetime.now() > stored["expires"]:
-                del _captcha_store[token]
-                print(f"[CAPTCHA] 验证失败：token 已过期")
-                return False
-            
-            # ===== 第2步：验证 proof =====
-            expected_proof = _hash_combine(challenge, puzzle, cipher, nonce, timestamp)[:32]
-            if proof != expected_proof:
-                print(f"[CAPTCHA] 验证失败：proof 不匹配")
-                return False
-            
-            # ===== 第3步：验证 nonce =====
-            if nonce != stored["nonce"]:
-                print(f"[CAPTCHA] 验证失败：nonce 不匹配")
-                return False
-            
-            # ===== 第4步：验证 cipher 签名 =====
-            sig_data = f"{token}:{stored['target']}:{timestamp}:{nonce}"
-            expected_cipher = _hmac_sign(sig_data, SECRET_LAYER_3)
-            if cipher != expected_cipher:
-                print(f"[CAPTCHA] 验证失败：cipher 签名不匹配")
-                return False
-            
-            # ===== 第5步：验证位置 =====
-            if abs(position - stored["target"]) > 8:
-                print(f"[CAPTCHA] 验证失败：位置不匹配 (position={position}, target={stored['target']})")
-                return False
-            
-            # 验证成功，删除 token
-            del _captcha_store[token]
-            print(f"[CAPTCHA] 验证成功！")
-            return True
+        stored = shared_state.get_json(f"captcha:{token}")
+        # 检查 token 是否存在（过期的由 TTL 自动删除）
+        if stored is None:
+            print(f"[CAPTCHA] 验证失败：token 不存在（可能已被使用或过期）")
+            return False
+        
+        # ===== 第2步：验证 proof =====
+        expected_proof = _hash_combine(challenge, puzzle, cipher, nonce, timestamp)[:32]
+        if proof != expected_proof:
+            print(f"[CAPTCHA] 验证失败：proof 不匹配")
+            return False
+        
+        # ===== 第3步：验证 nonce =====
+        if nonce != stored["nonce"]:
+            print(f"[CAPTCHA] 验证失败：nonce 不匹配")
+            return False
+        
+        # ===== 第4步：验证 cipher 签名 =====
+        sig_data = f"{token}:{stored['target']}:{timestamp}:{nonce}"
+        expected_cipher = _hmac_sign(sig_data, SECRET_LAYER_3)
+        if cipher != expected_cipher:
+            print(f"[CAPTCHA] 验证失败：cipher 签名不匹配")
+            return False
+        
+        # ===== 第5步：验证位置 =====
+        if abs(position - stored["target"]) > 8:
+            print(f"[CAPTCHA] 验证失败：位置不匹配 (position={position}, target={stored['target']})")
+            return False
+        
+        # 验证成功，删除 token（原子删除，多个 worker 并发验证同一 token 时只有一个成功）
+        if shared_state.pop(f"captcha:{token}") is None:
+            print(f"[CAPTCHA] 验证失败：token 已被使用")
+            return False
+        print(f"[CAPTCHA] 验证成功！")
+        return True
             
     except Exception as e:
         print(f"[CAPTCHA] 验证异常: {e}")
@@ -218,153 +248,290 @@ def verify_captcha(challenge: str, puzzle: str, cipher: str, nonce: str,
 
 
 def _cleanup_expired_captchas():
-    """清理过期的验证码（内存管理）"""
-    now = datetime.now()
-    expired_keys = []
-    for token, data in _captcha_store.items():
-        if now > data["expires"]:
-            expired_keys.append(token)
-    
-    for key in expired_keys:
-        _captcha_store.pop(key, None)
-    
-    # 定期清理所有内存存储
-    _cleanup_all_expired_data()
+    """清理过期的验证码、限流计数等短期状态（内存管理）"""
+    shared_state.prune()
 
 
-def _cleanup_all_expired_data():
-    """清理所有过期的内存数据"""
-    now = datetime.now()
-    
-    # 清理限流记录（保留1小时内的记录）
-    cutoff_time = now - timedelta(hours=1)
-    for ip in list(_rate_limit_store.keys()):
-        timestamps = _rate_limit_store[ip]
-        # 只保留1小时内的时间戳
-        _rate_limit_store[ip] = [ts for ts in timestamps if ts > cutoff_time.timestamp()]
-        # 如果没有有效记录，删除该IP
-        if not _rate_limit_store[ip]:
-            _rate_limit_store.pop(ip, None)
-    
-    # 清理失败计数记录（保留24小时内的记录）
-    cutoff_time = now - timedelta(hours=24)
-    for ip in list(_fail_count_store.keys()):
-        fail_data = _fail_count_store[ip]
-        if fail_data["last_fail"] and fail_data["last_fail"] < cutoff_time:
-            _fail_count_store.pop(ip, None)
+_last_cleanup = 0.0
+
+
+def _maybe_cleanup():
+    """签发路径上按间隔触发清理，不随每次请求执行"""
+    global _last_cleanup
+    now = time.time()
+    if now - _last_cleanup >= CAPTCHA_PRUNE_INTERVAL:
+        _last_cleanup = now
+        _cleanup_expired_captchas()
 
 
 def cleanup_memory_periodically():
     """定期清理内存，防止内存泄漏（建议定时任务调用）"""
-    with _lock:
-        _cleanup_expired_captchas()
-        print(f"[SECURITY] Memory cleanup completed. "
-              f"Captcha: {len(_captcha_store)}, "
-              f"RateLimit: {len(_rate_limit_store)}, "
-              f"FailCount: {len(_fail_count_store)}")
+    _cleanup_expired_captchas()
+    print(f"[SECURITY] Memory cleanup completed. {shared_state.stats()}")
 
 
-# ============ Rate Limiting （仍使用内存，短期数据）============
+# ============ Rate Limiting ============
 
-def check_rate_limit(ip: str) -> bool:
-    now = time.time()
-    window_start = now - RATE_LIMIT_WINDOW
-    
-    with _lock:
-        _rate_limit_store[ip] = [t for t in _rate_limit_store[ip] if t > window_start]
-        if len(_rate_limit_store[ip]) >= RATE_LIMIT_REQUESTS:
-            return False
-        _rate_limit_store[ip].append(now)
-        return True
+def match_rate_limit_rule(path: str) -> Optional[str]:
+    """返回匹配 path 的最长规则前缀，没有规则时返回 None"""
+    matched = None
+    for prefix in RATE_LIMIT_RULES:
+        if path.startswith(prefix) and (matched is None or len(prefix) > len(matched)):
+            matched = prefix
+    return matched
 
 
-def get_rate_limit_remaining(ip: str) -> int:
-    now = time.time()
-    window_start = now - RATE_LIMIT_WINDOW
-    with _lock:
-        valid_requests = [t for t in _rate_limit_store[ip] if t > window_start]
-        return max(0, RATE_LIMIT_REQUESTS - len(valid_requests))
+def check_rate_limit(ip: str, route: Optional[str] = None) -> bool:
+    """按 (路由规则, IP) 计数；route 为 None 或无对应规则时使用全局默认限额"""
+    limit, window = RATE_LIMIT_RULES.get(route, (RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW))
+    return shared_state.hit_window(f"rl:{route or '*'}|{ip}", limit, window)
+
+
+def get_rate_limit_remaining(ip: str, route: Optional[str] = None) -> int:
+    limit, window = RATE_LIMIT_RULES.get(route, (RATE_LIMIT_REQUESTS, RATE_LIMIT_WINDOW))
+    return shared_state.window_remaining(f"rl:{route or '*'}|{ip}", limit, window)
 
 
-# ============ IP 封禁（数据库持久化）============
+# ============ IP 封禁（数据库持久化 + 内存缓存）============
+
+import asyncio
+import logging
 
 from sqlmodel import Session, select
 from backend.models import engine, IPBan, LoginFailure
 
+logger = logging.getLogger(__name__)
+
+BAN_FLUSH_INTERVAL = 1.0       # 写回数据库的间隔（秒）
+FAIL_MEMORY_HOURS = 24         # 失败计数在共享状态中保留的时长
+BAN_EXPIRED_GRACE = 3600       # 封禁到期后记录再保留的时长，用于到期时清零失败计数
+
+
+class IPStateCache:
+    """
+    IPBan / LoginFailure 的写回缓存
+    启动时从数据库加载到 shared_state（ban:{ip} / fail:{ip}），之后读全部走 shared_state；
+    写操作先改 shared_state，再按 IP 合并后由本进程批量写回数据库。
+    一个 IP 的暴力尝试无论多密集，每个刷新周期最多产生一次写入。
+    """
+
+    def __init__(self, flush_interval: float = BAN_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = Lock()
+        self._dirty_fails: set = set()
+        self._dirty_bans: set = set()
+        self._task = None
+        self._loaded = False
+        self._writes = 0
+
+    # ---- 共享状态读写 ----
+
+    @staticmethod
+    def _set_ban(ip: str, expires_at: datetime, reason: str, only_if_absent: bool = False) -> bool:
+        ttl = (expires_at - datetime.now()).total_seconds() + BAN_EXPIRED_GRACE
+        value = json.dumps([expires_at.timestamp(), reason], ensure_ascii=False)
+        if only_if_absent:
+            return shared_state.set_if_absent(f"ban:{ip}", value, ttl)
+        shared_state.set(f"ban:{ip}", value, ttl)
+        return True
+
+    @staticmethod
+    def _get_ban(ip: str) -> Optional[tuple]:
+        entry = shared_state.get_json(f"ban:{ip}")
+        return (datetime.fromtimestamp(entry[0]), entry[1]) if entry else None
+
+    def _mark(self, fail_ip: Optional[str] = None, ban_ip: Optional[str] = None):
+        with self._lock:
+            if fail_ip:
+                self._dirty_fails.add(fail_ip)
+            if ban_ip:
+                self._dirty_bans.add(ban_ip)
+        self._write_through_if_idle()
+
+    # ---- 加载 ----
+
+    def load(self):
+        """从数据库加载未过期的封禁和近期失败计数（已在共享状态中的以共享状态为准，不覆盖其他 worker 的新值）"""
+        self.flush()
+        now = datetime.now()
+        cutoff = now - timedelta(hours=FAIL_MEMORY_HOURS)
+        with Session(engine) as session:
+            bans = session.exec(select(IPBan).where(IPBan.expires_at > now)).all()
+            fails = session.exec(
+                select(LoginFailure).where(LoginFailure.fail_count > 0, LoginFailure.last_fail_at > cutoff)
+            ).all()
+        for b in bans:
+            self._set_ban(b.ip, b.expires_at, b.reason, only_if_absent=True)
+        for f in fails:
+            shared_state.set_if_absent(f"fail:{f.ip}", str(f.fail_count), FAIL_MEMORY_HOURS * 3600)
+        self._loaded = True
+        logger.info(f"[security] 已加载封禁 {len(bans)} 个, 失败计数 {len(fails)} 个")
+
+    def reload_ip(self, ip: str):
+        """管理员直接修改数据库后，重新读取该 IP 的状态（以数据库为准，丢弃该 IP 未写回的变化）"""
+        with self._lock:
+            self._dirty_fails.discard(ip)
+            self._dirty_bans.discard(ip)
+        with Session(engine) as session:
+            ban = session.exec(select(IPBan).where(IPBan.ip == ip)).first()
+            failure = session.exec(select(LoginFailure).where(LoginFailure.ip == ip)).first()
+        if ban and ban.expires_at > datetime.now():
+            self._set_ban(ip, ban.expires_at, ban.reason)
+        else:
+            shared_state.delete(f"ban:{ip}")
+        if failure and failure.fail_count > 0:
+            shared_state.set(f"fail:{ip}", str(failure.fail_count), FAIL_MEMORY_HOURS * 3600)
+        else:
+            shared_state.delete(f"fail:{ip}")
+
+    def _ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+
+    # ---- 读 ----
+
+    def ban_expires_at(self, ip: str) -> Optional[datetime]:
+        """未封禁或封禁已过期返回 None；过期时顺带解除封禁并清零失败计数"""
+        self._ensure_loaded()
+        entry = self._get_ban(ip)
+        if entry is None:
+            return None
+        if datetime.now() < entry[0]:
+            return entry[0]
+        shared_state.delete(f"ban:{ip}")
+        shared_state.delete(f"fail:{ip}")
+        self._mark(fail_ip=ip, ban_ip=ip)
+        return None
+
+    def fail_count(self, ip: str) -> int:
+        self._ensure_loaded()
+        return int(shared_state.get(f"fail:{ip}") or 0)
+
+    # ---- 写 ----
+
+    def record_fail(self, ip: str) -> bool:
+        """失败计数 +1，达到阈值时封禁，返回是否达到封禁阈值"""
+        self._ensure_loaded()
+        count = shared_state.incr(f"fail:{ip}", 1, ttl=FAIL_MEMORY_HOURS * 3600)
+        reached = count >= BAN_THRESHOLD
+        banned = reached and self._set_ban(
+            ip, datetime.now() + timedelta(minutes=BAN_DURATION_MINUTES), "登录失败次数过多", only_if_absent=True
+        )
+        self._mark(fail_ip=ip, ban_ip=ip if banned else None)
+        return reached
+
+    def reset_fails(self, ip: str):
+        self._ensure_loaded()
+        if shared_state.get(f"fail:{ip}") is None:
+            return
+        shared_state.delete(f"fail:{ip}")
+        self._mark(fail_ip=ip)
+
+    # ---- 写回 ----
+
+    def _write_through_if_idle(self):
+        if self._task is None:
+            # 未启动后台刷新（如脚本/测试环境）时直接写穿
+            self.flush()
+
+    def flush(self) -> int:
+        """把本进程改动过的 IP 按共享状态中的当前值写回数据库，返回写入的 IP 数"""
+        with self._lock:
+            fail_ips, self._dirty_fails = self._dirty_fails, set()
+            ban_ips, self._dirty_bans = self._dirty_bans, set()
+        if not fail_ips and not ban_ips:
+            return 0
+        now = datetime.now()
+        try:
+            fails = {ip: shared_state.get(f"fail:{ip}") for ip in fail_ips}
+            bans = {ip: self._get_ban(ip) for ip in ban_ips}
+            with Session(engine) as session:
+                for ip, count in fails.items():
+                    failure = session.exec(select(LoginFailure).where(LoginFailure.ip == ip)).first()
+                    if count is None:
+                        if failure:
+                            failure.fail_count = 0
+                            failure.last_fail_at = None
+                            session.add(failure)
+                    elif failure:
+                        failure.fail_count = int(count)
+                        failure.last_fail_at = now
+                        session.add(failure)
+                    else:
+                        session.add(LoginFailure(ip=ip, fail_count=int(count), last_fail_at=now))
+                for ip, entry in bans.items():
+                    ban = session.exec(select(IPBan).where(IPBan.ip == ip)).first()
+                    if entry is None:
+                        if ban:
+                            session.delete(ban)
+                    elif ban:
+                        ban.expires_at, ban.reason = entry
+                        session.add(ban)
+                    else:
+                        session.add(IPBan(ip=ip, expires_at=entry[0], reason=entry[1]))
+                session.commit()
+        except Exception as e:
+            logger.error(f"[security] 封禁状态写回失败: {e}")
+            with self._lock:
+                self._dirty_fails |= fail_ips
+                self._dirty_bans |= ban_ips
+            return 0
+        self._writes += len(fails) + len(bans)
+        return len(fails) + len(bans)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await asyncio.to_thread(self.flush)
+
+    def start(self):
+        self._ensure_loaded()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await asyncio.to_thread(self.flush)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": shared_state.name,
+                "pending_writes": len(self._dirty_fails) + len(self._dirty_bans),
+                "rows_written": self._writes,
+            }
+
+
+# 全局单例
+ip_state = IPStateCache()
+
 
 def is_ip_banned(ip: str) -> bool:
     """检查 IP 是否被封禁"""
-    with Session(engine) as session:
-        ban = session.exec(select(IPBan).where(IPBan.ip == ip)).first()
-        if ban:
-            if datetime.now() < ban.expires_at:
-                return True
-            else:
-                # 封禁已过期，删除记录并重置失败计数
-                session.delete(ban)
-                failure = session.exec(select(LoginFailure).where(LoginFailure.ip == ip)).first()
-                if failure:
-                    failure.fail_count = 0
-                    failure.last_fail_at = None
-                    session.add(failure)
-                session.commit()
-        return False
+    return ip_state.ban_expires_at(ip) is not None
 
 
 def record_fail(ip: str) -> bool:
     """记录登录失败，返回是否达到封禁阈值"""
-    with Session(engine) as session:
-        failure = session.exec(select(LoginFailure).where(LoginFailure.ip == ip)).first()
-        
-        if not failure:
-            failure = LoginFailure(ip=ip, fail_count=1, last_fail_at=datetime.now())
-            session.add(failure)
-        else:
-            failure.fail_count += 1
-            failure.last_fail_at = datetime.now()
-            session.add(failure)
-        
-        # 检查是否达到封禁阈值
-        if failure.fail_count >= BAN_THRESHOLD:
-            # 创建封禁记录
-            existing_ban = session.exec(select(IPBan).where(IPBan.ip == ip)).first()
-            if not existing_ban:
-                ban = IPBan(
-                    ip=ip,
-                    expires_at=datetime.now() + timedelta(minutes=BAN_DURATION_MINUTES)
-                )
-                session.add(ban)
-            session.commit()
-            return True
-        
-        session.commit()
-        return False
+    return ip_state.record_fail(ip)
 
 
 def record_success(ip: str):
     """登录成功，清除失败计数"""
-    with Session(engine) as session:
-        failure = session.exec(select(LoginFailure).where(LoginFailure.ip == ip)).first()
-        if failure:
-            failure.fail_count = 0
-            failure.last_fail_at = None
-            session.add(failure)
-            session.commit()
+    ip_state.reset_fails(ip)
 
 
 def get_fail_count(ip: str) -> int:
     """获取登录失败次数"""
-    with Session(engine) as session:
-        failure = session.exec(select(LoginFailure).where(LoginFailure.ip == ip)).first()
-        return failure.fail_count if failure else 0
+    return ip_state.fail_count(ip)
 
 
 def get_ban_remaining_seconds(ip: str) -> int:
     """获取封禁剩余时间（秒）"""
-    with Session(engine) as session:
-        ban = session.exec(select(IPBan).where(IPBan.ip == ip)).first()
-        if ban:
-            remaining = (ban.expires_at - datetime.now()).total_seconds()
-            return max(0, int(remaining))
+    expires_at = ip_state.ban_expires_at(ip)
+    if expires_at is None:
         return 0
-
+    return max(0, int((expires_at - datetime.now()).total_seconds()))
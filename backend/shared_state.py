@@ -0,0 +1,516 @@
+"""
+跨进程共享状态
+限流计数、IP 封禁、验证码、支付锁、上游配额等短期状态原先都放在进程内存里，
+uvicorn --workers N 时每个进程各算各的（限额被放大 N 倍）。这里提供统一的键值接口，后端可选：
+
+  local  : 进程内存（默认，单进程部署）
+  sqlite : 独立的 SQLite 文件（WAL），同机多 worker 共享
+  redis  : Redis（需安装 redis 包，多机部署）
+
+通过环境变量 SHARED_STATE_BACKEND 选择；redis 不可用时退回 local 并记录错误。
+"""
+import heapq
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+BACKEND = os.getenv("SHARED_STATE_BACKEND", "local").lower()
+SQLITE_PATH = os.getenv(
+    "SHARED_STATE_SQLITE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "shared_state.db"),
+)
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+LOCAL_MAX_KEYS = int(os.getenv("SHARED_STATE_MAX_KEYS", "200000"))
+# 安全状态（IP 封禁 / 失败计数）不参与 LRU 淘汰：大量 IP 刷验证码、限流 key 时不能把生效中的封禁挤掉
+LOCAL_PINNED_PREFIXES = ("ban:", "fail:")
+LOCK_POLL_INTERVAL = 0.05
+
+
+class SharedStateBackend:
+    """
+    键值接口：值为字符串，ttl 为秒
+    子类实现 get/set/delete/pop/set_if_absent/delete_if/incr，滑动窗口计数和锁基于这些原语
+    """
+
+    name = "base"
+    shared = False   # 是否跨进程共享
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: str, ttl: float):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def pop(self, key: str) -> Optional[str]:
+        """原子地读取并删除（一次性令牌）"""
+        raise NotImplementedError
+
+    def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        raise NotImplementedError
+
+    def delete_if(self, key: str, value: str) -> bool:
+        """值等于 value 时才删除（释放自己持有的锁）"""
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """原子加减；key 不存在时从 0 开始并设置 ttl"""
+        raise NotImplementedError
+
+    # ---- 组合操作 ----
+
+    def get_json(self, key: str):
+        value = self.get(key)
+        return json.loads(value) if value is not None else None
+
+    def set_json(self, key: str, value, ttl: float):
+        self.set(key, json.dumps(value, ensure_ascii=False), ttl)
+
+    def hit_window(self, key: str, limit: int, window: int, now: Optional[float] = None) -> bool:
+        """
+        滑动窗口计数（两个固定桶加权近似）：先原子 +1 再判断，超限时撤销，
+        并发的多个进程各自拿到不同的计数值，不会同时越过上限
+        """
+        now = now or time.time()
+        bucket = int(now // window)
+        prev = int(self.get(f"{key}:{bucket - 1}") or 0)
+        count = self.incr(f"{key}:{bucket}", 1, ttl=window * 2)
+        if prev * (1 - (now - bucket * window) / window) + count > limit:
+            self.incr(f"{key}:{bucket}", -1)
+            return False
+        return True
+
+    def unhit_window(self, key: str, window: int, now: float):
+        """撤销一次在 now 时刻成功的 hit_window（多个窗口需同时占名额、后面的窗口拒绝时归还前面的）"""
+        self.incr(f"{key}:{int(now // window)}", -1)
+
+    def window_remaining(self, key: str, limit: int, window: int) -> int:
+        now = time.time()
+        bucket = int(now // window)
+        prev = int(self.get(f"{key}:{bucket - 1}") or 0)
+        count = int(self.get(f"{key}:{bucket}") or 0)
+        return max(0, int(limit - prev * (1 - (now - bucket * window) / window) - count))
+
+    def acquire_lock(self, name: str, ttl: float = 30, timeout: float = 10) -> Optional[str]:
+        """跨进程互斥锁；拿到返回持有令牌，超时返回 None。ttl 防止持有进程崩溃后永久占用"""
+        token = uuid.uuid4().hex
+        key = f"lock:{name}"
+        deadline = time.monotonic() + timeout
+        while not self.set_if_absent(key, token, ttl):
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(LOCK_POLL_INTERVAL)
+        return token
+
+    def release_lock(self, name: str, token: str):
+        self.delete_if(f"lock:{name}", token)
+
+    @contextmanager
+    def lock(self, name: str, ttl: float = 30, timeout: float = 10):
+        """acquire_lock 的上下文管理器形式；超时未拿到时 yield False"""
+        token = self.acquire_lock(name, ttl, timeout)
+        try:
+            yield token is not None
+        finally:
+            if token is not None:
+                self.release_lock(name, token)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "shared": self.shared}
+
+
+# ============ 进程内存 ============
+
+class SlidingWindowCounter:
+    """
+    滑动窗口计数器（固定桶加权近似）
+    每个 key 只保存 [当前桶序号, 当前桶计数, 上一桶计数]，
+    估算值 = 上一桶计数 × 上一桶仍落在窗口内的比例 + 当前桶计数，检查为 O(1)。
+    key 数量按 LRU 封顶，大量 IP 扫描时内存不会无限增长。
+    """
+
+    def __init__(self, max_keys: int = LOCAL_MAX_KEYS):
+        self.max_keys = max_keys
+        self._store: "OrderedDict[str, list]" = OrderedDict()
+        self._windows: dict[str, int] = {}
+
+    def __len__(self):
+        return len(self._store)
+
+    def _entry(self, key: str, window: int, now: float) -> tuple:
+        bucket = int(now // window)
+        entry = self._store.get(key)
+        if entry is None:
+            entry = [bucket, 0, 0]
+            self._store[key] = entry
+            self._windows[key] = window
+            if len(self._store) > self.max_keys:
+                evicted, _ = self._store.popitem(last=False)
+                self._windows.pop(evicted, None)
+        else:
+            self._store.move_to_end(key)
+            if entry[0] != bucket:
+                entry[2] = entry[1] if bucket - entry[0] == 1 else 0
+                entry[1] = 0
+                entry[0] = bucket
+        elapsed_ratio = (now - bucket * window) / window
+        return entry, entry[2] * (1 - elapsed_ratio) + entry[1]
+
+    def hit(self, key: str, limit: int, window: int, now: Optional[float] = None) -> bool:
+        """计一次请求；超过上限返回 False（被拒绝的请求不计数）"""
+        entry, count = self._entry(key, window, now or time.time())
+        if count >= limit:
+            return False
+        entry[1] += 1
+        return True
+
+    def unhit(self, key: str, window: int, now: float):
+        entry = self._store.get(key)
+        if entry is not None and entry[0] == int(now // window) and entry[1] > 0:
+            entry[1] -= 1
+
+    def remaining(self, key: str, limit: int, window: int) -> int:
+        if key not in self._store:
+            return limit
+        _, count = self._entry(key, window, time.time())
+        return max(0, int(limit - count))
+
+    def prune(self):
+        """删除已完整滑出窗口（计数必为 0）的 key"""
+        now = time.time()
+        for key in list(self._store):
+            window = self._windows.get(key, 60)
+            if int(now // window) - self._store[key][0] >= 2:
+                del self._store[key]
+                self._windows.pop(key, None)
+
+
+class LocalBackend(SharedStateBackend):
+    """
+    进程内存实现：普通 key 数量按 LRU 封顶，LOCAL_PINNED_PREFIXES 开头的 key 单独存放、只随 TTL 过期
+    带 TTL 的 key 同时记入按过期时间排序的最小堆，每次写入顺带弹出已到期的堆顶，
+    清理代价只与过期 key 数量成正比，不再整表扫描。
+    """
+
+    name = "local"
+
+    def __init__(self, max_keys: int = LOCAL_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()   # key -> (value, expires_at)
+        self._pinned: dict[str, tuple] = {}                      # 不淘汰的安全状态 key
+        self._expiry: list[tuple[float, str]] = []               # (expires_at, key) 最小堆
+        self._windows = SlidingWindowCounter(max_keys)
+
+    def _table(self, key: str) -> dict:
+        return self._pinned if key.startswith(LOCAL_PINNED_PREFIXES) else self._data
+
+    def _live(self, key: str):
+        table = self._table(key)
+        entry = table.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.time():
+            del table[key]
+            return None
+        if table is self._data:
+            self._data.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, value, ttl: Optional[float]):
+        now = time.time()
+        self._expire(now)
+        expires_at = now + ttl if ttl else None
+        table = self._table(key)
+        table[key] = (value, expires_at)
+        if expires_at is not None:
+            heapq.heappush(self._expiry, (expires_at, key))
+        if table is self._data:
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_keys:
+                self._data.popitem(last=False)
+
+    def _expire(self, now: float):
+        """弹出所有已到期的堆顶；key 已被覆盖/删除的堆项（过期时间对不上）直接丢弃"""
+        heap = self._expiry
+        while heap and heap[0][0] <= now:
+            expires_at, key = heapq.heappop(heap)
+            table = self._table(key)
+            entry = table.get(key)
+            if entry is not None and entry[1] == expires_at:
+                del table[key]
+        # 被覆盖、删除或 LRU 淘汰的 key 会在堆里留下失效项，积累过多时按现存数据重建
+        live = len(self._data) + len(self._pinned)
+        if len(heap) > 2 * live + 1024:
+            self._expiry = [
+                (entry[1], key)
+                for table in (self._data, self._pinned)
+                for key, entry in table.items()
+                if entry[1] is not None
+            ]
+            heapq.heapify(self._expiry)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key)
+            return None if entry is None else str(entry[0])
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._table(key).pop(key, None)
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                return None
+            del self._table(key)[key]
+            return str(entry[0])
+
+    def set_if_absent(self, key, value, ttl):
+        with self._lock:
+            if self._live(key) is not None:
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete_if(self, key, value):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None or entry[0] != value:
+                return False
+            del self._table(key)[key]
+            return True
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            entry = self._live(key)
+            if entry is None:
+                value = amount
+                self._store(key, value, ttl)
+            else:
+                value = int(entry[0]) + amount
+                self._table(key)[key] = (value, entry[1])
+            return value
+
+    def hit_window(self, key, limit, window, now=None):
+        # 单进程时直接用 O(1) 的本地计数器，被拒绝的请求不计数
+        with self._lock:
+            return self._windows.hit(key, limit, window, now)
+
+    def unhit_window(self, key, window, now):
+        with self._lock:
+            self._windows.unhit(key, window, now)
+
+    def window_remaining(self, key, limit, window):
+        with self._lock:
+            return self._windows.remaining(key, limit, window)
+
+    def prune(self):
+        """清理过期 key（定期清理任务调用）"""
+        with self._lock:
+            self._expire(time.time())
+            self._windows.prune()
+
+    def stats(self):
+        with self._lock:
+            return {
+                **super().stats(),
+                "keys": len(self._data),
+                "pinned_keys": len(self._pinned),
+                "expiry_heap": len(self._expiry),
+                "window_keys": len(self._windows),
+            }
+
+
+# ============ SQLite（同机多进程） ============
+
+class SQLiteBackend(SharedStateBackend):
+    """独立 SQLite 文件 + WAL；读改写放在 BEGIN IMMEDIATE 事务内保证原子性"""
+
+    name = "sqlite"
+    shared = True
+    PURGE_EVERY = 1000   # 每 N 次写操作清理一次过期行
+
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS kv ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_kv_expires ON kv(expires_at)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _tx(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    @staticmethod
+    def _read(conn, key):
+        row = conn.execute("SELECT value, expires_at FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return row[0]
+
+    @staticmethod
+    def _expiry(ttl):
+        return time.time() + ttl if ttl else None
+
+    def get(self, key):
+        return self._read(self._conn(), key)
+
+    def set(self, key, value, ttl):
+        with self._tx() as conn:
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, str(value), self._expiry(ttl)))
+
+    def delete(self, key):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def pop(self, key):
+        with self._tx() as conn:
+            value = self._read(conn, key)
+            conn.execute("DELETE FROM kv WHERE key = ?", (key,))
+            return value
+
+    def set_if_absent(self, key, value, ttl):
+        with self._tx() as conn:
+            if self._read(conn, key) is not None:
+                return False
+            conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                         (key, str(value), self._expiry(ttl)))
+            return True
+
+    def delete_if(self, key, value):
+        with self._tx() as conn:
+            return conn.execute("DELETE FROM kv WHERE key = ? AND value = ?", (key, str(value))).rowcount > 0
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._tx() as conn:
+            current = self._read(conn, key)
+            if current is None:
+                value = amount
+                conn.execute("INSERT OR REPLACE INTO kv (key, value, expires_at) VALUES (?, ?, ?)",
+                             (key, str(value), self._expiry(ttl)))
+            else:
+                value = int(current) + amount
+                conn.execute("UPDATE kv SET value = ? WHERE key = ?", (str(value), key))
+            return value
+
+    def prune(self):
+        with self._tx() as conn:
+            conn.execute("DELETE FROM kv WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def stats(self):
+        count = self._conn().execute("SELECT COUNT(*) FROM kv").fetchone()[0]
+        return {**super().stats(), "path": self.path, "keys": count}
+
+
+# ============ Redis（多机） ============
+
+class RedisBackend(SharedStateBackend):
+    """Redis 实现；接口与 local 一致，可用任何 Redis 协议兼容的服务替换"""
+
+    name = "redis"
+    shared = True
+
+    _DELETE_IF = "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) else return 0 end"
+    _INCR = (
+        "local v = redis.call('incrby', KEYS[1], ARGV[1]) "
+        "if tonumber(ARGV[2]) > 0 and redis.call('pttl', KEYS[1]) < 0 then "
+        "redis.call('pexpire', KEYS[1], ARGV[2]) end return v"
+    )
+
+    def __init__(self, url: str = REDIS_URL):
+        import redis
+        self.url = url
+        self._redis = redis.Redis.from_url(url, decode_responses=True, socket_timeout=2)
+        self._redis.ping()
+        self._delete_if = self._redis.register_script(self._DELETE_IF)
+        self._incr = self._redis.register_script(self._INCR)
+
+    @staticmethod
+    def _ms(ttl):
+        return max(1, int(ttl * 1000)) if ttl else None
+
+    def get(self, key):
+        return self._redis.get(key)
+
+    def set(self, key, value, ttl):
+        self._redis.set(key, str(value), px=self._ms(ttl))
+
+    def delete(self, key):
+        self._redis.delete(key)
+
+    def pop(self, key):
+        return self._redis.getdel(key)
+
+    def set_if_absent(self, key, value, ttl):
+        return bool(self._redis.set(key, str(value), px=self._ms(ttl), nx=True))
+
+    def delete_if(self, key, value):
+        return bool(self._delete_if(keys=[key], args=[str(value)]))
+
+    def incr(self, key, amount=1, ttl=None):
+        return int(self._incr(keys=[key], args=[amount, self._ms(ttl) or 0]))
+
+    def prune(self):
+        pass   # 过期由 Redis 自己处理
+
+    def stats(self):
+        return {**super().stats(), "url": self.url.split("@")[-1]}
+
+
+def _create_backend() -> SharedStateBackend:
+    if BACKEND == "sqlite":
+        return SQLiteBackend()
+    if BACKEND == "redis":
+        try:
+            return RedisBackend()
+        except Exception as e:
+            logger.error(f"[shared-state] Redis 不可用，退回进程内存（多 worker 时限额不共享）: {e}")
+            return LocalBackend()
+    if BACKEND != "local":
+        logger.error(f"[shared-state] 未知的 SHARED_STATE_BACKEND={BACKEND}，使用进程内存")
+    return LocalBackend()
+
+
+# 全局单例
+shared_state = _create_backend()
@@ -3,136 +3,72 @@
 用于处理断电、崩溃等异常情况导致的订单状态异常
 """
 import asyncio
-from datetime import datetime, timedelta
+from sqlalchemy import func
 from sqlmodel import Session, select
 from backend.models import JimengOrder, engine
 from backend.admin_jimeng_account import _load_jimeng_accounts, _save_jimeng_accounts
 
 
 def fix_account_task_counts():
-    """修复账号任务计数（断电后可能不准确）"""
+    """修复账号任务计数（断电后可能不准确）：按各账号仍在进行中的订单重新计算"""
     print("[RECOVERY] 修复账号任务计数...")
 
     try:
+        with Session(engine) as session:
+            rows = session.exec(
+                select(JimengOrder.account_id, func.count(JimengOrder.id)).where(
+                    JimengOrder.status.in_(["processing", "generating"]),
+                    JimengOrder.account_id.is_not(None),
+                ).group_by(JimengOrder.account_id)
+            ).all()
+        in_flight = {account_id: count for account_id, count in rows}
+
         data = _load_jimeng_accounts()
 
-        # 重置所有账号的任务计数为 0
         for account in data.get("accounts", []):
             old_count = account.get("current_tasks", 0)
-            account["current_tasks"] = 0
-            if old_count > 0:
-                print(f"[RECOVERY] 账号 {account.get('display_name', account.get('account_id'))} 任务计数: {old_count} -> 0")
+            new_count = in_flight.get(account.get("account_id"), 0)
+            account["current_tasks"] = new_count
+            if old_count != new_count:
+                print(f"[RECOVERY] 账号 {account.get('display_name', account.get('account_id'))} 任务计数: {old_count} -> {new_count}")
 
         _save_jimeng_accounts(data)
-        print("[RECOVERY] ✓ 账号任务计数已重置")
+        print("[RECOVERY] ✓ 账号任务计数已修复")
         return True
     except Exception as e:
         print(f"[RECOVERY] ✗ 修复账号任务计数失败: {e}")
         return False
 
 
-def recover_stuck_orders():
-    """恢复卡住的订单"""
-    print("[RECOVERY] 检查卡住的订单...")
-
-    try:
-        with Session(engine) as session:
-            # 查找所有 processing 或 generating 状态的订单
-            stuck_orders = session.exec(
-                select(JimengOrder).where(
-                    JimengOrder.status.in_(["processing", "generating"])
-                )
-            ).all()
-
-            if not stuck_orders:
-                print("[RECOVERY] ✓ 没有卡住的订单")
-                return []
-
-            print(f"[RECOVERY] 找到 {len(stuck_orders)} 个卡住的订单")
-
-            recovered_order_ids = []
-
-            for order in stuck_orders:
-                # 检查订单创建时间，如果超过 30 分钟还在处理中，认为是异常
-                time_elapsed = datetime.utcnow() - order.created_at
-
-                if time_elapsed > timedelta(minutes=30):
-                    # 超时订单标记为失败并退款
-                    print(f"[RECOVERY] 订单 #{order.id} 超时（{time_elapsed}），标记为失败")
-                    order.status = "failed"
-                    order.error_message = "服务重启导致任务中断，已自动退款"
-
-                    # 退款（检查是否已退款）
-                    from backend.models import User, Transaction
-                    user = session.get(User, order.user_id)
-                    if user and order.cost > 0:
-                        user.balance += order.cost
-                        session.add(user)
-
-                        # 记录退款交易
-                        refund = Transaction(
-                            user_id=order.user_id,
-                            amount=order.cost,
-                            bonus=0,
-                            type="refund"
-                        )
-                        session.add(refund)
-                        print(f"[RECOVERY] 订单 #{order.id} 已退款 {order.cost} 元")
-                else:
-                    # 未超时的订单重置为 pending，稍后重新处理
-                    print(f"[RECOVERY] 订单 #{order.id} 重置为 pending 状态")
-                    order.status = "pending"
-                    order.progress = 0
-                    recovered_order_ids.append(order.id)
-
-                session.add(order)
-
-            session.commit()
-
-            print(f"[RECOVERY] ✓ 已处理 {len(stuck_orders)} 个卡住的订单")
-            print(f"[RECOVERY] - 重置为 pending: {len(recovered_order_ids)} 个")
-            print(f"[RECOVERY] - 标记为失败: {len(stuck_orders) - len(recovered_order_ids)} 个")
-
-            return recovered_order_ids
-
-    except Exception as e:
-        print(f"[RECOVERY] ✗ 恢复订单失败: {e}")
-        import traceback
-        traceback.print_exc()
-        return []
-
-
-async def resubmit_pending_orders():
-    """重新提交 pending 状态的订单"""
-    print("[RECOVERY] 重新提交待处理订单...")
+async def enqueue_unfinished_orders():
+    """
+    为未结束的即梦订单补入任务队列
+    已有未完成任务的订单会被去重；process_jimeng_order 可重入，已提交的订单只会继续等待结果，
+    超时的由 jimeng_poll 标记失败并退款，这里不修改订单状态
+    """
+    print("[RECOVERY] 检查未结束的即梦订单...")
 
     try:
         with Session(engine) as session:
-            pending_orders = session.exec(
-                select(JimengOrder).where(
-                    JimengOrder.status == "pending"
+            order_ids = session.exec(
+                select(JimengOrder.id).where(
+                    JimengOrder.status.in_(["pending", "processing", "generating"])
                 ).order_by(JimengOrder.created_at)
             ).all()
 
-            if not pending_orders:
-                print("[RECOVERY] ✓ 没有待处理订单")
-                return
+        if not order_ids:
+            print("[RECOVERY] ✓ 没有未结束的订单")
+            return
 
-            print(f"[RECOVERY] 找到 {len(pending_orders)} 个待处理订单")
+        from backend.job_queue import job_queue
 
-            # 导入后台处理函数
-            from backend.jimeng_background import process_jimeng_order
+        for order_id in order_ids:
+            await job_queue.enqueue("jimeng_process", order_id)
 
-            # 重新提交所有 pending 订单
-            for order in pending_orders:
-                print(f"[RECOVERY] 重新提交订单 #{order.id}")
-                asyncio.create_task(process_jimeng_order(order.id))
-                await asyncio.sleep(0.5)  # 避免同时提交太多
-
-            print(f"[RECOVERY] ✓ 已重新提交 {len(pending_orders)} 个订单")
+        print(f"[RECOVERY] ✓ {len(order_ids)} 个未结束订单已在任务队列中")
 
     except Exception as e:
-        print(f"[RECOVERY] ✗ 重新提交订单失败: {e}")
+        print(f"[RECOVERY] ✗ 补入任务队列失败: {e}")
         import traceback
         traceback.print_exc()
 
@@ -143,9 +79,13 @@ def check_database_integrity():
 
     try:
         import sqlite3
-        from backend.models import sqlite_file_name
+        from backend.models import engine, is_sqlite
+
+        if not is_sqlite:
+            print("[RECOVERY] 非 SQLite 数据库，跳过文件完整性检查")
+            return True
 
-        conn = sqlite3.connect(sqlite_file_name)
+        conn = sqlite3.connect(engine.url.database)
         cursor = conn.cursor()
 
         # 执行完整性检查
@@ -179,11 +119,17 @@ async def startup_recovery():
     # 2. 修复账号任务计数
     fix_account_task_counts()
 
-    # 3. 恢复卡住的订单
-    recovered_order_ids = recover_stuck_orders()
-
-    # 4. 重新提交待处理订单
-    await resubmit_pending_orders()
+    # 3. 未结束的订单补入任务队列（从中断处继续，不重置状态）
+    await enqueue_unfinished_orders()
+
+    # 4. 清理重试次数用尽的过期租约（其余未完成任务由任务队列 worker 自动领取）
+    from backend.job_queue import job_queue
+    expired = job_queue.recover()
+    if expired:
+        print(f"[RECOVERY] 任务队列: {expired} 个过期任务标记为失败")
+    purged = job_queue.purge_finished()
+    if purged:
+        print(f"[RECOVERY] 任务队列: 清理 {purged} 条已结束任务记录")
 
     print("\n" + "="*60)
     print("[RECOVERY] ✓ 启动恢复流程完成")
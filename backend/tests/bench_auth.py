@@ -0,0 +1,102 @@
+"""
+登录用户解析基准：每次请求查库（旧实现） vs 按用户 ID 缓存（backend.auth.get_current_user）
+使用临时 SQLite 库，在进程内通过 ASGI 直接请求一个只依赖登录用户的接口，输出 requests/sec。
+
+运行：python backend/tests/bench_auth.py [请求数] [并发数]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, ROOT)
+
+_tmp_dir = tempfile.mkdtemp(prefix="bench_auth_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp_dir, 'bench.db')}"
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException, status
+from jose import JWTError, jwt
+from sqlmodel import Session, select
+
+from backend.auth import (
+    ALGORITHM, SECRET_KEY, create_access_token, get_current_user, oauth2_scheme,
+    user_cache, user_token_claims,
+)
+from backend.models import User, create_db_and_tables, engine, get_session
+
+
+async def get_current_user_uncached(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
+    """改造前的实现：每次请求解码 token 后按用户名查库"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+    except JWTError:
+        raise credentials_exception
+    user = session.exec(select(User).where(User.username == username)).first()
+    if user is None:
+        raise credentials_exception
+    return user
+
+
+app = FastAPI()
+
+
+@app.get("/before")
+def me_before(current_user: User = Depends(get_current_user_uncached)):
+    return {"id": current_user.id, "balance": current_user.balance}
+
+
+@app.get("/after")
+def me_after(current_user: User = Depends(get_current_user)):
+    return {"id": current_user.id, "balance": current_user.balance}
+
+
+async def _run(path: str, tokens: list[str], total: int, concurrency: int) -> float:
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        counter = iter(range(total))
+
+        async def worker():
+            for i in counter:
+                resp = await client.get(path, headers={"Authorization": f"Bearer {tokens[i % len(tokens)]}"})
+                assert resp.status_code == 200, resp.text
+
+        # 预热
+        await client.get(path, headers={"Authorization": f"Bearer {tokens[0]}"})
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return total / (time.perf_counter() - started)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+
+    create_db_and_tables()
+    with Session(engine) as session:
+        # 模拟真实规模的用户表，活跃用户 50 个
+        session.add_all(User(username=f"bench_{i}", hashed_password="x") for i in range(5000))
+        session.commit()
+        users = session.exec(select(User).limit(50)).all()
+        tokens = [create_access_token(user_token_claims(u)) for u in users]
+
+    before = asyncio.run(_run("/before", tokens, total, concurrency))
+    user_cache.clear()
+    after = asyncio.run(_run("/after", tokens, total, concurrency))
+    print(f"请求数 {total}，并发 {concurrency}，用户 {len(tokens)}")
+    print(f"  每次查库  : {before:8.0f} req/s")
+    print(f"  按 ID 缓存: {after:8.0f} req/s  ({after / before:.2f}x)  {user_cache.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+登录用户缓存：TTL、LRU 上限以及 User 行修改/删除后的失效
+运行：python -m pytest backend/tests/test_auth_cache.py -q
+"""
+import os
+import sys
+import time
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, ROOT)
+
+from backend.auth import UserCache, user_cache
+from backend.models import User
+
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def _add_user(engine, username: str) -> User:
+    with Session(engine, expire_on_commit=False) as session:
+        user = User(username=username, hashed_password="x")
+        session.add(user)
+        session.commit()
+        return user
+
+
+def test_commit_invalidates_cached_user(engine):
+    user = _add_user(engine, "alice")
+    user_cache.put(user)
+    assert user_cache.get(user.id) is user
+
+    with Session(engine) as session:
+        row = session.get(User, user.id)
+        row.balance += 10
+        session.add(row)
+        session.commit()
+    assert user_cache.get(user.id) is None
+    assert user_cache.id_for("alice") is None
+
+
+def test_rollback_keeps_cached_user(engine):
+    user = _add_user(engine, "bob")
+    user_cache.put(user)
+    with Session(engine) as session:
+        row = session.get(User, user.id)
+        row.balance += 10
+        session.flush()
+        session.rollback()
+    # flush 时已失效，回滚后重新放入的缓存不会被误删
+    user_cache.put(user)
+    with Session(engine) as session:
+        session.commit()
+    assert user_cache.get(user.id) is user
+
+
+def test_delete_invalidates_cached_user(engine):
+    user = _add_user(engine, "carol")
+    user_cache.put(user)
+    with Session(engine) as session:
+        session.delete(session.get(User, user.id))
+        session.commit()
+    assert user_cache.get(user.id) is None
+
+
+def test_ttl_and_capacity():
+    cache = UserCache(ttl=0.05, max_entries=2)
+    users = [User(id=i, username=f"u{i}", hashed_password="x") for i in range(1, 4)]
+    for user in users:
+        cache.put(user)
+    assert cache.get(1) is None and cache.id_for("u1") is None  # LRU 淘汰
+    assert cache.get(3) is users[2]
+    time.sleep(0.06)
+    assert cache.get(3) is None
+
+    disabled = UserCache(ttl=0)
+    disabled.put(users[0])
+    assert disabled.get(1) is None
@@ -0,0 +1,45 @@
+"""
+验证码签发配额：单 IP 上限与全站存量上限，被拒绝的请求不占用任何一方的名额
+运行：python -m pytest backend/tests/test_captcha_quota.py -q
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, ROOT)
+
+from backend import security
+from backend.shared_state import LocalBackend, SQLiteBackend
+
+
+@pytest.fixture(params=["local", "sqlite"])
+def state(request, tmp_path, monkeypatch):
+    if request.param == "local":
+        backend = LocalBackend()
+    else:
+        backend = SQLiteBackend(str(tmp_path / "shared_state.db"))
+    monkeypatch.setattr(security, "shared_state", backend)
+    monkeypatch.setattr(security, "CAPTCHA_PER_IP_LIMIT", 3)
+    monkeypatch.setattr(security, "CAPTCHA_MAX_ACTIVE", 5)
+    return backend
+
+
+def test_per_ip_limit_does_not_consume_global(state):
+    assert all(security.check_captcha_quota("1.1.1.1") for _ in range(3))
+    # 单 IP 超限的请求不计入全站存量
+    assert not any(security.check_captcha_quota("1.1.1.1") for _ in range(10))
+    assert state.window_remaining("captcha-issued:*", 5, security.CAPTCHA_EXPIRE_SECONDS) == 2
+    assert security.check_captcha_quota("2.2.2.2")
+    assert security.check_captcha_quota("2.2.2.2")
+
+
+def test_global_limit_returns_per_ip_slot(state):
+    for ip in ("1.1.1.1", "1.1.1.1", "2.2.2.2", "2.2.2.2", "3.3.3.3"):
+        assert security.check_captcha_quota(ip)
+    assert not security.check_captcha_quota("4.4.4.4")
+    assert not security.check_captcha_quota("3.3.3.3")
+    # 全站拒绝时归还单 IP 名额
+    assert state.window_remaining("captcha-issued:4.4.4.4", 3, security.CAPTCHA_EXPIRE_SECONDS) == 3
+    assert state.window_remaining("captcha-issued:3.3.3.3", 3, security.CAPTCHA_EXPIRE_SECONDS) == 2
@@ -0,0 +1,125 @@
+"""
+热点查询的 EXPLAIN QUERY PLAN 回归测试
+每条查询都断言走了预期的索引、没有整表扫描；新增热点查询时在 HOT_QUERIES 里补一条。
+运行：python -m pytest backend/tests/test_query_plans.py -q
+"""
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import desc, func, text
+from sqlmodel import SQLModel, create_engine, select
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, ROOT)
+
+from backend.migrations import run_migrations
+from backend.models import GptimageOrder, JimengOrder, Transaction, User, VideoOrder
+
+NOW = datetime(2026, 1, 1)
+
+# (说明, 查询, 期望使用的索引)
+HOT_QUERIES = [
+    # ---- VideoOrder ----
+    ("用户订单分页 /api/orders",
+     select(VideoOrder).where(VideoOrder.user_id == 1)
+     .order_by(VideoOrder.created_at.desc(), VideoOrder.id.desc()).limit(20),
+     "ix_videoorder_user_created"),
+    ("全量扫描进行中订单 poll_all_pending_orders",
+     select(VideoOrder).where(VideoOrder.status.in_(["generating", "processing"])),
+     "ix_videoorder_status_created"),
+    ("automation_v2 生成中订单",
+     select(VideoOrder).where(VideoOrder.status == "generating"),
+     "ix_videoorder_status_created"),
+    ("后台统计：已完成订单数",
+     select(func.count(VideoOrder.id)).where(VideoOrder.status == "completed"),
+     "ix_videoorder_status_created"),
+    ("后台统计：今日订单数",
+     select(func.count(VideoOrder.id)).where(VideoOrder.created_at >= NOW),
+     "ix_videoorder_created"),
+    ("后台订单列表按状态筛选",
+     select(VideoOrder).where(VideoOrder.status == "failed").order_by(VideoOrder.created_at.desc()),
+     "ix_videoorder_status_created"),
+    ("清理 30 天前已完成订单",
+     select(VideoOrder).where(VideoOrder.created_at < NOW - timedelta(days=30), VideoOrder.status == "completed"),
+     "ix_videoorder_status_created"),
+    ("耗时统计种子数据",
+     select(VideoOrder.model_name, VideoOrder.resolution, VideoOrder.duration,
+            VideoOrder.created_at, VideoOrder.updated_at)
+     .where(VideoOrder.status == "completed").order_by(VideoOrder.id.desc()).limit(2000),
+     "ix_videoorder_status_created"),
+    # ---- Transaction ----
+    ("用户流水 /api/transactions",
+     select(Transaction).where(Transaction.user_id == 1).order_by(desc(Transaction.created_at)).limit(50),
+     "ix_transaction_user_created"),
+    ("后台统计：充值总额",
+     select(func.sum(Transaction.amount)).where(Transaction.type == "recharge"),
+     "ix_transaction_type_created"),
+    ("后台统计：今日充值",
+     select(func.sum(Transaction.amount)).where(Transaction.type == "recharge").where(Transaction.created_at >= NOW),
+     "ix_transaction_type_created"),
+    # ---- JimengOrder ----
+    ("启动恢复：未结束的即梦订单",
+     select(JimengOrder.id).where(JimengOrder.status.in_(["pending", "processing", "generating"]))
+     .order_by(JimengOrder.created_at),
+     "ix_jimengorder_status_created"),
+    ("启动恢复：账号进行中订单数",
+     select(JimengOrder.account_id, func.count(JimengOrder.id))
+     .where(JimengOrder.status.in_(["processing", "generating"]), JimengOrder.account_id.is_not(None))
+     .group_by(JimengOrder.account_id),
+     "ix_jimengorder_status_created"),
+    ("用户即梦订单列表",
+     select(JimengOrder).where(JimengOrder.user_id == 1).order_by(JimengOrder.created_at.desc()),
+     "ix_jimengorder_user_created"),
+    # ---- GptimageOrder ----
+    ("用户 GPT-Image 订单列表",
+     select(GptimageOrder).where(GptimageOrder.user_id == 1).order_by(GptimageOrder.created_at.desc()).limit(50),
+     "ix_gptimageorder_user_created"),
+    ("调度器恢复未提交订单",
+     select(GptimageOrder.id, GptimageOrder.user_id).where(
+         GptimageOrder.status.in_(("pending", "processing")), GptimageOrder.task_id.is_(None)
+     ).order_by(GptimageOrder.created_at, GptimageOrder.id),
+     "ix_gptimageorder_status_created"),
+    # ---- User ----
+    ("邀请记录",
+     select(User).where(User.invited_by == 1).order_by(User.created_at.desc()),
+     "ix_user_invited_created"),
+]
+
+
+@pytest.fixture(scope="module")
+def engine():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    return engine
+
+
+def _plan(engine, statement) -> list[str]:
+    sql = str(statement.compile(engine, compile_kwargs={"literal_binds": True}))
+    with engine.connect() as conn:
+        return [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"))]
+
+
+@pytest.mark.parametrize("name,statement,index", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_index(engine, name, statement, index):
+    plan = _plan(engine, statement)
+    detail = "\n".join(plan)
+    assert any(index in line for line in plan), f"{name} 未使用 {index}:\n{detail}"
+    # SCAN <表>（不带 USING INDEX）即整表扫描
+    full_scans = [line for line in plan if line.startswith("SCAN ") and "INDEX" not in line]
+    assert not full_scans, f"{name} 出现整表扫描:\n{detail}"
+
+
+def test_migrations_create_declared_indexes(tmp_path):
+    """老库（只有表、没有新索引）执行迁移后，索引与模型声明一致"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    SQLModel.metadata.create_all(engine)
+    declared = {q[2] for q in HOT_QUERIES}
+    with engine.begin() as conn:
+        for name in declared:
+            conn.execute(text(f"DROP INDEX {name}"))
+    run_migrations(engine)
+    with engine.connect() as conn:
+        existing = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+    assert declared <= existing
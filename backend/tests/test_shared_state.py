@@ -0,0 +1,135 @@
+"""
+共享状态后端（local / sqlite）：过期、一次性写入、滑动窗口计数、互斥锁，以及封禁 key 不被 LRU 淘汰
+运行：python -m pytest backend/tests/test_shared_state.py -q
+"""
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(__file__), '..', '..')
+sys.path.insert(0, ROOT)
+
+from backend.shared_state import LocalBackend, SQLiteBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(time, "time", clock)
+    return clock
+
+
+@pytest.fixture(params=["local", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "local":
+        return LocalBackend(max_keys=100)
+    return SQLiteBackend(str(tmp_path / "shared_state.db"))
+
+
+def test_ttl_expiry(backend, clock):
+    backend.set("captcha:a", "1", ttl=10)
+    backend.incr("counter", 1, ttl=10)
+    assert backend.get("captcha:a") == "1"
+    clock.now += 11
+    assert backend.get("captcha:a") is None
+    assert backend.incr("counter", 1, ttl=10) == 1
+    assert backend.pop("captcha:a") is None
+
+
+def test_set_if_absent(backend, clock):
+    assert backend.set_if_absent("k", "first", ttl=5)
+    assert not backend.set_if_absent("k", "second", ttl=5)
+    assert backend.get("k") == "first"
+    clock.now += 6
+    assert backend.set_if_absent("k", "third", ttl=5)
+    assert backend.get("k") == "third"
+
+
+def test_hit_window_and_remaining(backend, clock):
+    clock.now = 6000.0   # 桶边界，上一桶为空
+    assert [backend.hit_window("rl:x", 3, 60) for _ in range(4)] == [True, True, True, False]
+    assert backend.window_remaining("rl:x", 3, 60) == 0
+    assert backend.window_remaining("rl:other", 3, 60) == 3
+    # 下一桶过半时上一桶按一半计入：3 × 0.5 = 1.5，还剩 1 次
+    clock.now += 90
+    assert backend.window_remaining("rl:x", 3, 60) == 1
+    assert backend.hit_window("rl:x", 3, 60)
+    assert backend.window_remaining("rl:x", 3, 60) == 0
+    # 完整滑出两个窗口后计数清零
+    clock.now += 120
+    assert backend.window_remaining("rl:x", 3, 60) == 3
+
+
+def test_lock(backend):
+    with backend.lock("pay", ttl=5, timeout=1) as acquired:
+        assert acquired
+        result = []
+        t = threading.Thread(target=lambda: result.append(backend.acquire_lock("pay", ttl=5, timeout=0.1)))
+        t.start()
+        t.join()
+        assert result == [None]
+    token = backend.acquire_lock("pay", ttl=5, timeout=0.1)
+    assert token is not None
+    # 只有持有者的令牌能释放
+    backend.release_lock("pay", "someone-else")
+    assert backend.acquire_lock("pay", ttl=5, timeout=0.1) is None
+    backend.release_lock("pay", token)
+    assert backend.acquire_lock("pay", ttl=5, timeout=0.1) is not None
+
+
+def test_lock_expires_when_holder_dies(backend, clock):
+    assert backend.acquire_lock("pay", ttl=5, timeout=0) is not None
+    assert backend.acquire_lock("pay", ttl=5, timeout=0) is None
+    clock.now += 6
+    assert backend.acquire_lock("pay", ttl=5, timeout=0) is not None
+
+
+def test_local_lru_never_evicts_security_keys(clock):
+    backend = LocalBackend(max_keys=10)
+    backend.set("ban:1.2.3.4", "{}", ttl=3600)
+    backend.incr("fail:1.2.3.4", 3, ttl=3600)
+    for i in range(100):
+        backend.set(f"captcha:{i}", "x", ttl=300)
+    assert backend.get("captcha:0") is None
+    assert backend.get("ban:1.2.3.4") == "{}"
+    assert backend.get("fail:1.2.3.4") == "3"
+    assert backend.stats()["keys"] == 10
+    # 安全 key 仍按 TTL 过期
+    clock.now += 3601
+    backend.set("captcha:new", "x", ttl=300)
+    assert backend.get("ban:1.2.3.4") is None
+    assert backend.stats()["pinned_keys"] == 0
+
+
+def test_unhit_window_returns_slot(backend, clock):
+    clock.now = 6000.0
+    assert backend.hit_window("rl:y", 1, 60, clock.now)
+    backend.unhit_window("rl:y", 60, clock.now)
+    assert backend.window_remaining("rl:y", 1, 60) == 1
+    assert backend.hit_window("rl:y", 1, 60)
+
+
+def test_limiter_shared_reject_does_not_leak_quota(tmp_path, monkeypatch, clock):
+    from backend import novart_limiter
+
+    backend = SQLiteBackend(str(tmp_path / "shared_state.db"))
+    monkeypatch.setattr(novart_limiter, "shared_state", backend)
+    clock.now = 6000.0
+    limiter = novart_limiter.WindowRateLimiter([(3, 1), (2, 60)], shared_key="novart-test")
+    assert limiter._take_shared() and limiter._take_shared()
+    # 每秒窗口通过、每分钟窗口拒绝：每秒窗口占的名额必须归还
+    assert not limiter._take_shared()
+    assert not limiter._take_shared()
+    assert backend.window_remaining("novart-test:1", 3, 1) == 1
+    assert backend.window_remaining("novart-test:60", 2, 60) == 0
@@ -0,0 +1,149 @@
+"""
+视频流式下载
+分块写入 .part 临时文件（aiofiles，不阻塞事件循环），校验长度后原子重命名；
+失败时用 Range 从已下载的位置续传；全局限制同时进行的下载数，避免大文件挤占内存和带宽。
+"""
+import asyncio
+import logging
+import os
+import re
+from typing import Optional
+
+import aiofiles
+import httpx
+
+logger = logging.getLogger(__name__)
+
+DOWNLOAD_CONCURRENCY = int(os.getenv("VIDEO_DOWNLOAD_CONCURRENCY", "3"))
+CHUNK_SIZE = 256 * 1024
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF = 2          # 重试等待（秒）：2, 4, 8
+TIMEOUT = httpx.Timeout(30.0, read=60.0)
+
+_CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+    pass
+
+
+class VideoDownloader:
+    """共享下载器：一个长连接客户端 + 并发上限"""
+
+    def __init__(self, concurrency: int = DOWNLOAD_CONCURRENCY):
+        self.concurrency = max(1, concurrency)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+        self._active = 0
+        self._waiting = 0
+        self._completed = 0
+        self._failed = 0
+        self._resumed = 0
+        self._bytes = 0
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                timeout=TIMEOUT,
+                follow_redirects=True,
+                # 要求原始字节，保证 Content-Length 与写入的字节数可比
+                headers={"Accept-Encoding": "identity"},
+            )
+        return self._client
+
+    async def download(self, url: str, dest_path: str) -> int:
+        """下载 url 到 dest_path，返回文件字节数；失败抛出 DownloadError"""
+        part_path = dest_path + ".part"
+        self._waiting += 1
+        async with self._semaphore:
+            self._waiting -= 1
+            self._active += 1
+            try:
+                last_error = None
+                for attempt in range(1, MAX_ATTEMPTS + 1):
+                    try:
+                        size = await self._fetch(url, dest_path, part_path)
+                        self._completed += 1
+                        return size
+                    except (httpx.HTTPError, DownloadError, OSError) as e:
+                        last_error = e
+                        if attempt < MAX_ATTEMPTS:
+                            logger.warning(f"[download] 第{attempt}次下载中断，将续传: {e}")
+                            await asyncio.sleep(RETRY_BACKOFF * 2 ** (attempt - 1))
+                self._failed += 1
+                _remove_quietly(part_path)
+                raise DownloadError(f"下载失败（已重试{MAX_ATTEMPTS}次）: {last_error}")
+            finally:
+                self._active -= 1
+
+    async def _fetch(self, url: str, dest_path: str, part_path: str) -> int:
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        async with self._get_client().stream("GET", url, headers=headers) as r:
+            if r.status_code == 416 and offset:
+                # 临时文件与远端不匹配（如远端文件变了），丢弃后从头下载
+                _remove_quietly(part_path)
+                raise DownloadError("Range 不可满足，重新下载")
+            r.raise_for_status()
+
+            expected_total = None
+            if offset and r.status_code == 206:
+                match = _CONTENT_RANGE_RE.match(r.headers.get("content-range", ""))
+                if not match or int(match.group(1)) != offset:
+                    _remove_quietly(part_path)
+                    raise DownloadError(f"Content-Range 不匹配: {r.headers.get('content-range')}")
+                if match.group(3) != "*":
+                    expected_total = int(match.group(3))
+                mode = "ab"
+                self._resumed += 1
+            else:
+                # 首次下载或服务器不支持 Range（返回 200 全量）
+                offset = 0
+                mode = "wb"
+                if "content-length" in r.headers:
+                    expected_total = int(r.headers["content-length"])
+
+            written = 0
+            async with aiofiles.open(part_path, mode) as f:
+                async for chunk in r.aiter_raw(CHUNK_SIZE):
+                    await f.write(chunk)
+                    written += len(chunk)
+            self._bytes += written
+
+        size = offset + written
+        if expected_total is not None and size != expected_total:
+            # 保留临时文件，下一次尝试从 size 处续传
+            raise DownloadError(f"长度不符: 已下载 {size} / 预期 {expected_total}")
+        if size == 0:
+            _remove_quietly(part_path)
+            raise DownloadError("响应为空")
+        os.replace(part_path, dest_path)
+        return size
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "active": self._active,
+            "waiting": self._waiting,
+            "completed": self._completed,
+            "failed": self._failed,
+            "resumed": self._resumed,
+            "bytes": self._bytes,
+        }
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# 全局单例
+video_downloader = VideoDownloader()
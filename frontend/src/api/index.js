@@ -267,11 +267,31 @@ export const createOrder = async (prompt, model_name, firstFrameImage, lastFrame
     return data;
 };
 
-export const getOrders = async () => {
-    const response = await api.get('/orders')
+// 不传 params 返回全部订单；传 limit/cursor/since 时返回 { items, next_cursor, server_time }
+export const getOrders = async (params) => {
+    const response = await api.get('/orders', { params })
     return response.data
 }
 
+export const getOrder = async (orderId) => {
+    const response = await api.get(`/orders/${orderId}`)
+    return response.data
+}
+
+// 订单状态事件流（SSE）：返回 EventSource，调用方负责 close()
+// EventSource 无法携带 Authorization 头，token 走 query 参数
+export const subscribeOrderEvents = (onEvent) => {
+    const token = localStorage.getItem('token')
+    if (!token || typeof EventSource === 'undefined') return null
+    const source = new EventSource(`${getBaseURL()}/orders/events?token=${encodeURIComponent(token)}`)
+    source.addEventListener('order', (e) => {
+        try {
+            onEvent(JSON.parse(e.data))
+        } catch (err) { /* ignore */ }
+    })
+    return source
+}
+
 export const getAvailableModels = async () => {
     const response = await api.get('/models')
     return response.data
@@ -0,0 +1,62 @@
+'use strict';
+// ================================================================
+// 可灵签名核心 — 加载 SDK 并导出 sign()，供 sign_cli.js / sign_server.js 共用
+// ================================================================
+
+global.window = global;
+global.document = {
+  scripts: { length: 3 },
+  createElement: () => ({})
+};
+Object.defineProperty(global, 'navigator', {
+  value: {
+    userAgent: 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/146.0.0.0 Safari/537.36',
+    sendBeacon: () => {}
+  },
+  writable: true, configurable: true
+});
+global.performance = { now: () => Date.now() };
+global.localStorage = { getItem: () => null, setItem: () => {} };
+
+const fs = require('fs');
+const vm = require('vm');
+const path = require('path');
+
+const sdkSrc = fs.readFileSync(path.join(__dirname, 'sdk_block.js'), 'utf8');
+const ctx = vm.createContext(global);
+vm.runInContext(sdkSrc, ctx);
+
+const Ga = ctx.Ga;
+if (!Ga) {
+  process.stderr.write('ERROR: Ga not found\n');
+  process.exit(1);
+}
+
+const DEFAULT_PROJECT = { appKey: '8M3oUipD76', radarId: '91e99da176' };
+const API_BASE = 'https://api-app-cn.klingai.com';
+
+function sign(url, query = {}, form = null, requestBody = null, projectInfo = DEFAULT_PROJECT) {
+  return new Promise((resolve, reject) => {
+    const input = {
+      url,
+      query: { caver: '2', ...query },
+      form: form || null,
+      requestBody: requestBody || {},
+      projectInfo: { ...projectInfo, debug: false }
+    };
+    Ga.call('$encode', [input, {
+      suc: (signResult, signInput) => resolve({ signResult, signInput }),
+      err: (e) => reject(e)
+    }]);
+  });
+}
+
+// 签名并拼出完整 URL（只含 __NS_hxfalcon 和 caver，额外 query 由调用方追加）
+async function signRequest({ url, query = {}, form = null, requestBody = null, projectInfo = DEFAULT_PROJECT }) {
+  const { signResult, signInput } = await sign(url, query, form, requestBody, projectInfo);
+  const sep = url.includes('?') ? '&' : '?';
+  const signedUrl = `${API_BASE}${url}${sep}__NS_hxfalcon=${encodeURIComponent(signResult)}&caver=2`;
+  return { signResult, signInput, signedUrl };
+}
+
+module.exports = { sign, signRequest, DEFAULT_PROJECT, API_BASE };
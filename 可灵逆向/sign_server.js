@@ -0,0 +1,52 @@
+'use strict';
+// ================================================================
+// 可灵签名常驻进程 — stdin 每行一个 JSON 请求，stdout 每行一个 JSON 响应（NDJSON）
+// 启动完成输出: { ready: true, pid }
+// 请求: { id, url, query, form, requestBody, projectInfo } 或 { id, op: 'ping' }
+// 响应: { id, ok: true, signResult, signInput, signedUrl } / { id, ok: false, error }
+// 请求可并发（按 id 对应响应），stdout 只用于协议输出
+// ================================================================
+
+// SDK 的日志改走 stderr，避免污染协议输出
+const toStderr = (...args) => process.stderr.write(args.map(String).join(' ') + '\n');
+console.log = console.info = console.warn = console.debug = toStderr;
+
+const readline = require('readline');
+const { signRequest } = require('./sign_core');
+
+let served = 0;
+
+function reply(msg) {
+  process.stdout.write(JSON.stringify(msg) + '\n');
+}
+
+async function handle(line) {
+  let req;
+  try {
+    req = JSON.parse(line);
+  } catch (e) {
+    reply({ id: null, ok: false, error: 'invalid JSON input' });
+    return;
+  }
+  const id = req.id;
+  if (req.op === 'ping') {
+    reply({ id, ok: true, pong: true, served, rss: process.memoryUsage().rss });
+    return;
+  }
+  try {
+    const result = await signRequest(req);
+    served++;
+    reply({ id, ok: true, ...result });
+  } catch (e) {
+    reply({ id, ok: false, error: String(e) });
+  }
+}
+
+const rl = readline.createInterface({ input: process.stdin, crlfDelay: Infinity });
+rl.on('line', (line) => {
+  if (line.trim()) handle(line);
+});
+// 父进程关闭 stdin 时退出
+rl.on('close', () => process.exit(0));
+
+reply({ ready: true, pid: process.pid });